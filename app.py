@@ -1,19 +1,38 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import re
 import json
 import time
 import csv
+import bisect
+import hashlib
+import itertools
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import unicodedata
+import uuid
+import weakref
+import zipfile
+import zlib
+from abc import ABC, abstractmethod
 from io import StringIO, BytesIO
 from typing import List, Dict
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
+from collections import deque
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # Versionamento semântico (MAJOR.MINOR.PATCH):
 # MAJOR = mudança grande no modelo de análise ou comportamento (ex.: novo prompt de transbordo)
 # MINOR = nova funcionalidade compatível (ex.: modo Analista de Categorias, novas colunas, nova taxonomia de motivos)
 # PATCH = correções, ajustes de UI, documentação, scripts
-# Histórico: 1.0 inicial → 1.x critérios/colunas/categorias → 2.0 prompt produção (transbordo) → 2.1 prompt com taxonomia causal de motivo_transbordo
-APP_VERSION = "2.1.0"
+# Histórico: 1.0 inicial → 1.x critérios/colunas/categorias → 2.0 prompt produção (transbordo) → 2.1 prompt com taxonomia causal de motivo_transbordo → 2.2 segmentação de conversas longas (map-reduce) → 2.3 respostas em streaming com parser JSON incremental → 2.4 saída estruturada com schema estrito → 2.5 modo cascata → 2.6 erros tipados, circuit breaker e fila de reprocessamento → 2.7 exportação por retailer em passada única (Excel/ZIP) → 2.8 armazenamento único de conversas na sessão → 2.9 tabela de resultados paginada → 2.10 índice de texto completo das conversas → 2.11 modo delta com histórico de vereditos → 2.12 análise em job de segundo plano (progresso, cancelamento, sem teto de 1000) → 2.13 instrumentação por requisição (latência, tokens, tentativas, custo) → 2.14 métricas Prometheus opcionais e log estruturado por execução → 2.15 triagem com classificador destilado dos vereditos do LLM → 2.16 parser estruturado de mensagens (falante, data/hora e offsets) compartilhado por regras, prompt e exportação → 2.17 detector de repetição do bot (shingles + MinHash/LSH) → 2.18 métricas de tempo do atendimento na carga do arquivo → 2.19 ordem de análise por risco (regras locais) → 2.20 amostragem estratificada com estimativas e intervalo de confiança → 2.21 provedores de LLM (OpenAI, endpoint compatível, mock local) → 2.22 timeout por requisição e hedge de requisições lentas
+APP_VERSION = "2.22.0"
 
 
 # Configuração da página
@@ -54,54 +73,89 @@ st.markdown(
     </style>
     <script>
         // Ocultar elementos que contenham "created by" ou "hugo costa"
-        function ocultarElementosCriador() {
-            const textosParaOcultar = ['created by', 'Created by', 'CREATED BY', 'hugo costa', 'Hugo Costa', 'HUGO COSTA'];
+        // Só os nós adicionados/alterados são inspecionados (MutationObserver), em vez de varrer o DOM inteiro a cada segundo
+        (function () {
+            const textosParaOcultar = ['created by', 'hugo costa'];
+            // Áreas de conteúdo do app que nunca contêm o crédito do criador (tabelas de resultados podem ter milhares de nós)
+            const areasIgnoradas = '[data-testid="stDataFrame"], [data-testid="stTable"], [data-testid="stExpander"], [data-testid="stCode"]';
             
-            // Função recursiva para verificar todos os elementos
-            function verificarElemento(elemento) {
-                if (!elemento) return;
-                
-                const texto = elemento.textContent || elemento.innerText || '';
+            // Custo acumulado das inspeções (consultar window.__custoOcultarCriador no console do navegador ou com medir_ocultar_criador.py)
+            const custo = window.__custoOcultarCriador = {execucoes: 0, nosTexto: 0, totalMs: 0, maxMs: 0, ultimoMs: 0};
+            
+            function contemTextoProcurado(texto) {
                 const textoLower = texto.toLowerCase();
-                
-                // Verificar se o elemento ou seus filhos contêm os textos
-                for (const textoProcurado of textosParaOcultar) {
-                    if (textoLower.includes(textoProcurado.toLowerCase())) {
-                        elemento.style.display = 'none';
-                        elemento.style.visibility = 'hidden';
-                        return;
-                    }
+                return textosParaOcultar.some(textoProcurado => textoLower.includes(textoProcurado));
+            }
+            
+            // Oculta o elemento que contém diretamente o texto (não os ancestrais)
+            function verificarNoTexto(noTexto) {
+                custo.nosTexto++;
+                const elemento = noTexto.parentElement;
+                if (elemento && noTexto.nodeValue && contemTextoProcurado(noTexto.nodeValue)) {
+                    elemento.style.display = 'none';
+                    elemento.style.visibility = 'hidden';
                 }
-                
-                // Verificar filhos
-                if (elemento.children) {
-                    for (const filho of elemento.children) {
-                        verificarElemento(filho);
-                    }
+            }
+            
+            function dentroDeAreaIgnorada(no) {
+                const elemento = no.nodeType === Node.ELEMENT_NODE ? no : no.parentElement;
+                return !elemento || elemento.closest(areasIgnoradas) !== null;
+            }
+            
+            // Nós de texto fora das áreas ignoradas: elas são descartadas inteiras (FILTER_REJECT pula a subárvore)
+            const filtroAreas = {
+                acceptNode(no) {
+                    if (no.nodeType === Node.TEXT_NODE) return NodeFilter.FILTER_ACCEPT;
+                    return no.matches(areasIgnoradas) ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_SKIP;
                 }
+            };
+            
+            // Percorre apenas os nós de texto da subárvore adicionada (a varredura inicial passa por aqui com document.body)
+            function verificarSubarvore(raiz) {
+                if (dentroDeAreaIgnorada(raiz)) return;
+                if (raiz.nodeType === Node.TEXT_NODE) {
+                    verificarNoTexto(raiz);
+                    return;
+                }
+                if (raiz.nodeType !== Node.ELEMENT_NODE) return;
+                const percurso = document.createTreeWalker(raiz, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, filtroAreas);
+                while (percurso.nextNode()) {
+                    verificarNoTexto(percurso.currentNode);
+                }
+            }
+            
+            function medir(inspecao) {
+                const inicio = performance.now();
+                inspecao();
+                const duracao = performance.now() - inicio;
+                custo.execucoes++;
+                custo.totalMs += duracao;
+                custo.ultimoMs = duracao;
+                custo.maxMs = Math.max(custo.maxMs, duracao);
             }
             
-            // Executar quando a página carregar e periodicamente
-            setTimeout(() => {
-                document.querySelectorAll('*').forEach(el => {
-                    verificarElemento(el);
-                });
-            }, 100);
+            function iniciar() {
+                // Varredura única do que já está na página
+                medir(() => verificarSubarvore(document.body));
+                
+                new MutationObserver(mutacoes => medir(() => {
+                    for (const mutacao of mutacoes) {
+                        if (mutacao.type === 'characterData') {
+                            if (!dentroDeAreaIgnorada(mutacao.target)) verificarNoTexto(mutacao.target);
+                        } else {
+                            mutacao.addedNodes.forEach(verificarSubarvore);
+                        }
+                    }
+                })).observe(document.body, {childList: true, subtree: true, characterData: true});
+            }
             
-            // Executar periodicamente para pegar elementos carregados dinamicamente
-            setInterval(() => {
-                document.querySelectorAll('*').forEach(el => {
-                    verificarElemento(el);
-                });
-            }, 1000);
-        }
-        
-        // Executar quando o DOM estiver pronto
-        if (document.readyState === 'loading') {
-            document.addEventListener('DOMContentLoaded', ocultarElementosCriador);
-        } else {
-            ocultarElementosCriador();
-        }
+            // Executar quando o DOM estiver pronto
+            if (document.readyState === 'loading') {
+                document.addEventListener('DOMContentLoaded', iniciar);
+            } else {
+                iniciar();
+            }
+        })();
     </script>
     """,
     unsafe_allow_html=True
@@ -116,29 +170,157 @@ st.markdown("---")
 st.sidebar.header("⚙️ Configurações")
 st.sidebar.caption(f"Versão **{APP_VERSION}**")
 
-# Configurações para OpenAI API (obrigatório)
+# Configurações do provedor de LLM (obrigatório)
 st.sidebar.markdown("---")
-st.sidebar.subheader("🔑 Configurações OpenAI")
+st.sidebar.subheader("🔑 Configurações do LLM")
 
-# Importar openai
+# Importar openai (o SDK também fala com endpoints compatíveis e com o mock local)
 try:
     import openai
 except ImportError:
     st.sidebar.error("❌ Biblioteca openai não instalada. Execute: pip install openai")
     st.stop()
 
-api_key = st.sidebar.text_input(
-    "OpenAI API Key",
-    value="",
-    type="password",
-    help="Insira sua chave da API do OpenAI"
-)
+# Provedores de LLM: API da OpenAI, servidor compatível (vLLM, Ollama, LM Studio) ou mock local sem rede
+PROVEDORES_LLM = ["OpenAI", "Endpoint compatível com OpenAI", "Mock local (offline)"]
+MODELOS_OPENAI = ["gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"]
+
+# Semente do mock local (mesma sequência de latências e falhas injetadas a cada execução do servidor)
+SEMENTE_MOCK_LOCAL = 42
+
+# Tempo sem rerun nem requisição depois do qual o mock local de uma sessão é desligado
+TTL_MOCK_OCIOSO_S = 30 * 60
+
+# Função para identificar a sessão do navegador (dona dos jobs e do mock local que criou)
+def id_sessao() -> str:
+    if 'sessao_id' not in st.session_state:
+        st.session_state['sessao_id'] = uuid.uuid4().hex
+    return st.session_state['sessao_id']
 
-model_name = st.sidebar.selectbox(
-    "Modelo OpenAI",
-    options=["gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"],
+# Registro dos mocks locais, um por sessão (os sliders de uma sessão não mexem no mock das outras)
+@st.cache_resource
+def registro_mocks_locais() -> Dict:
+    return {"trava": threading.Lock(), "mocks": {}}
+
+# Função para obter o mock local da sessão, desligando os que ficaram ociosos além do TTL
+def obter_mock_local(sessao_id: str, ttl_s: float = TTL_MOCK_OCIOSO_S) -> tuple:
+    """Retorna (configuracao, base_url) do mock da sessão; requisições de um job em andamento contam como uso"""
+    from servidor_mock_openai import ConfiguracaoMock, iniciar_servidor
+    registro = registro_mocks_locais()
+    agora = time.time()
+    with registro["trava"]:
+        for chave, mock in list(registro["mocks"].items()):
+            requisicoes = mock["configuracao"].contadores["requisicoes"]
+            if requisicoes != mock["requisicoes_vistas"]:
+                mock["requisicoes_vistas"], mock["ultimo_uso"] = requisicoes, agora
+            elif chave != sessao_id and agora - mock["ultimo_uso"] > ttl_s:
+                mock["servidor"].shutdown()
+                mock["servidor"].server_close()
+                del registro["mocks"][chave]
+        if sessao_id not in registro["mocks"]:
+            configuracao = ConfiguracaoMock(semente=SEMENTE_MOCK_LOCAL)
+            servidor, base_url = iniciar_servidor(configuracao, "127.0.0.1")
+            registro["mocks"][sessao_id] = {
+                "configuracao": configuracao, "servidor": servidor, "base_url": base_url,
+                "requisicoes_vistas": 0, "ultimo_uso": agora
+            }
+        mock = registro["mocks"][sessao_id]
+        mock["ultimo_uso"] = agora
+    return mock["configuracao"], mock["base_url"]
+
+provedor_llm = st.sidebar.selectbox(
+    "Provedor de LLM",
+    options=PROVEDORES_LLM,
     index=0,
-    help="Selecione o modelo do OpenAI (gpt-4o-mini é mais rápido e econômico)"
+    help="Endpoint compatível: qualquer servidor com a API de chat completions da OpenAI. Mock local: vereditos sintéticos, sem custo nem rede, para testar o pipeline."
+)
+
+base_url_llm = None
+if provedor_llm == "Endpoint compatível com OpenAI":
+    base_url_llm = st.sidebar.text_input(
+        "Base URL",
+        value=os.environ.get("OPENAI_BASE_URL", "http://localhost:8000/v1"),
+        help="Ex.: http://localhost:8000/v1 (vLLM), http://localhost:11434/v1 (Ollama)"
+    )
+    # Servidores locais costumam ignorar a chave, mas o SDK exige uma
+    api_key = st.sidebar.text_input(
+        "API Key (opcional)",
+        value="",
+        type="password",
+        help="Deixe vazio se o servidor não exigir autenticação"
+    ) or "sk-local"
+    model_name = st.sidebar.text_input(
+        "Modelo",
+        value="gpt-4o-mini",
+        help="Nome do modelo como publicado pelo servidor"
+    ).strip() or None
+elif provedor_llm == "Mock local (offline)":
+    configuracao_mock, base_url_llm = obter_mock_local(id_sessao())
+    configuracao_mock.latencia_ms = st.sidebar.slider(
+        "Latência do mock (ms)", min_value=0, max_value=5000, value=300, step=50,
+        help="Latência média de cada resposta (com variação de ±20%)"
+    )
+    configuracao_mock.jitter_ms = configuracao_mock.latencia_ms * 0.2
+    configuracao_mock.taxa_429 = st.sidebar.slider(
+        "Taxa de erros 429", min_value=0.0, max_value=0.5, value=0.0, step=0.01,
+        help="Fração das requisições respondidas com rate limit (Retry-After de 1 s)"
+    )
+    configuracao_mock.taxa_json_invalido = st.sidebar.slider(
+        "Taxa de JSON malformado", min_value=0.0, max_value=0.5, value=0.0, step=0.01,
+        help="Fração das respostas truncadas, com tipo errado ou sem JSON"
+    )
+    api_key = "sk-mock"
+    model_name = st.sidebar.selectbox(
+        "Modelo (simulado)",
+        options=MODELOS_OPENAI,
+        index=0,
+        help="O mock aceita qualquer modelo; o nome só afeta o formato de resposta pedido e as estimativas de custo"
+    )
+else:
+    api_key = st.sidebar.text_input(
+        "OpenAI API Key",
+        value="",
+        type="password",
+        help="Insira sua chave da API do OpenAI"
+    )
+    model_name = st.sidebar.selectbox(
+        "Modelo OpenAI",
+        options=MODELOS_OPENAI,
+        index=0,
+        help="Selecione o modelo do OpenAI (gpt-4o-mini é mais rápido e econômico)"
+    )
+
+# Configuração do modo cascata (modelo econômico primeiro, escalonamento para modelo forte)
+modo_cascata = st.sidebar.checkbox(
+    "Modo cascata",
+    value=False,
+    help="Analisa todas as conversas com o modelo selecionado acima e reanalisa no modelo forte apenas as conversas com baixa confiança ou com necessidade de transbordo."
+)
+
+if provedor_llm == "Endpoint compatível com OpenAI":
+    modelo_forte = st.sidebar.text_input(
+        "Modelo forte (escalonamento)",
+        value=model_name or "",
+        disabled=not modo_cascata,
+        help="Modelo do mesmo servidor usado para reanalisar as conversas escalonadas no modo cascata"
+    ).strip() or None
+else:
+    modelo_forte = st.sidebar.selectbox(
+        "Modelo forte (escalonamento)",
+        options=["gpt-4o", "gpt-4-turbo", "gpt-4o-mini", "gpt-3.5-turbo"],
+        index=0,
+        disabled=not modo_cascata,
+        help="Modelo usado para reanalisar as conversas escalonadas no modo cascata"
+    )
+
+limiar_confianca_cascata = st.sidebar.slider(
+    "Confiança mínima para não escalonar",
+    min_value=0.0,
+    max_value=1.0,
+    value=0.8,
+    step=0.05,
+    disabled=not modo_cascata,
+    help="Conversas em que o modelo econômico informar confiança abaixo deste valor são reanalisadas no modelo forte"
 )
 
 # Configuração de delay entre requisições
@@ -153,6 +335,41 @@ delay_entre_requisicoes = st.sidebar.slider(
 
 st.sidebar.info("💡 **Dica**: Se receber erros de rate limit, aumente o delay entre requisições.")
 
+# Prazo por requisição (sem ele, uma requisição travada segura o lote inteiro)
+timeout_requisicao_s = st.sidebar.slider(
+    "Timeout por requisição (segundos)",
+    min_value=5,
+    max_value=120,
+    value=60,
+    step=5,
+    help="Prazo do envio ao veredito completo. Requisições que estouram o prazo são repetidas na hora, sem backoff."
+)
+
+# Hedge: cópia da requisição quando a original passa do percentil de latência observado
+usar_hedge = st.sidebar.checkbox(
+    "Hedge de requisições lentas",
+    value=True,
+    help="Quando uma requisição demora mais que o percentil escolhido das latências recentes, uma cópia é enviada e vale a primeira resposta. Começa após 3 requisições."
+)
+
+percentil_hedge = st.sidebar.select_slider(
+    "Percentil para disparar a cópia",
+    options=[0.90, 0.95, 0.99],
+    value=0.95,
+    format_func=lambda percentil: f"p{int(percentil * 100)}",
+    disabled=not usar_hedge
+)
+
+orcamento_hedge = st.sidebar.slider(
+    "Máximo de cópias (% das requisições)",
+    min_value=1,
+    max_value=20,
+    value=10,
+    step=1,
+    disabled=not usar_hedge,
+    help="Limite de requisições extras geradas pelo hedge; deixe acima de 100 - percentil (p95 → mais de 5%), senão a cauda não cabe no orçamento. Um erro 429 suspende as cópias até o orçamento se recompor"
+)
+
 # Configuração geral - Limite de conversas
 st.sidebar.markdown("---")
 st.sidebar.subheader("📊 Configurações de Processamento")
@@ -161,12 +378,12 @@ st.sidebar.subheader("📊 Configurações de Processamento")
 if 'limite_conversas' not in st.session_state:
     st.session_state['limite_conversas'] = None
 
-# Verificar se há conversas carregadas no session state para mostrar o máximo
-max_conversas = 1000  # Valor padrão
+# Máximo = total de conversas carregadas (sem teto fixo: lotes grandes rodam como job em segundo plano)
+max_conversas = None
 help_text = "Deixe vazio para analisar todas as conversas. Útil para testar com poucas conversas ou processar em lotes menores para evitar rate limits."
 
 if 'conversas_carregadas_count' in st.session_state:
-    max_conversas = max(1000, st.session_state['conversas_carregadas_count'])
+    max_conversas = st.session_state['conversas_carregadas_count'] or None
     help_text = f"Deixe vazio para analisar todas as {st.session_state['conversas_carregadas_count']} conversas carregadas. Útil para testar com poucas conversas ou processar em lotes menores para evitar rate limits."
 
 limite_conversas = st.sidebar.number_input(
@@ -181,43 +398,404 @@ limite_conversas = st.sidebar.number_input(
 # Salvar no session state
 st.session_state['limite_conversas'] = limite_conversas if limite_conversas else None
 
+# Ordem de análise: com limite, cancelamento ou interrupção, o que já foi analisado é o mais arriscado
+ORDENS_ANALISE = ["Maior risco primeiro", "Ordem do arquivo"]
+ordem_analise = st.sidebar.selectbox(
+    "Ordem de análise",
+    options=ORDENS_ANALISE,
+    index=0,
+    help="Maior risco primeiro: as conversas são pontuadas por regras locais (pedido de humano, looping, divergência, erro, frustração, transbordo e tamanho) antes de qualquer chamada à API. Com limite, são analisadas as de maior risco."
+)
+
+# Amostragem estratificada: analisa só a amostra e estima as taxas da população com intervalo de confiança
+amostragem_estratificada = st.sidebar.checkbox(
+    "Amostragem estratificada",
+    value=False,
+    help="Sorteia uma amostra estratificada por retailer, dia e risco local (proporcional ao tamanho de cada estrato), analisa só a amostra e estima as taxas de transbordo e atenção de todo o arquivo com intervalo de confiança. Substitui o limite de conversas."
+)
+tamanho_amostra = None
+nivel_confianca = 0.95
+if amostragem_estratificada:
+    tamanho_amostra = st.sidebar.number_input(
+        "Tamanho da amostra",
+        min_value=10,
+        value=1000,
+        step=100,
+        help="Conversas analisadas pela API. Com ~1000 conversas, a margem de erro fica em torno de ±3 pontos percentuais."
+    )
+    nivel_confianca = st.sidebar.select_slider(
+        "Nível de confiança",
+        options=[0.90, 0.95, 0.99],
+        value=0.95,
+        format_func=lambda nivel: f"{nivel:.0%}"
+    )
+
 # Mostrar informação sobre o limite
-if limite_conversas:
+if amostragem_estratificada:
+    st.sidebar.info(f"📐 Amostra estratificada de **{tamanho_amostra} conversas** (o limite acima é ignorado)")
+elif limite_conversas:
     st.sidebar.info(f"📌 Limite ativo: **{limite_conversas} conversas**")
 else:
     st.sidebar.info("📌 Sem limite: **Todas as conversas** serão analisadas")
 
-# Função para extrair JSON do texto (para OpenAI)
-def extract_json_from_text(text: str) -> Dict:
-    """Extrai JSON do texto retornado pelo Gemini"""
-    text = text.strip()
-    
-    # Tenta encontrar JSON entre ```json e ```
-    json_block = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', text, re.DOTALL)
-    if json_block:
-        try:
-            return json.loads(json_block.group(1))
-        except json.JSONDecodeError:
-            pass
-    
-    # Tenta encontrar JSON entre chaves (múltiplas linhas)
-    json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text, re.DOTALL)
-    if json_match:
+# Configuração do circuit breaker
+limite_falhas_disjuntor = st.sidebar.number_input(
+    "Falhas consecutivas para interromper",
+    min_value=1,
+    max_value=50,
+    value=3,
+    step=1,
+    help="Após este número de falhas consecutivas do mesmo tipo (rate limit, conexão...), a análise pausa uma vez e depois é interrompida. Chave inválida e cota esgotada interrompem na primeira falha."
+)
+
+# Configuração de segmentação de conversas longas (map-reduce)
+segmentar_conversas_longas = st.sidebar.checkbox(
+    "Segmentar conversas longas",
+    value=True,
+    help="Conversas acima do limite de tokens são divididas em trechos sobrepostos, analisados em paralelo e consolidados em um único veredito."
+)
+
+limiar_tokens_segmentacao = st.sidebar.number_input(
+    "Limite de tokens por conversa",
+    min_value=500,
+    max_value=100000,
+    value=3000,
+    step=500,
+    disabled=not segmentar_conversas_longas,
+    help="Conversas com estimativa de tokens acima deste valor são segmentadas. Cada trecho terá no máximo este tamanho."
+)
+
+sobreposicao_tokens_segmentacao = st.sidebar.number_input(
+    "Sobreposição entre trechos (tokens)",
+    min_value=0,
+    max_value=2000,
+    value=200,
+    step=50,
+    disabled=not segmentar_conversas_longas,
+    help="Quantidade aproximada de tokens repetidos no início de cada trecho para preservar o contexto do trecho anterior."
+)
+
+# Configuração do modo delta (reaproveitar vereditos de uploads anteriores)
+modo_delta = st.sidebar.checkbox(
+    "Modo delta (reaproveitar análises anteriores)",
+    value=False,
+    help="Compara o upload com o histórico de análises pelo chat_id (ou pelo hash do conteúdo quando não há ID) e analisa apenas conversas novas, alteradas ou com veredito de outro modelo/motor. Os vereditos do histórico entram no relatório junto com os novos."
+)
+
+# Diretório dos classificadores destilados (artefatos versionados gerados por treinar_classificador.py)
+DIRETORIO_CLASSIFICADORES = os.environ.get("CLASSIFICADORES_DIR", "classificadores")
+
+# Tokens finais da conversa que também entram como features próprias (o desfecho pesa mais no veredito)
+TOKENS_FINAIS_CLASSIFICADOR = 40
+
+# Função para extrair as features de hashing de uma conversa
+def extrair_features_classificador(conversa: str, dimensao: int) -> tuple:
+    """Retorna (índices, valores) esparsos: unigramas, bigramas e tokens finais com hashing, log(1+tf) e norma L2"""
+    # Remoção de acentos via ASCII: mais rápida que filtrar caractere a caractere como em tokenizar_busca
+    sem_acentos = unicodedata.normalize("NFKD", (conversa or "").lower()).encode("ascii", "ignore").decode("ascii")
+    vocabulario = {}
+    ids = np.array([vocabulario.setdefault(token, len(vocabulario)) for token in re.findall(r"\w+", sem_acentos)], dtype=np.int64)
+    if not len(ids):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    # crc32 só uma vez por token distinto; bigramas e tokens finais combinam os hashes dos unigramas
+    unigramas = np.array([zlib.crc32(token.encode("ascii")) for token in vocabulario], dtype=np.uint64)[ids]
+    bigramas = unigramas[:-1] * np.uint64(1000003) ^ unigramas[1:]
+    finais = unigramas[-TOKENS_FINAIS_CLASSIFICADOR:] ^ np.uint64(0x9E3779B9)
+    hashes = np.concatenate([unigramas, bigramas, finais]) % np.uint64(dimensao)
+    indices, contagens = np.unique(hashes, return_counts=True)
+    valores = np.log1p(contagens).astype(np.float32)
+    return indices.astype(np.int64), valores / np.linalg.norm(valores)
+
+# Classificador linear destilado dos vereditos do LLM (sem API, apenas CPU)
+class ClassificadorDestilado:
+    """Regressão softmax sobre features de hashing com duas cabeças: had_need_to_transfer e motivo_transbordo"""
+
+    def __init__(self, dimensao: int, cabecas: Dict, metadados: Dict):
+        # cabecas: {nome: (pesos [dimensao x classes], vies [classes], classes)}
+        self.dimensao = dimensao
+        self.cabecas = cabecas
+        self.metadados = metadados
+
+    @property
+    def versao(self) -> str:
+        return self.metadados.get("versao", "?")
+
+    def prever(self, conversa: str) -> Dict:
+        """Retorna {cabeça: (classe prevista, probabilidade)}"""
+        indices, valores = extrair_features_classificador(conversa, self.dimensao)
+        previsoes = {}
+        for nome, (pesos, vies, classes) in self.cabecas.items():
+            pontuacoes = valores @ pesos[indices] + vies
+            probabilidades = np.exp(pontuacoes - pontuacoes.max())
+            probabilidades /= probabilidades.sum()
+            melhor = int(probabilidades.argmax())
+            previsoes[nome] = (classes[melhor], float(probabilidades[melhor]))
+        return previsoes
+
+    def salvar(self, caminho: str) -> None:
+        arrays = {}
+        for nome, (pesos, vies, classes) in self.cabecas.items():
+            arrays[f"{nome}__pesos"] = pesos
+            arrays[f"{nome}__vies"] = vies
+            arrays[f"{nome}__classes"] = np.array([json.dumps(classe) for classe in classes])
+        metadados = dict(self.metadados, dimensao=self.dimensao, cabecas=list(self.cabecas))
+        np.savez_compressed(caminho, metadados=np.array(json.dumps(metadados, ensure_ascii=False)), **arrays)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "ClassificadorDestilado":
+        with np.load(caminho) as arquivo:
+            metadados = json.loads(str(arquivo["metadados"]))
+            cabecas = {
+                nome: (
+                    arquivo[f"{nome}__pesos"],
+                    arquivo[f"{nome}__vies"],
+                    [json.loads(classe) for classe in arquivo[f"{nome}__classes"]]
+                )
+                for nome in metadados["cabecas"]
+            }
+        return cls(metadados["dimensao"], cabecas, metadados)
+
+# Função para localizar o artefato mais recente do classificador
+def caminho_classificador_mais_recente(diretorio: str = DIRETORIO_CLASSIFICADORES) -> str:
+    """Os nomes levam a data de treino (classificador-AAAAMMDD-HHMMSS.npz), então a ordem alfabética é a cronológica"""
+    if not os.path.isdir(diretorio):
+        return None
+    artefatos = sorted(nome for nome in os.listdir(diretorio) if nome.startswith("classificador-") and nome.endswith(".npz"))
+    return os.path.join(diretorio, artefatos[-1]) if artefatos else None
+
+# Classificador carregado uma vez por artefato (compartilhado entre sessões e jobs)
+@st.cache_resource
+def obter_classificador(caminho: str, modificado_em: float) -> ClassificadorDestilado:
+    return ClassificadorDestilado.carregar(caminho)
+
+# Configuração da triagem com o classificador destilado
+caminho_classificador = caminho_classificador_mais_recente()
+classificador_destilado = None
+if caminho_classificador:
+    try:
+        classificador_destilado = obter_classificador(caminho_classificador, os.path.getmtime(caminho_classificador))
+    except Exception as e:
+        st.sidebar.warning(f"⚠️ Classificador local inválido ({os.path.basename(caminho_classificador)}): {e}")
+
+usar_classificador = st.sidebar.checkbox(
+    "Triagem com classificador local",
+    value=False,
+    disabled=classificador_destilado is None,
+    help="Um classificador treinado com vereditos anteriores do LLM responde localmente, sem custo, quando estiver confiante; as demais conversas seguem para a API. Gere o modelo com treinar_classificador.py."
+)
+
+limiar_confianca_classificador = st.sidebar.slider(
+    "Confiança mínima do classificador",
+    min_value=0.5,
+    max_value=1.0,
+    value=0.9,
+    step=0.01,
+    disabled=not usar_classificador,
+    help="Conversas em que o classificador ficar abaixo deste valor (na decisão de transbordo ou no motivo) são analisadas pelo LLM"
+)
+
+if classificador_destilado is not None:
+    st.sidebar.caption(
+        f"🧮 Classificador **{classificador_destilado.versao}** "
+        f"({classificador_destilado.metadados.get('exemplos_treino', '?')} exemplos de treino)"
+    )
+
+# Campos do veredito que precisam chegar para encerrar a resposta em streaming
+CAMPOS_OBRIGATORIOS_VEREDITO = ("had_need_to_transfer", "motivo_transbordo")
+
+# Parser incremental de JSON (para respostas em streaming)
+class ParserJSONIncremental:
+    """Lê um objeto JSON em partes e disponibiliza cada campo de primeiro nível assim que ele termina"""
+
+    def __init__(self):
+        self.campos = {}
+        self.completo = False
+        self.malformado = False
+        self._iniciado = False
+        self._profundidade = 0
+        self._em_string = False
+        self._escape = False
+        self._fragmento = []
+
+    def alimentar(self, texto: str) -> Dict:
+        """Processa um novo pedaço de texto e retorna os campos concluídos neste pedaço"""
+        novos = {}
+        for char in texto:
+            if self.completo:
+                break
+            if not self._iniciado:
+                # Ignorar qualquer texto antes do objeto (ex.: ```json)
+                if char == '{':
+                    self._iniciado = True
+                    self._profundidade = 1
+                continue
+
+            if self._em_string:
+                self._fragmento.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._em_string = False
+                continue
+
+            if char == '"':
+                self._em_string = True
+            elif char in '{[':
+                self._profundidade += 1
+            elif char in '}]':
+                self._profundidade -= 1
+                if self._profundidade == 0:
+                    novos.update(self._concluir_fragmento())
+                    self.completo = True
+                    break
+            elif char == ',' and self._profundidade == 1:
+                novos.update(self._concluir_fragmento())
+                continue
+
+            self._fragmento.append(char)
+
+        self.campos.update(novos)
+        return novos
+
+    def _concluir_fragmento(self) -> Dict:
+        """Converte o par chave/valor acumulado em um dicionário"""
+        fragmento = ''.join(self._fragmento).strip()
+        self._fragmento = []
+        if not fragmento:
+            return {}
         try:
-            return json.loads(json_match.group())
+            return json.loads('{' + fragmento + '}')
         except json.JSONDecodeError:
-            pass
-    
-    # Tenta parsear todo o texto como JSON
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-    
-    return None
+            self.malformado = True
+            return {}
+
+    def tem_campos(self, campos) -> bool:
+        """Indica se todos os campos informados já foram recebidos"""
+        return all(campo in self.campos for campo in campos)
+
+    def resultado(self) -> Dict:
+        """Retorna os campos recebidos até agora ou None se nenhum campo foi lido"""
+        return dict(self.campos) if self.campos else None
+
+# Função para extrair JSON do texto (para OpenAI)
+def extract_json_from_text(text: str) -> Dict:
+    """Extrai o primeiro objeto JSON do texto em uma única passada (tolera ```json e texto ao redor)"""
+    parser = ParserJSONIncremental()
+    parser.alimentar(text.strip())
+    return parser.resultado()
+
+# Taxonomia oficial de motivo_transbordo (mesma ordem do prompt)
+TAXONOMIA_MOTIVO_TRANSBORDO = [
+    "STATUS_PEDIDO_ATRASADO",
+    "STATUS_PEDIDO_ENTREGUE_NAO_RECEBIDO",
+    "ENDERECO_INCORRETO",
+    "REEMBOLSO_OU_ESTORNO_ATRASADO",
+    "DUVIDA_USO_CODIGO_RASTREIO",
+    "STATUS_TICKET",
+    "PEDIDO_DEVOLVIDO_LOGISTICA",
+    "DETALHES_STATUS_TROCA_DEVOLUCAO",
+    "PROBLEMA_VALE_TROCA",
+    "EXCECAO_PRAZO_EXPIRADO",
+    "PRAZO_ESTORNO",
+    "PROBLEMA_CODIGO_POSTAGEM",
+    "ALTERACAO_PEDIDO_EM_ANDAMENTO",
+    "ALTERACAO_DADOS_CADASTRAIS",
+    "ALTERACAO_FORMA_PAGAMENTO_OU_DEVOLUCAO",
+    "SOLICITACAO_CANCELAMENTO",
+    "DUVIDA_PEDIDO_CANCELADO",
+    "FALHA_IA_LOOP_OU_ALUCINACAO",
+    "PEDIDO_NAO_LOCALIZADO_PELA_IA",
+    "DUVIDA_PRE_VENDA",
+    "LOJA_FISICA",
+    "PEDIDO_DIRETO_HUMANO",
+    "ASSUNTO_FORA_DO_ESCOPO",
+    "OUTROS"
+]
+
+# Modelos que aceitam Structured Outputs (response_format json_schema com strict)
+MODELOS_SAIDA_ESTRUTURADA = {"gpt-4o-mini", "gpt-4o"}
+
+# Função para montar o schema JSON estrito do veredito
+def criar_schema_veredito(incluir_confianca: bool = False) -> Dict:
+    """Cria o schema JSON do veredito com enum da taxonomia de motivo_transbordo"""
+    schema = {
+        "type": "object",
+        "properties": {
+            "had_need_to_transfer": {"type": "boolean"},
+            "motivo_transbordo": {
+                "anyOf": [
+                    {"type": "string", "enum": TAXONOMIA_MOTIVO_TRANSBORDO},
+                    {"type": "null"}
+                ]
+            }
+        },
+        "required": ["had_need_to_transfer", "motivo_transbordo"],
+        "additionalProperties": False
+    }
+    if incluir_confianca:
+        schema["properties"]["confianca"] = {"type": "number"}
+        schema["required"].append("confianca")
+    return schema
+
+# Função para escolher o formato de resposta de acordo com o modelo
+def formato_resposta_veredito(modelo: str, incluir_confianca: bool = False) -> Dict:
+    """Retorna o response_format: schema estrito para modelos compatíveis, JSON livre para os demais"""
+    if modelo in MODELOS_SAIDA_ESTRUTURADA:
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "veredito_transbordo",
+                "strict": True,
+                "schema": criar_schema_veredito(incluir_confianca)
+            }
+        }
+    return {"type": "json_object"}
+
+# Função para converter o JSON do modelo no veredito padrão
+def montar_veredito(resultado_json: Dict) -> Dict:
+    """Valida o JSON contra o schema do veredito e monta os campos exibidos; retorna None se inválido"""
+    if not resultado_json:
+        return None
+
+    had_need_to_transfer = resultado_json.get("had_need_to_transfer")
+    motivo_transbordo = resultado_json.get("motivo_transbordo")
+
+    if not isinstance(had_need_to_transfer, bool):
+        return None
+    if motivo_transbordo is not None and motivo_transbordo not in TAXONOMIA_MOTIVO_TRANSBORDO:
+        return None
+
+    confianca = resultado_json.get("confianca")
+    if confianca is not None:
+        if isinstance(confianca, bool) or not isinstance(confianca, (int, float)):
+            return None
+        confianca = min(max(float(confianca), 0.0), 1.0)
+
+    if had_need_to_transfer:
+        tipo_falha = "Necessidade de Transferência"
+        descricao = "Conversa precisa de atenção - houve necessidade real de transferência para atendimento humano"
+        sugestao = "Revisar fluxo conversacional e melhorar detecção de casos que requerem transferência para atendimento humano"
+    else:
+        tipo_falha = "N/A"
+        descricao = "Conversa processada corretamente - não houve necessidade de transferência"
+        sugestao = "N/A"
+
+    veredito = {
+        "had_need_to_transfer": had_need_to_transfer,
+        "acao_necessaria": had_need_to_transfer,
+        "tipo_falha": tipo_falha,
+        "motivo_transbordo": motivo_transbordo or "N/A",
+        "descricao": descricao,
+        "sugestao_solucao": sugestao
+    }
+    if confianca is not None:
+        veredito["confianca"] = confianca
+    return veredito
 
 # Função para criar prompt do sistema
-def criar_prompt_sistema(conversa: str) -> str:
+def criar_prompt_sistema(conversa: str, incluir_confianca: bool = False) -> str:
     """Cria o prompt estruturado para análise da conversa via OpenAI"""
     prompt = f"""TAREFA:
 Analisar a conversa entre CLIENTE e o sistema (WHIZZ + ATENDENTE BOT, avaliados como um único agente) e determinar:
@@ -397,286 +975,1077 @@ REGRAS FINAIS
 ---------------------------------------------------------------------
 
 CONVERSA A SER ANALISADA:
-{conversa}
+{conversa_para_prompt(conversa)}
 
 IMPORTANTE:
 Retorne APENAS o JSON final.
 Sem explicações.
 Sem texto adicional.
 Sem comentários."""
+    if incluir_confianca:
+        prompt += """
+
+Inclua também no JSON o campo "confianca": número entre 0 e 1 indicando o quanto você está seguro do veredito (1 = certeza total)."""
     return prompt
 
-# Função para analisar uma conversa via OpenAI API
-def analisar_conversa_openai(conversa: str, modelo: str, api_key_openai: str = None) -> Dict:
-    """Analisa uma conversa usando a API do OpenAI"""
+# Função para consumir a resposta em streaming da OpenAI
+def consumir_resposta_streaming(stream, ao_receber_campos=None, campos_obrigatorios=CAMPOS_OBRIGATORIOS_VEREDITO,
+                                prazo: float = None, cancelado: threading.Event = None):
+    """Lê os pedaços da resposta, repassa campos concluídos e fecha o stream quando o veredito está completo
+
+    Retorna (texto, parser, uso); uso é o bloco usage do último pedaço ou None se o stream foi encerrado antes dele.
+    Levanta ErroTempoEsgotado se o prazo (time.perf_counter) vencer; com cancelado sinalizado, encerra sem erro.
+    """
+    parser = ParserJSONIncremental()
+    partes = []
+    uso = None
     try:
-        # Importar openai
+        for chunk in stream:
+            # Outra cópia da requisição (hedge) já respondeu, ou o prazo total venceu com o stream pingando
+            if cancelado is not None and cancelado.is_set():
+                break
+            if prazo is not None and time.perf_counter() > prazo:
+                raise ErroTempoEsgotado("Prazo da requisição esgotado durante o streaming")
+            # Com stream_options include_usage, o consumo de tokens chega em um pedaço final sem choices
+            if getattr(chunk, "usage", None):
+                uso = chunk.usage
+            if not chunk.choices or parser.completo:
+                continue
+            conteudo = chunk.choices[0].delta.content
+            if not conteudo:
+                continue
+            partes.append(conteudo)
+            novos = parser.alimentar(conteudo)
+            if novos and ao_receber_campos:
+                ao_receber_campos(novos)
+            # Encerrar cedo se os campos obrigatórios chegaram antes do fim do objeto
+            # (com o objeto completo, o restante do stream é só o pedaço de usage)
+            if not parser.completo and parser.tem_campos(campos_obrigatorios):
+                break
+    finally:
+        stream.close()
+    return ''.join(partes), parser, uso
+
+# Erros tipados da análise via API (usados pelo circuit breaker e pela fila de reprocessamento)
+class ErroAnaliseAPI(Exception):
+    """Falha ao obter o veredito de uma conversa"""
+    classe = "erro_desconhecido"
+    reexecutavel = False  # Pode ser tentado novamente com backoff
+    fatal = False  # Afeta todas as conversas (abre o circuito imediatamente)
+
+    def __init__(self, mensagem: str, retry_after: float = None):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+class ErroConfiguracao(ErroAnaliseAPI):
+    classe = "configuracao"
+    fatal = True
+
+
+class ErroAutenticacao(ErroAnaliseAPI):
+    classe = "autenticacao"
+    fatal = True
+
+
+class ErroCotaExcedida(ErroAnaliseAPI):
+    classe = "cota_excedida"
+    fatal = True
+
+
+class ErroRateLimit(ErroAnaliseAPI):
+    classe = "rate_limit"
+    reexecutavel = True
+
+
+class ErroConexao(ErroAnaliseAPI):
+    classe = "conexao"
+    reexecutavel = True
+
+
+class ErroTempoEsgotado(ErroAnaliseAPI):
+    classe = "tempo_esgotado"
+    reexecutavel = True
+
+
+class ErroServidor(ErroAnaliseAPI):
+    classe = "servidor"
+    reexecutavel = True
+
+
+class ErroRequisicaoInvalida(ErroAnaliseAPI):
+    classe = "requisicao_invalida"
+
+
+class ErroRespostaInvalida(ErroAnaliseAPI):
+    classe = "resposta_invalida"
+
+
+# Função para converter exceções do SDK da OpenAI em erros tipados
+def classificar_erro_openai(e: Exception) -> ErroAnaliseAPI:
+    """Mapeia a exceção do SDK da OpenAI para a classe de erro correspondente"""
+    if isinstance(e, ErroAnaliseAPI):
+        return e
+
+    mensagem = str(e)
+    if len(mensagem) > 200:
+        mensagem = mensagem[:200] + "..."
+
+    retry_after = None
+    response = getattr(e, 'response', None)
+    if response is not None and hasattr(response, 'headers'):
         try:
-            import openai
-        except ImportError:
-            return {
-                "acao_necessaria": True,
-                "tipo_falha": "Erro de dependência",
-                "motivo_transbordo": "N/A",
-                "descricao": "Erro: Biblioteca openai não está instalada. Execute: pip install openai",
-                "sugestao_solucao": "Instalar biblioteca: pip install openai"
-            }
-        
-        # Verificar API Key
-        if not api_key_openai:
-            return {
-                "acao_necessaria": True,
-                "tipo_falha": "Erro de configuração",
-                "motivo_transbordo": "N/A",
-                "descricao": "Erro: OpenAI API Key não foi configurada. Configure na barra lateral.",
-                "sugestao_solucao": "Configurar OpenAI API Key na barra lateral da aplicação"
-            }
-        
-        # Configurar cliente OpenAI
-        client = openai.OpenAI(api_key=api_key_openai)
-        
-        # Verificar se a conversa não está vazia
-        if not conversa or len(conversa.strip()) < 10:
-            return {
-                "acao_necessaria": False,
-                "tipo_falha": "N/A",
-                "motivo_transbordo": "N/A",
-                "descricao": "Conversa sem conteúdo suficiente para análise",
-                "sugestao_solucao": "N/A"
-            }
-        
-        # Criar prompt
-        prompt = criar_prompt_sistema(conversa)
-        
-        # Gerar conteúdo com retry e backoff exponencial para rate limiting
-        response = None
-        max_retries = 5  # Aumentado para 5 tentativas
-        
-        for tentativa in range(max_retries):
-            try:
-                response = client.chat.completions.create(
-                    model=modelo,
-                    messages=[
-                        {"role": "system", "content": "Você é um Auditor de Qualidade de Atendimento Automatizado (QA). Retorne APENAS JSON válido, sem texto adicional."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    response_format={"type": "json_object"}  # Forçar resposta JSON
-                )
-                break  # Sucesso, sair do loop
-            except Exception as e:
-                error_msg = str(e)
-                error_type = type(e).__name__
-                
-                # Verificar se é erro de rate limit
-                is_rate_limit = (
-                    "429" in error_msg or 
-                    "rate_limit" in error_msg.lower() or 
-                    "rate limit" in error_msg.lower() or
-                    "rate_limit_exceeded" in error_type or
-                    "quota" in error_msg.lower() or
-                    "too_many_requests" in error_msg.lower()
-                )
-                
-                if is_rate_limit:
-                    if tentativa < max_retries - 1:
-                        # Backoff exponencial: 10s, 20s, 40s, 80s
-                        wait_time = 10 * (2 ** tentativa)
-                        # Limitar a 60 segundos máximo
-                        wait_time = min(wait_time, 60)
-                        
-                        # Tentar extrair retry-after do header se disponível
-                        if hasattr(e, 'response') and hasattr(e.response, 'headers'):
-                            retry_after = e.response.headers.get('retry-after')
-                            if retry_after:
-                                try:
-                                    wait_time = int(retry_after) + 2
-                                except:
-                                    pass
-                        
-                        time.sleep(wait_time)
-                        continue  # Tentar novamente
-                    else:
-                        # Última tentativa falhou
-                        raise Exception(f"Rate limit excedido após {max_retries} tentativas. Aguarde alguns minutos antes de tentar novamente.")
-                else:
-                    # Outro tipo de erro, não tentar novamente
-                    raise e
-        
-        if response is None or not response.choices or not response.choices[0].message.content:
-            return {
-                "acao_necessaria": True,
-                "tipo_falha": "Erro na API",
-                "motivo_transbordo": "N/A",
-                "descricao": "O modelo não retornou uma resposta válida",
-                "sugestao_solucao": "Verificar conexão com API OpenAI e tentar novamente"
-            }
-        
-        texto_resposta = response.choices[0].message.content.strip()
-        resultado_json = extract_json_from_text(texto_resposta)
-        
-        if resultado_json is None:
-            return {
-                "acao_necessaria": True,
-                "tipo_falha": "Erro ao processar resposta",
-                "motivo_transbordo": "N/A",
-                "descricao": f"Erro ao extrair JSON. Resposta: {texto_resposta[:150]}",
-                "sugestao_solucao": "Verificar formato da resposta da API e ajustar prompt se necessário"
-            }
-        
-        # Validar e padronizar campos
-        # Processar had_need_to_transfer (novo formato) ou acao_necessaria (formato antigo para compatibilidade)
-        had_need_to_transfer = resultado_json.get("had_need_to_transfer", None)
-        acao_necessaria_old = resultado_json.get("acao_necessaria", None)
-        
-        # Converter had_need_to_transfer para acao_necessaria
-        if had_need_to_transfer is not None:
-            if isinstance(had_need_to_transfer, str):
-                acao_necessaria = had_need_to_transfer.lower() in ["true", "sim", "yes", "1"]
-            else:
-                acao_necessaria = bool(had_need_to_transfer)
-        elif acao_necessaria_old is not None:
-            if isinstance(acao_necessaria_old, str):
-                acao_necessaria = acao_necessaria_old.lower() in ["true", "sim", "yes", "1"]
-            else:
-                acao_necessaria = bool(acao_necessaria_old)
-        else:
-            acao_necessaria = False
-        
-        resultado_json["acao_necessaria"] = bool(acao_necessaria)
-        
-        # Criar tipo_falha e descricao baseados no resultado
-        if acao_necessaria:
-            resultado_json["tipo_falha"] = str(resultado_json.get("tipo_falha", "Necessidade de Transferência")).strip()
-            resultado_json["descricao"] = str(resultado_json.get("descricao", "Conversa precisa de atenção - houve necessidade real de transferência para atendimento humano")).strip()
-        else:
-            resultado_json["tipo_falha"] = str(resultado_json.get("tipo_falha", "N/A")).strip()
-            resultado_json["descricao"] = str(resultado_json.get("descricao", "Conversa processada corretamente - não houve necessidade de transferência")).strip()
-        
-        # Motivo do transbordo (sempre preencher)
-        resultado_json["motivo_transbordo"] = str(resultado_json.get("motivo_transbordo", "N/A")).strip() or "N/A"
-        
-        # Processar sugestão de solução
-        sugestao = resultado_json.get("sugestao_solucao", "")
-        if not sugestao or sugestao.strip() == "":
-            # Se não foi fornecida e há ação necessária, criar uma sugestão genérica
-            if acao_necessaria:
-                sugestao = "Revisar fluxo conversacional e melhorar detecção de casos que requerem transferência para atendimento humano"
-            else:
-                sugestao = "N/A"
-        
-        resultado_json["sugestao_solucao"] = str(sugestao).strip()
-        
-        return resultado_json
-        
-    except Exception as e:
-        error_msg = str(e)
-        
-        # Verificar se é erro de rate limit
-        is_rate_limit = (
-            "429" in error_msg or 
-            "quota" in error_msg.lower() or 
-            "rate limit" in error_msg.lower() or 
-            "rate_limit" in error_msg.lower() or
-            "rate_limit_exceeded" in error_msg.lower() or
-            "too_many_requests" in error_msg.lower()
+            retry_after = float(response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            retry_after = None
+
+    if isinstance(e, openai.AuthenticationError) or isinstance(e, openai.PermissionDeniedError):
+        return ErroAutenticacao(f"API Key inválida ou sem permissão: {mensagem}")
+    if isinstance(e, openai.RateLimitError):
+        if getattr(e, 'code', None) == "insufficient_quota":
+            return ErroCotaExcedida(f"Cota da conta OpenAI esgotada: {mensagem}")
+        return ErroRateLimit(f"Rate limit excedido: {mensagem}", retry_after)
+    if isinstance(e, openai.APITimeoutError):
+        return ErroTempoEsgotado(f"Requisição sem resposta dentro do prazo: {mensagem}")
+    if isinstance(e, openai.APIConnectionError):
+        return ErroConexao(f"Falha de conexão com a API: {mensagem}")
+    if isinstance(e, openai.InternalServerError):
+        return ErroServidor(f"Erro no servidor da API: {mensagem}", retry_after)
+    if isinstance(e, (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError)):
+        return ErroRequisicaoInvalida(f"Requisição rejeitada pela API: {mensagem}")
+    return ErroAnaliseAPI(f"Erro na análise: {mensagem}")
+
+# Provedores de LLM: a análise só depende de um stream de chat completions no formato da API da OpenAI
+class ProvedorChat(ABC):
+    """Interface de um backend de chat: devolve o stream de pedaços consumido por consumir_resposta_streaming"""
+    nome = "provedor"
+    timeout_s = None  # Prazo de cada requisição, do envio ao veredito completo
+    politica_hedge = None  # PoliticaHedge compartilhada pelas requisições do provedor
+
+    @abstractmethod
+    def criar_stream(self, modelo: str, mensagens: list, temperatura: float, formato_resposta: dict):
+        ...
+
+
+class ProvedorOpenAI(ProvedorChat):
+    """API da OpenAI ou qualquer endpoint compatível (vLLM, Ollama, LM Studio, mock local) via base_url"""
+
+    def __init__(self, api_key: str, base_url: str = None, nome: str = "OpenAI", timeout_s: float = None,
+                 politica_hedge: "PoliticaHedge" = None):
+        if not api_key:
+            raise ErroConfiguracao("OpenAI API Key não foi configurada. Configure na barra lateral.")
+        self.nome = nome
+        self.base_url = base_url or None
+        self.timeout_s = timeout_s
+        self.politica_hedge = politica_hedge
+        # Cliente único reaproveitado entre requisições (sem retries internos do SDK: o backoff da análise é medido e registrado)
+        # O timeout do SDK vale por leitura (conexão travada); o prazo total é verificado durante o streaming
+        self.cliente = openai.OpenAI(
+            api_key=api_key, base_url=self.base_url, max_retries=0, **({"timeout": timeout_s} if timeout_s else {})
         )
-        
-        if is_rate_limit:
-            return {
-                "acao_necessaria": True,
-                "tipo_falha": "Rate limit excedido",
-                "motivo_transbordo": "N/A",
-                "descricao": "⚠️ Rate limit da API OpenAI excedido. Soluções: 1) Aumente o delay entre requisições na sidebar (recomendado: 10-15s), 2) Adicione créditos na sua conta OpenAI, 3) Aguarde alguns minutos e tente novamente.",
-                "sugestao_solucao": "Aumentar delay entre requisições na sidebar para 10-15 segundos ou adicionar créditos na conta OpenAI"
-            }
-        
-        if len(error_msg) > 200:
-            error_msg = error_msg[:200] + "..."
-        
-        return {
-            "acao_necessaria": True,
-            "tipo_falha": "Erro na análise",
-            "motivo_transbordo": "N/A",
-            "descricao": f"Erro na análise: {error_msg}",
-            "sugestao_solucao": "Verificar logs de erro e configurações da API OpenAI"
-        }
 
-# Função para analisar uma conversa localmente usando regras de negócio
-def analisar_conversa_local(conversa: str) -> Dict:
-    """Analisa uma conversa usando regras de negócio locais (sem API)"""
-    try:
-        # Verificar se a conversa não está vazia
-        if not conversa or len(conversa.strip()) < 10:
-            return {
-                "necessidade_transbordo": "Não",
-                "transferencia": "Não",
-                "agente_agiu_corretamente": "Sim",
-                "motivo_transbordo": "N/A",
-                "problema_mapeado": "Conversa muito curta",
-                "precisa_atencao": "Não",
-                "observacao": "Conversa sem conteúdo suficiente para análise"
-            }
-        
-        conversa_lower = conversa.lower()
-        conversa_original = conversa
-        
-        # Normalizar a conversa para análise
-        linhas = conversa.split('\n')
-        
-        # 1. NECESSIDADE DE TRANSBORDO
-        necessidade_transbordo = "Não"
-        motivo_transbordo = "N/A"
-        
-        # Padrões que indicam necessidade de transbordo
-        pede_humano_patterns = [
-            r'falar\s+com\s+(?:um\s+)?(?:atendente|humano|pessoa|operador)',
-            r'quero\s+(?:falar\s+)?com\s+(?:um\s+)?(?:atendente|humano|pessoa)',
-            r'preciso\s+de\s+(?:um\s+)?(?:atendente|humano|pessoa)',
-            r'atendente\s+(?:humano|pessoa)',
-            r'transferir\s+para\s+(?:um\s+)?(?:atendente|humano|pessoa)'
-        ]
-        
-        looping_patterns = [
-            r'(?:repete|repetiu|repetindo|loop)',
-            r'mesma\s+(?:coisa|mensagem|resposta)',
-            r'já\s+(?:falei|disse|respondi)',
-            r'não\s+entende'
-        ]
-        
-        erro_bot_patterns = [
-            r'erro',
-            r'não\s+funcionou',
-            r'não\s+está\s+funcionando',
-            r'bug',
-            r'problema\s+técnico',
-            r'falha'
-        ]
+    def criar_stream(self, modelo: str, mensagens: list, temperatura: float, formato_resposta: dict):
+        return self.cliente.chat.completions.create(
+            model=modelo,
+            messages=mensagens,
+            temperature=temperatura,
+            response_format=formato_resposta,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+# Latências observadas antes de o hedge entrar em ação (com poucas amostras, o teto pela mediana segura o limiar)
+MIN_AMOSTRAS_HEDGE = 3
+
+# Cópias por requisição: uma segunda sai se a primeira cópia também passar do atraso
+MAX_COPIAS_HEDGE = 2
+
+# Requisições mais recentes consideradas no percentil de latência
+JANELA_LATENCIAS_HEDGE = 200
+
+# Teto do atraso em múltiplos da mediana: quando a cauda lenta ocupa a fração 1 - percentil, o percentil cai dentro dela
+MULTIPLO_MEDIANA_HEDGE = 5
+
+# Créditos iniciais e máximos do balde: permitem cópias logo no início e em rajadas de requisições lentas
+RAJADA_HEDGE = 2.0
+
+# Hedge de requisições lentas: uma cópia é disparada quando a original passa do percentil de latência observado
+class PoliticaHedge:
+    """Limiar adaptativo (percentil das latências recentes) e orçamento de cópias em balde de créditos
+
+    Cada requisição original rende `fracao_maxima` de crédito e cada cópia consome um, então as cópias não
+    passam dessa fração das requisições (mais a rajada inicial). A fração precisa ficar acima de 1 - percentil,
+    senão a cauda que o percentil aponta é maior que o orçamento. Um 429 zera os créditos: com o provedor
+    limitando, cópia só piora.
+    """
+
+    def __init__(self, percentil: float = 0.95, fracao_maxima: float = 0.10, atraso_minimo_s: float = 0.5):
+        self.percentil = percentil
+        self.fracao_maxima = fracao_maxima
+        self.atraso_minimo_s = atraso_minimo_s
+        self.latencias = deque(maxlen=JANELA_LATENCIAS_HEDGE)
+        self.creditos = RAJADA_HEDGE
+        self.trava = threading.Lock()
+        self.contadores = {"requisicoes": 0, "hedges": 0, "hedges_vencedores": 0, "hedges_negados": 0}
+
+    def atraso_hedge(self) -> float:
+        """Tempo de espera pela original antes da cópia; None enquanto não há amostra suficiente"""
+        with self.trava:
+            if len(self.latencias) < MIN_AMOSTRAS_HEDGE:
+                return None
+            ordenadas = sorted(self.latencias)
+        limiar = min(ordenadas[min(int(self.percentil * len(ordenadas)), len(ordenadas) - 1)], MULTIPLO_MEDIANA_HEDGE * ordenadas[len(ordenadas) // 2])
+        return max(limiar, self.atraso_minimo_s)
+
+    def registrar_requisicao(self) -> None:
+        with self.trava:
+            self.contadores["requisicoes"] += 1
+            self.creditos = min(self.creditos + self.fracao_maxima, RAJADA_HEDGE)
+
+    def registrar_latencia(self, latencia: float) -> None:
+        with self.trava:
+            self.latencias.append(latencia)
+
+    def registrar_rate_limit(self) -> None:
+        with self.trava:
+            self.creditos = 0.0
+
+    def reservar_hedge(self) -> bool:
+        with self.trava:
+            if self.creditos < 1.0:
+                self.contadores["hedges_negados"] += 1
+                return False
+            self.creditos -= 1.0
+            self.contadores["hedges"] += 1
+            return True
+
+    def registrar_vitoria_hedge(self) -> None:
+        with self.trava:
+            self.contadores["hedges_vencedores"] += 1
+
+# Função para executar uma requisição com hedge (a primeira resposta válida vence)
+def requisitar_com_hedge(requisitar, politica: PoliticaHedge = None) -> tuple:
+    """requisitar(cancelado, original) faz a requisição completa e retorna (texto, parser, uso, latencia)
+
+    Se a original passar do atraso da política e houver crédito, dispara uma cópia; a resposta que chegar primeiro
+    vence e as demais são canceladas; se a cópia também passar do atraso, sai outra (até MAX_COPIAS_HEDGE).
+    Retorna o resultado do vencedor mais o número de cópias disparadas.
+    O percentil acompanha a latência da original, inclusive quando ela falha, estoura o tempo ou perde para a
+    cópia (nesse caso, o tempo até o cancelamento, que já passa do percentil).
+    """
+    if politica is None:
+        return requisitar(None, True) + (0,)
+
+    politica.registrar_requisicao()
+    atraso = politica.atraso_hedge()
+    cancelado = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1 + MAX_COPIAS_HEDGE)
+    try:
+        inicio = time.perf_counter()
+        original = executor.submit(requisitar, cancelado, True)
+        pendentes = {original}
+        hedges = 0
+        erro = None
+        while pendentes:
+            aguardar = atraso if hedges < MAX_COPIAS_HEDGE and atraso is not None else None
+            concluidas, pendentes = wait(pendentes, timeout=aguardar, return_when=FIRST_COMPLETED)
+            if not concluidas:
+                # Original além do percentil: cópia se o orçamento permitir, senão só esperar
+                if politica.reservar_hedge():
+                    pendentes.add(executor.submit(requisitar, cancelado, False))
+                    hedges += 1
+                else:
+                    atraso = None
+                continue
+            for futuro in concluidas:
+                try:
+                    resultado = futuro.result()
+                except ErroRateLimit as e:
+                    politica.registrar_rate_limit()
+                    erro = erro or e
+                    continue
+                except Exception as e:
+                    erro = erro or e
+                    continue
+                finally:
+                    if futuro is original:
+                        politica.registrar_latencia(time.perf_counter() - inicio)
+                cancelado.set()
+                if futuro is not original:
+                    politica.registrar_vitoria_hedge()
+                    if original in pendentes:
+                        politica.registrar_latencia(time.perf_counter() - inicio)
+                return resultado + (hedges,)
+        raise erro
+    finally:
+        cancelado.set()
+        executor.shutdown(wait=False)
+
+# Exportador Prometheus/OpenMetrics opcional (ativado pela variável METRICAS_PROMETHEUS_PORTA)
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+METRICAS_PROMETHEUS_PORTA = os.environ.get("METRICAS_PROMETHEUS_PORTA")
+
+# Métricas do pipeline de análise (sem efeito quando o exportador está desativado)
+class MetricasAnalise:
+    """Contadores, histogramas e gauge da análise; cada método vira no-op sem prometheus_client ou sem porta"""
+
+    def __init__(self, porta: int = None):
+        self.porta = porta
+        self.ativo = prometheus_client is not None and porta is not None
+        if not self.ativo:
+            return
+        registro = prometheus_client.CollectorRegistry()
+        self._conversas = prometheus_client.Counter(
+            "analise_conversas", "Conversas analisadas", ["modelo", "resultado"], registry=registro
+        )
+        self._erros = prometheus_client.Counter(
+            "analise_erros_api", "Erros da API OpenAI por classe (inclui tentativas que foram repetidas)", ["classe"], registry=registro
+        )
+        self._cache = prometheus_client.Counter(
+            "analise_cache_hits", "Reaproveitamentos sem chamada à API", ["origem"], registry=registro
+        )
+        self._latencia = prometheus_client.Histogram(
+            "analise_latencia_requisicao_segundos", "Latência das requisições de análise", ["modelo"], registry=registro,
+            buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+        )
+        self._tokens = prometheus_client.Histogram(
+            "analise_tokens_requisicao", "Tokens por requisição de análise", ["tipo"], registry=registro,
+            buckets=(10, 50, 100, 500, 1000, 2000, 4000, 8000, 16000)
+        )
+        self._em_andamento = prometheus_client.Gauge(
+            "analise_requisicoes_em_andamento", "Requisições à API em andamento", registry=registro
+        )
+        prometheus_client.start_http_server(porta, registry=registro)
+
+    def requisicao_iniciada(self) -> None:
+        if self.ativo:
+            self._em_andamento.inc()
+
+    def requisicao_finalizada(self) -> None:
+        if self.ativo:
+            self._em_andamento.dec()
+
+    def registrar_requisicao(self, modelo: str, latencia_s: float, tokens_entrada: int, tokens_saida: int, tokens_cache: int) -> None:
+        if not self.ativo:
+            return
+        self._latencia.labels(modelo).observe(latencia_s)
+        self._tokens.labels("entrada").observe(tokens_entrada)
+        self._tokens.labels("saida").observe(tokens_saida)
+        self._tokens.labels("cache").observe(tokens_cache)
+
+    def registrar_erro(self, classe: str) -> None:
+        if self.ativo:
+            self._erros.labels(classe).inc()
+
+    def registrar_conversa(self, modelo: str, resultado: str) -> None:
+        if self.ativo:
+            self._conversas.labels(modelo or "N/A", resultado).inc()
+
+    def registrar_cache_hits(self, origem: str, quantidade: int) -> None:
+        if self.ativo and quantidade:
+            self._cache.labels(origem).inc(quantidade)
+
+# Instância única por processo (o servidor HTTP do exportador só pode subir uma vez)
+@st.cache_resource
+def obter_metricas_analise(porta) -> MetricasAnalise:
+    return MetricasAnalise(int(porta) if porta else None)
+
+METRICAS = obter_metricas_analise(METRICAS_PROMETHEUS_PORTA)
+
+# Diretório dos logs estruturados das execuções (um arquivo JSON Lines por execução)
+DIRETORIO_LOGS_EXECUCAO = os.environ.get("LOGS_EXECUCAO_DIR", "logs_execucao")
+
+# Log estruturado de uma execução
+class LogExecucao:
+    """Grava eventos da execução (início, cada conversa, fim) como uma linha JSON cada"""
+
+    def __init__(self, execucao_id: str, diretorio: str = DIRETORIO_LOGS_EXECUCAO):
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho = os.path.join(diretorio, f"execucao_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{execucao_id}.jsonl")
+        self.execucao_id = execucao_id
+        self._trava = threading.Lock()
+
+    def registrar(self, evento: str, **campos) -> None:
+        linha = {"timestamp": datetime.now().isoformat(timespec="milliseconds"), "execucao_id": self.execucao_id, "evento": evento}
+        linha.update(campos)
+        with self._trava, open(self.caminho, "a", encoding="utf-8") as arquivo:
+            arquivo.write(json.dumps(linha, ensure_ascii=False, default=str) + "\n")
+
+# Instrução de sistema enviada em todas as análises
+PROMPT_SISTEMA_AUDITOR = "Você é um Auditor de Qualidade de Atendimento Automatizado (QA). Retorne APENAS JSON válido, sem texto adicional."
+
+# Campos de instrumentação somados quando uma conversa gera mais de uma requisição
+CAMPOS_METRICAS_SOMA = ("tentativas", "tempo_espera_s", "hedges", "tokens_entrada", "tokens_saida", "tokens_cache", "custo_usd")
+
+# Função para combinar as métricas de várias requisições da mesma conversa
+def combinar_metricas(resultados: List[Dict], paralelas: bool = False) -> Dict:
+    """Soma tokens, custo, tentativas e espera; a latência é a soma (sequenciais) ou a maior (paralelas)"""
+    com_metricas = [r for r in resultados if "latencia_s" in r]
+    if not com_metricas:
+        return {}
+    latencias = [r["latencia_s"] for r in com_metricas]
+    metricas = {campo: sum(r[campo] for r in com_metricas) for campo in CAMPOS_METRICAS_SOMA}
+    metricas["tempo_espera_s"] = round(metricas["tempo_espera_s"], 1)
+    metricas["latencia_s"] = round(max(latencias) if paralelas else sum(latencias), 3)
+    metricas["tokens_estimados"] = any(r["tokens_estimados"] for r in com_metricas)
+    return metricas
+
+# Função para analisar uma conversa via OpenAI API
+def analisar_conversa_openai(conversa: str, modelo: str, api_key_openai: str = None, ao_receber_campos=None, incluir_confianca: bool = False,
+                             provedor: ProvedorChat = None) -> Dict:
+    """Analisa uma conversa via provedor de chat (resposta em streaming, encerrada assim que o veredito chega)
+
+    Sem provedor, usa a API da OpenAI com api_key_openai (respeitando OPENAI_BASE_URL).
+    Levanta ErroAnaliseAPI (ou subclasse) quando não é possível obter um veredito válido.
+    """
+    # Verificar provedor (a API Key é exigida pelo ProvedorOpenAI)
+    if provedor is None:
+        provedor = ProvedorOpenAI(api_key_openai)
+    
+    # Verificar se a conversa não está vazia
+    if not conversa or len(conversa.strip()) < 10:
+        return {
+            "acao_necessaria": False,
+            "tipo_falha": "N/A",
+            "motivo_transbordo": "N/A",
+            "descricao": "Conversa sem conteúdo suficiente para análise",
+            "sugestao_solucao": "N/A"
+        }
+    
+    # Criar prompt
+    prompt = criar_prompt_sistema(conversa, incluir_confianca)
+    campos_obrigatorios = CAMPOS_OBRIGATORIOS_VEREDITO + (("confianca",) if incluir_confianca else ())
+    
+    # Uma requisição completa (envio + streaming) dentro do prazo; a cópia do hedge não repassa campos parciais
+    def requisitar(cancelado, original):
+        inicio_requisicao = time.perf_counter()
+        prazo = inicio_requisicao + provedor.timeout_s if provedor.timeout_s else None
+        METRICAS.requisicao_iniciada()
+        try:
+            stream = provedor.criar_stream(
+                modelo,
+                [
+                    {"role": "system", "content": PROMPT_SISTEMA_AUDITOR},
+                    {"role": "user", "content": prompt}
+                ],
+                0.1,
+                formato_resposta_veredito(modelo, incluir_confianca)  # Schema estrito quando o modelo suporta
+            )
+            resposta = consumir_resposta_streaming(
+                stream, ao_receber_campos if original else None, campos_obrigatorios, prazo, cancelado
+            )
+        except Exception as e:
+            raise classificar_erro_openai(e) from e
+        finally:
+            METRICAS.requisicao_finalizada()
+        return resposta + (time.perf_counter() - inicio_requisicao,)
+    
+    # Gerar conteúdo com retry e backoff exponencial para erros transitórios (rate limit, conexão, servidor)
+    texto_resposta = ""
+    parser = None
+    uso = None
+    max_retries = 5
+    tentativas_extras = 0
+    tempo_espera = 0.0
+    latencia = 0.0
+    hedges = 0
+    
+    for tentativa in range(max_retries):
+        try:
+            inicio = time.perf_counter()
+            texto_resposta, parser, uso, _, hedges_tentativa = requisitar_com_hedge(requisitar, provedor.politica_hedge)
+            latencia = time.perf_counter() - inicio
+            hedges += hedges_tentativa
+            break  # Sucesso, sair do loop
+        except Exception as e:
+            erro = classificar_erro_openai(e)
+            METRICAS.registrar_erro(erro.classe)
+            
+            # Erros permanentes ou última tentativa: não tentar novamente
+            if not erro.reexecutavel or tentativa == max_retries - 1:
+                raise erro from e
+            
+            # Backoff exponencial: 10s, 20s, 40s, limitado a 60s (ou retry-after + 2s)
+            wait_time = min(10 * (2 ** tentativa), 60)
+            if erro.retry_after is not None:
+                wait_time = erro.retry_after + 2
+            # Prazo esgotado já consumiu o tempo da tentativa: repetir sem backoff
+            if isinstance(erro, ErroTempoEsgotado):
+                wait_time = 0.0
+            tentativas_extras += 1
+            tempo_espera += wait_time
+            time.sleep(wait_time)
+    
+    # Instrumentação da requisição (tokens estimados quando o stream foi encerrado antes do usage)
+    if uso is not None:
+        detalhes = getattr(uso, "prompt_tokens_details", None)
+        tokens_entrada = uso.prompt_tokens
+        tokens_saida = uso.completion_tokens
+        tokens_cache = (getattr(detalhes, "cached_tokens", None) or 0) if detalhes else 0
+    else:
+        tokens_entrada = estimar_tokens(PROMPT_SISTEMA_AUDITOR) + estimar_tokens(prompt)
+        tokens_saida = estimar_tokens(texto_resposta)
+        tokens_cache = 0
+    # A cópia cancelada do hedge também é cobrada pelo prompt enviado
+    tokens_entrada += hedges * (estimar_tokens(PROMPT_SISTEMA_AUDITOR) + estimar_tokens(prompt))
+    METRICAS.registrar_requisicao(modelo, latencia, tokens_entrada, tokens_saida, tokens_cache)
+    
+    if parser is None or not texto_resposta.strip():
+        METRICAS.registrar_erro(ErroRespostaInvalida.classe)
+        raise ErroRespostaInvalida("O modelo não retornou uma resposta válida")
+    
+    veredito = montar_veredito(parser.resultado())
+    if veredito is None:
+        METRICAS.registrar_erro(ErroRespostaInvalida.classe)
+        raise ErroRespostaInvalida(f"Resposta fora do schema do veredito: {texto_resposta.strip()[:150]}")
+    
+    veredito.update({
+        "modelo_utilizado": modelo,
+        "latencia_s": round(latencia, 3),
+        "tentativas": tentativas_extras,
+        "tempo_espera_s": round(tempo_espera, 1),
+        "hedges": hedges,
+        "tokens_entrada": tokens_entrada,
+        "tokens_saida": tokens_saida,
+        "tokens_cache": tokens_cache,
+        "tokens_estimados": uso is None,
+        "custo_usd": calcular_custo_tokens(modelo, tokens_entrada, tokens_saida, tokens_cache)
+    })
+    return veredito
+
+# Códigos de falante das mensagens estruturadas
+FALANTE_DESCONHECIDO = 0
+FALANTE_CLIENTE = 1
+FALANTE_AGENTE = 2  # WHIZZ, ATENDENTE BOT, Bot... (avaliados como um único agente)
+
+# Termos do rótulo que identificam o falante
+TERMOS_FALANTE_CLIENTE = ("cliente", "usuario", "usuário", "customer", "user")
+TERMOS_FALANTE_AGENTE = ("bot", "whizz", "atendente", "agente", "assistente")
+
+# Cabeçalho de mensagem: "CLIENTE - 05/01/2026 15:59:48 - texto" ou "Bot: texto"
+PADRAO_CABECALHO_MENSAGEM = re.compile(
+    r"^[ \t]*(?P<rotulo>[^\W\d_][^\n:]{0,40}?)[ \t]*"
+    r"(?:-[ \t]*(?P<dia>\d{2})/(?P<mes>\d{2})/(?P<ano>\d{4})[ \t]+(?P<hora>\d{2}):(?P<minuto>\d{2})(?::(?P<segundo>\d{2}))?[ \t]*-|:)[ \t]?",
+    re.MULTILINE
+)
+
+# Cache de parse das conversas fora de um arquivo carregado (trechos segmentados, avaliação, benchmark)
+TAMANHO_CACHE_CONVERSAS_ESTRUTURADAS = 2048
+
+# Função para identificar o falante pelo rótulo do cabeçalho (poucos rótulos distintos no arquivo inteiro)
+@lru_cache(maxsize=1024)
+def classificar_falante(rotulo: str) -> int:
+    palavras = re.findall(r"\w+", rotulo.lower())
+    if any(palavra in TERMOS_FALANTE_CLIENTE for palavra in palavras):
+        return FALANTE_CLIENTE
+    if any(palavra in TERMOS_FALANTE_AGENTE for palavra in palavras):
+        return FALANTE_AGENTE
+    return FALANTE_DESCONHECIDO
+
+# Conversa decomposta em mensagens, com arrays paralelos apontando para o texto original
+class ConversaEstruturada:
+    """Falante, timestamp e offsets de cada mensagem sobre um único buffer de texto (sem cópia por mensagem)"""
+
+    def __init__(self, texto: str, rotulos: List[str], indices_rotulo, falantes, timestamps, inicios_cabecalho, inicios, fins):
+        self.texto = texto
+        self.rotulos = rotulos                      # rótulos distintos ("CLIENTE", "WHIZZ PÓS-VENDAS"...)
+        self.indices_rotulo = indices_rotulo        # int16: rótulo de cada mensagem (-1 = sem cabeçalho)
+        self.falantes = falantes                    # int8: FALANTE_*
+        self.timestamps = timestamps                # float64: segundos desde 1970 (NaN = sem data)
+        self.inicios_cabecalho = inicios_cabecalho  # int32: início da linha do cabeçalho
+        self.inicios = inicios                      # int32: início do texto da mensagem
+        self.fins = fins                            # int32: fim do texto da mensagem (sem espaços finais)
+        self._minusculo = None
+
+    def __len__(self) -> int:
+        return len(self.falantes)
+
+    @property
+    def minusculo(self) -> str:
+        """Texto em minúsculas calculado uma vez, com os mesmos offsets do original"""
+        if self._minusculo is None:
+            minusculo = self.texto.lower()
+            if len(minusculo) != len(self.texto):
+                # Caracteres raros cuja minúscula muda de tamanho (ex.: 'İ') ficam como estão
+                minusculo = "".join(c.lower() if len(c.lower()) == 1 else c for c in self.texto)
+            self._minusculo = minusculo
+        return self._minusculo
+
+    def mensagem(self, i: int) -> str:
+        return self.texto[self.inicios[i]:self.fins[i]]
+
+    def mensagem_minuscula(self, i: int) -> str:
+        return self.minusculo[self.inicios[i]:self.fins[i]]
+
+    def turno(self, i: int) -> str:
+        """Cabeçalho + mensagem, como aparece na transcrição"""
+        return self.texto[self.inicios_cabecalho[i]:self.fins[i]]
+
+    def indices(self, falante: int) -> np.ndarray:
+        return np.flatnonzero(self.falantes == falante)
+
+    def primeira_data_hora(self) -> datetime:
+        com_data = self.timestamps[~np.isnan(self.timestamps)]
+        return datetime(1970, 1, 1) + timedelta(seconds=float(com_data[0])) if len(com_data) else None
+
+# Função para estruturar a transcrição bruta em mensagens
+def parsear_conversa(conversa: str) -> ConversaEstruturada:
+    """Reconhece cabeçalhos com data ("CLIENTE - dd/mm/aaaa hh:mm:ss - ") e no formato "Falante:"; texto sem cabeçalho vira uma mensagem de falante desconhecido"""
+    conversa = conversa or ""
+    rotulos = []
+    indices_rotulo, falantes, timestamps, inicios_cabecalho, inicios = [], [], [], [], []
+    # Poucos rótulos e datas distintos por conversa: classificação e conversão de data feitas uma vez cada
+    rotulos_vistos = {}
+    dias_desde_1970 = {}
+
+    for cabecalho in PADRAO_CABECALHO_MENSAGEM.finditer(conversa):
+        rotulo, dia, mes, ano, hora, minuto, segundo = cabecalho.groups()
+        chave_rotulo = (rotulo, ano is None)
+        if chave_rotulo not in rotulos_vistos:
+            rotulo_limpo = rotulo.strip()
+            falante = classificar_falante(rotulo_limpo)
+            # Sem data, só vale "Falante:" curto com falante reconhecido (evita "https:", "Número do pedido:"...)
+            if ano is None and (falante == FALANTE_DESCONHECIDO or len(rotulo_limpo.split()) > 3
+                                or classificar_falante(rotulo_limpo.split()[0]) != falante):
+                rotulos_vistos[chave_rotulo] = None
+            else:
+                if rotulo_limpo not in rotulos:
+                    rotulos.append(rotulo_limpo)
+                rotulos_vistos[chave_rotulo] = (rotulos.index(rotulo_limpo), falante)
+        if rotulos_vistos[chave_rotulo] is None:
+            continue
+
+        timestamp = np.nan
+        if ano is not None:
+            data = (dia, mes, ano)
+            if data not in dias_desde_1970:
+                try:
+                    dias_desde_1970[data] = (datetime(int(ano), int(mes), int(dia)) - datetime(1970, 1, 1)).days
+                except ValueError:
+                    dias_desde_1970[data] = None
+            if dias_desde_1970[data] is not None:
+                timestamp = dias_desde_1970[data] * 86400 + int(hora) * 3600 + int(minuto) * 60 + int(segundo or 0)
+
+        posicao_rotulo, falante = rotulos_vistos[chave_rotulo]
+        indices_rotulo.append(posicao_rotulo)
+        falantes.append(falante)
+        timestamps.append(timestamp)
+        inicios_cabecalho.append(cabecalho.start())
+        inicios.append(cabecalho.end())
+
+    # Texto antes do primeiro cabeçalho (ou conversa sem nenhum) vira mensagem sem falante
+    if not inicios or conversa[:inicios_cabecalho[0]].strip():
+        indices_rotulo.insert(0, -1)
+        falantes.insert(0, FALANTE_DESCONHECIDO)
+        timestamps.insert(0, np.nan)
+        inicios_cabecalho.insert(0, 0)
+        inicios.insert(0, 0)
+
+    proximos = inicios_cabecalho[1:] + [len(conversa)]
+    fins = [inicio + len(conversa[inicio:proximo].rstrip()) for inicio, proximo in zip(inicios, proximos)]
+    return ConversaEstruturada(
+        conversa,
+        rotulos,
+        np.array(indices_rotulo, dtype=np.int16),
+        np.array(falantes, dtype=np.int8),
+        np.array(timestamps, dtype=np.float64),
+        np.array(inicios_cabecalho, dtype=np.int32),
+        np.array(inicios, dtype=np.int32),
+        np.array(fins, dtype=np.int32)
+    )
+
+# Conversas estruturadas dos arquivos carregados, pelo texto: a lista da sessão (e a do job) mantém as entradas vivas
+CONVERSAS_ESTRUTURADAS_CARREGADAS = weakref.WeakValueDictionary()
+
+# Função para estruturar todas as conversas do arquivo uma única vez, na carga
+def estruturar_conversas(conversas: List[str]) -> List[ConversaEstruturada]:
+    """Lista alinhada ao conversa_numero (posição = número - 1); regras, prompt e triagem acham a mesma estrutura pelo texto"""
+    estruturas = []
+    for conversa in conversas:
+        estrutura = CONVERSAS_ESTRUTURADAS_CARREGADAS.get(conversa)
+        if estrutura is None:
+            estrutura = parsear_conversa(conversa)
+            CONVERSAS_ESTRUTURADAS_CARREGADAS[conversa] = estrutura
+        estruturas.append(estrutura)
+    return estruturas
+
+# Parse de conversas avulsas (fora do arquivo carregado), com cache LRU
+@lru_cache(maxsize=TAMANHO_CACHE_CONVERSAS_ESTRUTURADAS)
+def estruturar_conversa_avulsa(conversa: str) -> ConversaEstruturada:
+    return parsear_conversa(conversa)
+
+# Função para obter a estrutura de uma conversa: a da carga do arquivo quando existe, senão o parse avulso
+def estruturar_conversa(conversa: str) -> ConversaEstruturada:
+    estrutura = CONVERSAS_ESTRUTURADAS_CARREGADAS.get(conversa)
+    return estrutura if estrutura is not None else estruturar_conversa_avulsa(conversa)
+
+# Função para reescrever a conversa de forma compacta para o prompt
+def conversa_para_prompt(conversa: str) -> str:
+    """Uma mensagem por turno, sem as linhas em branco entre mensagens da transcrição"""
+    estrutura = estruturar_conversa(conversa)
+    return "\n".join(estrutura.turno(i) for i in range(len(estrutura)) if estrutura.fins[i] > estrutura.inicios_cabecalho[i])
+
+# Detecção de repetição do bot: shingles de palavras com MinHash + LSH (custo linear no tamanho da conversa)
+TAMANHO_SHINGLE_REPETICAO = 3
+MIN_PALAVRAS_MENSAGEM_REPETICAO = 5    # mensagens curtas ("Ok", "Opção 1") não contam como repetição
+LIMIAR_SIMILARIDADE_REPETICAO = 0.8    # Jaccard mínimo entre shingles para considerar quase-repetição
+FAIXAS_MINHASH, LINHAS_POR_FAIXA = 8, 2
+MIN_ENVIOS_LACO = 3                    # mesma mensagem enviada 3+ vezes = bot em looping
+
+# Coeficientes fixos do hashing multiplicativo (mesmas assinaturas em qualquer execução)
+_gerador_minhash = np.random.default_rng(20260105)
+COEFICIENTES_MINHASH = _gerador_minhash.integers(1, 2 ** 63, FAIXAS_MINHASH * LINHAS_POR_FAIXA, dtype=np.uint64) | np.uint64(1)
+DESLOCAMENTOS_MINHASH = _gerador_minhash.integers(0, 2 ** 63, FAIXAS_MINHASH * LINHAS_POR_FAIXA, dtype=np.uint64)
+
+# Função para detectar mensagens do bot repetidas ou quase repetidas em qualquer ponto da conversa
+def detectar_repeticoes_bot(estrutura: ConversaEstruturada) -> Dict:
+    """Agrupa mensagens do agente com shingles quase idênticos; retorna contagens e a posição (nº da mensagem) de cada grupo"""
+    indices_agente = estrutura.indices(FALANTE_AGENTE)
+    # Cópias exatas (o caso mais comum) são agrupadas pelo texto, sem tokenizar de novo
+    posicao_texto = {}
+    mensagens, envios, palavras = [], [], []
+    for i in indices_agente.tolist():
+        texto = estrutura.mensagem_minuscula(i)
+        if texto in posicao_texto:
+            if posicao_texto[texto] is not None:
+                envios[posicao_texto[texto]].append(i)
+            continue
+        palavras_mensagem = re.findall(r"\w+", texto)
+        if len(palavras_mensagem) < MIN_PALAVRAS_MENSAGEM_REPETICAO:
+            posicao_texto[texto] = None
+            continue
+        posicao_texto[texto] = len(mensagens)
+        mensagens.append(i)
+        envios.append([i])
+        palavras.append(palavras_mensagem)
+
+    # Quase-repetições entre mensagens distintas: união das que passam no Jaccard
+    pais = list(range(len(mensagens)))
+    def raiz(posicao):
+        while pais[posicao] != posicao:
+            pais[posicao] = pais[pais[posicao]]
+            posicao = pais[posicao]
+        return posicao
+
+    similaridade_minima = {}
+    if len(mensagens) > 1:
+        # Hash por palavra distinta; shingles combinam os hashes das palavras vizinhas dentro da mesma mensagem
+        vocabulario = {}
+        ids = np.array([vocabulario.setdefault(palavra, len(vocabulario)) for lista in palavras for palavra in lista], dtype=np.int64)
+        hashes = np.array([zlib.crc32(palavra.encode("utf-8")) for palavra in vocabulario], dtype=np.uint64)[ids]
+        donos = np.repeat(np.arange(len(mensagens), dtype=np.uint64), [len(lista) for lista in palavras])
+        k = TAMANHO_SHINGLE_REPETICAO
+        mesmo_dono = donos[:len(donos) - k + 1] == donos[k - 1:]
+        combinados = hashes[:len(hashes) - k + 1].copy()
+        for deslocamento in range(1, k):
+            combinados = combinados * np.uint64(1000003) ^ hashes[deslocamento:len(hashes) - k + 1 + deslocamento]
+        # Pares (mensagem, shingle) distintos, ordenados por mensagem (sort + máscara: mais rápido que np.unique em arrays pequenos)
+        pares = np.sort((donos[:len(donos) - k + 1][mesmo_dono] << np.uint64(32)) | (combinados[mesmo_dono] & np.uint64(0xFFFFFFFF)))
+        pares = pares[np.concatenate(([True], pares[1:] != pares[:-1]))]
+        inicios = np.searchsorted(pares >> np.uint64(32), np.arange(len(mensagens) + 1, dtype=np.uint64)).tolist()
+        shingles = pares & np.uint64(0xFFFFFFFF)
+
+        # Assinaturas MinHash de todas as mensagens de uma vez; cada faixa de LINHAS_POR_FAIXA valores vira uma chave
+        misturados = (shingles[:, None] * COEFICIENTES_MINHASH + DESLOCAMENTOS_MINHASH) >> np.uint64(32)
+        assinaturas = np.minimum.reduceat(misturados, inicios[:-1], axis=0)
+        chaves = assinaturas[:, 0::LINHAS_POR_FAIXA]
+        for linha in range(1, LINHAS_POR_FAIXA):
+            chaves = chaves * np.uint64(1000003) ^ assinaturas[:, linha::LINHAS_POR_FAIXA]
+
+        # Mensagens que coincidem em alguma faixa viram candidatas; o Jaccard exato dos shingles confirma
+        conjuntos = [None] * len(mensagens)
+        baldes = {}
+        for posicao, chaves_mensagem in enumerate(chaves.tolist()):
+            candidatas = set()
+            for faixa, chave in enumerate(chaves_mensagem):
+                candidatas.update(baldes.setdefault((faixa, chave), []))
+                baldes[(faixa, chave)].append(posicao)
+            for candidata in candidatas:
+                if raiz(candidata) == raiz(posicao):
+                    continue
+                for indice in (candidata, posicao):
+                    if conjuntos[indice] is None:
+                        conjuntos[indice] = set(shingles[inicios[indice]:inicios[indice + 1]].tolist())
+                jaccard = len(conjuntos[candidata] & conjuntos[posicao]) / len(conjuntos[candidata] | conjuntos[posicao])
+                if jaccard >= LIMIAR_SIMILARIDADE_REPETICAO:
+                    raiz_candidata, raiz_posicao = raiz(candidata), raiz(posicao)
+                    pais[raiz_posicao] = raiz_candidata
+                    similaridade_minima[raiz_candidata] = min(
+                        jaccard, similaridade_minima.get(raiz_candidata, 1.0), similaridade_minima.pop(raiz_posicao, 1.0)
+                    )
+
+    resumo = {"mensagens_bot": len(indices_agente), "repeticoes": 0, "maior_repeticao": 1 if mensagens else 0, "grupos": []}
+    grupos = {}
+    for posicao in range(len(mensagens)):
+        grupos.setdefault(raiz(posicao), []).extend(envios[posicao])
+    for raiz_grupo, enviadas in grupos.items():
+        if len(enviadas) < 2:
+            continue
+        enviadas.sort()
+        resumo["grupos"].append({
+            "mensagens": [i + 1 for i in enviadas],
+            "similaridade": round(similaridade_minima.get(raiz_grupo, 1.0), 2),
+            "exemplo": estrutura.mensagem(enviadas[0])[:80]
+        })
+        resumo["repeticoes"] += len(enviadas) - 1
+        resumo["maior_repeticao"] = max(resumo["maior_repeticao"], len(enviadas))
+    resumo["grupos"].sort(key=lambda grupo: -len(grupo["mensagens"]))
+    return resumo
+
+# Função para resumir a repetição do bot nas colunas do resultado
+def colunas_repeticao_bot(conversa: str, estrutura: ConversaEstruturada = None) -> Dict:
+    repeticoes = detectar_repeticoes_bot(estrutura if estrutura is not None else estruturar_conversa(conversa))
+    return {
+        "repeticoes_bot": repeticoes["repeticoes"],
+        "maior_repeticao_bot": repeticoes["maior_repeticao"],
+        "mensagens_repetidas_bot": "; ".join(
+            f"{len(grupo['mensagens'])}x nas mensagens {', '.join(map(str, grupo['mensagens']))}: {grupo['exemplo']}"
+            for grupo in repeticoes["grupos"][:3]
+        ) or "N/A"
+    }
+
+# Métricas de tempo do atendimento, extraídas dos timestamps das mensagens (sem custo de LLM)
+LIMIAR_PAUSA_LONGA_S = 600  # silêncio de 10+ minutos entre mensagens = cliente abandonou e voltou (ou não voltou)
+COLUNAS_TEMPOS_CONVERSA = [
+    "duracao_sessao_s", "latencia_bot_media_s", "latencia_bot_max_s", "espera_transbordo_s",
+    "maior_espera_cliente_s", "pausas_longas", "abandono_cliente"
+]
+
+# Mensagem do bot que encerra o atendimento automatizado: transferência para humano ou direcionamento ao SAC/central
+PADRAO_MENSAGEM_TRANSBORDO = re.compile(
+    r"transferi|transferindo|atendimento\s+ao\s+cliente|\bsac\b|nossa\s+central|central\s+de\s+atendimento|formul[aá]rio"
+)
+
+# Função para calcular as métricas de tempo de todas as conversas de uma vez
+def calcular_tempos_conversas(conversas: List[str], estruturas: List[ConversaEstruturada] = None) -> pd.DataFrame:
+    """Retorna um DataFrame indexado pelo conversa_numero (1-based) com latência do bot, espera até o transbordo, duração e pausas"""
+    total = len(conversas)
+    if not total:
+        return pd.DataFrame(columns=COLUNAS_TEMPOS_CONVERSA)
+
+    # Arrays de todas as mensagens do arquivo concatenados; o texto só é consultado para achar o transbordo e o fim da conversa
+    timestamps, falantes, tamanhos = [], [], []
+    primeiro_transbordo = np.full(total, np.nan)
+    termina_em_pergunta_bot = np.zeros(total, dtype=bool)
+    for posicao, conversa in enumerate(conversas):
+        estrutura = estruturas[posicao] if estruturas is not None else estruturar_conversa(conversa)
+        timestamps.append(estrutura.timestamps)
+        falantes.append(estrutura.falantes)
+        tamanhos.append(len(estrutura))
+        for ocorrencia in PADRAO_MENSAGEM_TRANSBORDO.finditer(estrutura.minusculo):
+            mensagem = int(np.searchsorted(estrutura.inicios_cabecalho, ocorrencia.start(), side="right")) - 1
+            if estrutura.falantes[mensagem] == FALANTE_AGENTE:
+                primeiro_transbordo[posicao] = estrutura.timestamps[mensagem]
+                break
+        ultima = len(estrutura) - 1
+        termina_em_pergunta_bot[posicao] = (
+            estrutura.falantes[ultima] == FALANTE_AGENTE and estrutura.texto[estrutura.fins[ultima] - 1:estrutura.fins[ultima]] == "?"
+        )
+
+    timestamps = np.concatenate(timestamps)
+    falantes = np.concatenate(falantes)
+    tamanhos = np.array(tamanhos)
+    inicios = np.concatenate(([0], np.cumsum(tamanhos)[:-1]))
+    dono = np.repeat(np.arange(total), tamanhos)
+
+    # Intervalos entre mensagens consecutivas da mesma conversa, classificados pela troca de falante
+    intervalos = np.diff(timestamps)
+    mesma_conversa = dono[1:] == dono[:-1]
+    dono_intervalo = dono[1:]
+    resposta_bot = mesma_conversa & (falantes[:-1] == FALANTE_CLIENTE) & (falantes[1:] == FALANTE_AGENTE) & ~np.isnan(intervalos)
+    espera_cliente = mesma_conversa & (falantes[:-1] == FALANTE_AGENTE) & (falantes[1:] == FALANTE_CLIENTE) & ~np.isnan(intervalos)
+    pausa_longa = mesma_conversa & (intervalos >= LIMIAR_PAUSA_LONGA_S)
+
+    def maximo_por_conversa(mascara: np.ndarray) -> np.ndarray:
+        maximos = np.full(total, np.nan)
+        np.fmax.at(maximos, dono_intervalo[mascara], intervalos[mascara])
+        return maximos
+
+    respostas = np.bincount(dono_intervalo[resposta_bot], minlength=total)
+    soma_respostas = np.bincount(dono_intervalo[resposta_bot], weights=intervalos[resposta_bot], minlength=total)
+    primeira_mensagem_cliente = np.fmin.reduceat(np.where(falantes == FALANTE_CLIENTE, timestamps, np.nan), inicios)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tempos = pd.DataFrame({
+            "duracao_sessao_s": np.fmax.reduceat(timestamps, inicios) - np.fmin.reduceat(timestamps, inicios),
+            "latencia_bot_media_s": np.round(soma_respostas / respostas, 1),
+            "latencia_bot_max_s": maximo_por_conversa(resposta_bot),
+            "espera_transbordo_s": primeiro_transbordo - primeira_mensagem_cliente,
+            "maior_espera_cliente_s": maximo_por_conversa(espera_cliente),
+            "pausas_longas": np.bincount(dono_intervalo[pausa_longa], minlength=total),
+            "abandono_cliente": np.where(termina_em_pergunta_bot, "Sim", "Não")
+        }, index=pd.RangeIndex(1, total + 1, name="conversa_numero"))
+    # Transbordo antes da primeira mensagem do cliente (ou sem data) não é espera
+    tempos.loc[tempos["espera_transbordo_s"] < 0, "espera_transbordo_s"] = np.nan
+    return tempos
+
+# Função para resumir as métricas de tempo das conversas analisadas (SLA do bot)
+def resumir_tempos_atendimento(df_resultados: pd.DataFrame) -> Dict:
+    """Mediana e p90 de latência do bot, espera até o transbordo e duração; None se o arquivo não tinha timestamps"""
+    if "duracao_sessao_s" not in df_resultados.columns or df_resultados["duracao_sessao_s"].isna().all():
+        return None
+    resumo = {}
+    for coluna in ("latencia_bot_media_s", "espera_transbordo_s", "duracao_sessao_s"):
+        valores = pd.to_numeric(df_resultados[coluna], errors="coerce").dropna()
+        resumo[coluna] = {"p50": valores.median(), "p90": valores.quantile(0.9)} if len(valores) else None
+    resumo["com_transbordo"] = int(df_resultados["espera_transbordo_s"].notna().sum())
+    resumo["abandonos"] = int((df_resultados["abandono_cliente"] == "Sim").sum())
+    resumo["pausas_longas"] = int((pd.to_numeric(df_resultados["pausas_longas"], errors="coerce") > 0).sum())
+    resumo["total"] = len(df_resultados)
+    return resumo
+
+# Função para copiar as métricas de tempo da conversa para o resultado
+def adicionar_tempos_conversa(resultado: Dict, idx: int, tempos_conversas: pd.DataFrame) -> None:
+    if tempos_conversas is None or idx not in tempos_conversas.index:
+        return
+    for campo, valor in tempos_conversas.loc[idx].items():
+        resultado[campo] = None if pd.isna(valor) else (valor.item() if hasattr(valor, "item") else valor)
+
+# Padrões das regras locais (compartilhados pela análise local e pela priorização por risco)
+PADROES_SINAIS_LOCAIS = {
+    # Cliente pede atendimento humano
+    "pede_humano": [
+        r'falar\s+com\s+(?:um\s+)?(?:atendente|humano|pessoa|operador)',
+        r'quero\s+(?:falar\s+)?com\s+(?:um\s+)?(?:atendente|humano|pessoa)',
+        r'preciso\s+de\s+(?:um\s+)?(?:atendente|humano|pessoa)',
+        r'atendente\s+(?:humano|pessoa)',
+        r'transferir\s+para\s+(?:um\s+)?(?:atendente|humano|pessoa)'
+    ],
+    # Cliente reclama de repetição
+    "tem_looping": [
+        r'(?:repete|repetiu|repetindo|loop)',
+        r'mesma\s+(?:coisa|mensagem|resposta)',
+        r'já\s+(?:falei|disse|respondi)',
+        r'não\s+entende'
+    ],
+    # Erro do bot
+    "tem_erro": [
+        r'erro',
+        r'não\s+funcionou',
+        r'não\s+está\s+funcionando',
+        r'bug',
+        r'problema\s+técnico',
+        r'falha'
+    ],
+    # Cliente frustrado
+    "cliente_frustrado": [
+        r'irritado|irritada',
+        r'estou\s+bravo|estou\s+brava',
+        r'não\s+resolveu',
+        r'incompetente',
+        r'horrível|péssimo'
+    ],
+    # Cliente nega recebimento ou status
+    "tem_divergencia": [
+        r'não\s+recebi',
+        r'não\s+foi\s+entregue',
+        r'está\s+errado',
+        r'não\s+é\s+isso',
+        r'diferente\s+do\s+que\s+comprei',
+        r'pedido\s+errado'
+    ],
+    # Bot transferiu para fila humana
+    "tem_transferencia": [
+        r'transferindo\s+para\s+(?:um\s+)?(?:atendente|humano|equipe)',
+        r'vou\s+transferir\s+você',
+        r'conectando\s+com\s+(?:um\s+)?atendente'
+    ],
+    # Link externo/SAC (não conta como transferência)
+    "tem_link": [
+        r'https?://',
+        r'www\.',
+        r'\.com\.br',
+        r'formulário|formulario',
+        r'sac|contato',
+        r'troque\.app',
+        r'crocs\.com\.br/contato'
+    ]
+}
+
+# Função para detectar os sinais das regras locais em uma conversa
+def detectar_sinais_locais(conversa: str, estrutura: ConversaEstruturada = None) -> Dict:
+    """Flags de cada grupo de padrões + repetição do bot; looping também vale quando o bot envia a mesma mensagem MIN_ENVIOS_LACO+ vezes"""
+    if estrutura is None:
+        estrutura = estruturar_conversa(conversa)
+    sinais = {
+        nome: any(re.search(padrao, estrutura.minusculo) for padrao in padroes)
+        for nome, padroes in PADROES_SINAIS_LOCAIS.items()
+    }
+    sinais["repeticoes"] = detectar_repeticoes_bot(estrutura)
+    sinais["tem_looping"] = sinais["tem_looping"] or sinais["repeticoes"]["maior_repeticao"] >= MIN_ENVIOS_LACO
+    return sinais
+
+# Pesos dos sinais locais na prioridade de análise (conversas de maior risco vão primeiro para a API)
+PESOS_RISCO = {
+    "pede_humano": 3.0,
+    "tem_looping": 3.0,
+    "tem_divergencia": 2.0,
+    "tem_erro": 2.0,
+    "cliente_frustrado": 2.0,
+    "transbordo": 1.0  # bot transferiu ou direcionou ao SAC/central
+}
+MENSAGENS_RISCO_MAXIMO = 60  # comprimento soma até 1 ponto, proporcional ao nº de mensagens
+
+# Função para pontuar o risco de uma conversa só com sinais locais (sem API)
+def pontuar_risco_conversa(conversa: str, estrutura: ConversaEstruturada = None) -> float:
+    if estrutura is None:
+        estrutura = estruturar_conversa(conversa)
+    sinais = detectar_sinais_locais(conversa, estrutura)
+    pontos = sum(peso for nome, peso in PESOS_RISCO.items() if sinais.get(nome))
+    if sinais["tem_transferencia"] or PADRAO_MENSAGEM_TRANSBORDO.search(estrutura.minusculo):
+        pontos += PESOS_RISCO["transbordo"]
+    return round(pontos + min(len(estrutura) / MENSAGENS_RISCO_MAXIMO, 1.0), 3)
+
+# Função para pontuar todas as conversas carregadas
+def calcular_riscos_conversas(conversas: List[str], ao_progresso=None, estruturas: List[ConversaEstruturada] = None) -> np.ndarray:
+    riscos = np.zeros(len(conversas), dtype=np.float32)
+    for posicao, conversa in enumerate(conversas):
+        riscos[posicao] = pontuar_risco_conversa(conversa, estruturas[posicao] if estruturas is not None else None)
+        if ao_progresso and (posicao + 1) % TAMANHO_LOTE_INDICE == 0:
+            ao_progresso((posicao + 1) / len(conversas))
+    return riscos
+
+# Função para definir a ordem de análise (conversa_numero, 1-based)
+def ordenar_conversas_analise(total: int, riscos: np.ndarray = None, ordem: str = ORDENS_ANALISE[0]) -> List[int]:
+    """Maior risco primeiro (empates na ordem do arquivo); sem pontuação, ordem do arquivo"""
+    if ordem != ORDENS_ANALISE[0] or riscos is None or len(riscos) != total:
+        return list(range(1, total + 1))
+    return (np.argsort(-riscos, kind="stable") + 1).tolist()
+
+# Função para analisar uma conversa localmente usando regras de negócio
+def analisar_conversa_local(conversa: str) -> Dict:
+    """Analisa uma conversa usando regras de negócio locais (sem API)"""
+    try:
+        # Verificar se a conversa não está vazia
+        if not conversa or len(conversa.strip()) < 10:
+            return {
+                "necessidade_transbordo": "Não",
+                "transferencia": "Não",
+                "agente_agiu_corretamente": "Sim",
+                "motivo_transbordo": "N/A",
+                "problema_mapeado": "Conversa muito curta",
+                "precisa_atencao": "Não",
+                "observacao": "Conversa sem conteúdo suficiente para análise"
+            }
         
-        cliente_frustrado_patterns = [
-            r'irritado|irritada',
-            r'estou\s+bravo|estou\s+brava',
-            r'não\s+resolveu',
-            r'incompetente',
-            r'horrível|péssimo'
-        ]
+        # Mensagens com falante identificado (parse feito na carga do arquivo, o mesmo usado pelo prompt)
+        estrutura = estruturar_conversa(conversa)
+        conversa_lower = estrutura.minusculo
         
-        # Verificar necessidade de transbordo
-        pede_humano = any(re.search(pattern, conversa_lower) for pattern in pede_humano_patterns)
-        tem_looping = any(re.search(pattern, conversa_lower) for pattern in looping_patterns)
-        tem_erro = any(re.search(pattern, conversa_lower) for pattern in erro_bot_patterns)
-        cliente_frustrado = any(re.search(pattern, conversa_lower) for pattern in cliente_frustrado_patterns)
+        # Sinais das regras (os mesmos usados para priorizar as conversas por risco)
+        sinais = detectar_sinais_locais(conversa)
+        pede_humano, tem_looping, tem_erro = sinais["pede_humano"], sinais["tem_looping"], sinais["tem_erro"]
+        cliente_frustrado, tem_divergencia = sinais["cliente_frustrado"], sinais["tem_divergencia"]
+        tem_transferencia, tem_link = sinais["tem_transferencia"], sinais["tem_link"]
+        repeticoes = sinais["repeticoes"]
         
-        # Verificar divergência (cliente nega recebimento ou status)
-        divergencia_patterns = [
-            r'não\s+recebi',
-            r'não\s+foi\s+entregue',
-            r'está\s+errado',
-            r'não\s+é\s+isso',
-            r'diferente\s+do\s+que\s+comprei',
-            r'pedido\s+errado'
-        ]
-        tem_divergencia = any(re.search(pattern, conversa_lower) for pattern in divergencia_patterns)
+        # 1. NECESSIDADE DE TRANSBORDO
+        necessidade_transbordo = "Não"
+        motivo_transbordo = "N/A"
         
         if pede_humano:
             necessidade_transbordo = "Sim"
@@ -697,25 +2066,6 @@ def analisar_conversa_local(conversa: str) -> Dict:
         # 2. TRANSFERÊNCIA
         transferencia = "Não"
         # Verificar se bot transferiu para fila humana (não link externo)
-        transferencia_patterns = [
-            r'transferindo\s+para\s+(?:um\s+)?(?:atendente|humano|equipe)',
-            r'vou\s+transferir\s+você',
-            r'conectando\s+com\s+(?:um\s+)?atendente'
-        ]
-        
-        link_externo_patterns = [
-            r'https?://',
-            r'www\.',
-            r'\.com\.br',
-            r'formulário|formulario',
-            r'sac|contato',
-            r'troque\.app',
-            r'crocs\.com\.br/contato'
-        ]
-        
-        tem_transferencia = any(re.search(pattern, conversa_lower) for pattern in transferencia_patterns)
-        tem_link = any(re.search(pattern, conversa_lower) for pattern in link_externo_patterns)
-        
         if tem_transferencia and not tem_link:
             transferencia = "Sim"
         elif tem_link:
@@ -737,12 +2087,12 @@ def analisar_conversa_local(conversa: str) -> Dict:
         cliente_texto_antes = False
         bot_pediu_avaliacao = False
         
-        for i, linha in enumerate(linhas):
-            if re.search(avaliacao_pattern, linha.lower()) and ('bot' in linha.lower() or 'atendente' in linha.lower() or 'whizz' in linha.lower()):
+        for i in estrutura.indices(FALANTE_AGENTE):
+            if re.search(avaliacao_pattern, estrutura.mensagem_minuscula(i)):
                 bot_pediu_avaliacao = True
                 # Verificar se cliente digitou texto antes
                 for j in range(max(0, i-3), i):
-                    if 'cliente' in linhas[j].lower() and len(linhas[j]) > 20:
+                    if estrutura.falantes[j] == FALANTE_CLIENTE and estrutura.fins[j] - estrutura.inicios[j] > 20:
                         cliente_texto_antes = True
                         break
                 break
@@ -777,17 +2127,6 @@ def analisar_conversa_local(conversa: str) -> Dict:
         # 6. OBSERVAÇÃO - Descrição detalhada e contextualizada dos problemas encontrados
         detalhes_problemas = []
         
-        # Capturar contexto específico da conversa
-        contexto_cliente = []
-        contexto_bot = []
-        
-        for linha in linhas[:20]:  # Analisar primeiras 20 linhas para contexto
-            linha_lower = linha.lower()
-            if 'cliente' in linha_lower and len(linha.strip()) > 15:
-                contexto_cliente.append(linha.strip()[:100])
-            elif any(termo in linha_lower for termo in ['bot', 'atendente', 'whizz']) and len(linha.strip()) > 15:
-                contexto_bot.append(linha.strip()[:100])
-        
         # Detalhar problemas específicos encontrados com contexto
         
         # Necessidade de transbordo
@@ -798,23 +2137,12 @@ def analisar_conversa_local(conversa: str) -> Dict:
                 detalhes_transbordo.append("Cliente solicitou explicitamente atendimento humano")
             
             if tem_looping:
-                # Contar respostas do bot para detectar repetição
-                respostas_bot = [linha for linha in linhas if any(termo in linha.lower() for termo in ['bot', 'atendente', 'whizz'])]
-                if len(respostas_bot) > 3:
-                    # Verificar similaridade entre respostas
-                    similar_count = 0
-                    for i in range(len(respostas_bot)-1):
-                        if i < len(respostas_bot)-1:
-                            palavras_linha1 = set(respostas_bot[i].lower().split())
-                            palavras_linha2 = set(respostas_bot[i+1].lower().split())
-                            palavras_comuns = palavras_linha1 & palavras_linha2
-                            if len(palavras_comuns) > 5 and len(respostas_bot[i].split()) > 5:
-                                similar_count += 1
-                    
-                    if similar_count > 0:
-                        detalhes_transbordo.append(f"Bot entrou em looping: detectadas {similar_count + 1} respostas repetitivas/conflitantes. Cliente relatou que o bot 'não entende' ou repete a mesma informação.")
-                    else:
-                        detalhes_transbordo.append("Bot entrou em looping - respostas repetitivas detectadas na conversa. Cliente indicou que bot repete mesma informação ou não avança no atendimento.")
+                if repeticoes["grupos"]:
+                    grupo = repeticoes["grupos"][0]
+                    detalhes_transbordo.append(
+                        f"Bot entrou em looping: {repeticoes['repeticoes']} mensagem(ns) repetida(s); a mesma resposta foi enviada "
+                        f"{len(grupo['mensagens'])}x (mensagens {', '.join(map(str, grupo['mensagens']))}): \"{grupo['exemplo']}\""
+                    )
                 else:
                     detalhes_transbordo.append("Bot entrou em looping - padrões de repetição detectados. Cliente mencionou que bot não está entendendo ou repete respostas.")
             
@@ -942,7 +2270,7 @@ def processar_txt(conteudo: str) -> List[str]:
 
 # Função para processar arquivo CSV
 def processar_csv(conteudo: str) -> Dict:
-    """Processa arquivo CSV com coluna 'conversa' ou 'Conversa' e retorna conversas + DataFrame completo"""
+    """Processa arquivo CSV com coluna 'conversa' ou 'Conversa' e retorna conversas + DataFrame com as demais colunas"""
     try:
         # Tentar diferentes métodos de leitura do CSV
         df = None
@@ -1005,7 +2333,9 @@ def processar_csv(conteudo: str) -> Dict:
                 indices_validos.append(idx)
         
         # Filtrar DataFrame para manter apenas linhas com conversas válidas
-        df_filtrado = df.iloc[indices_validos].copy() if indices_validos else df.copy()
+        # A coluna de conversa é descartada: o texto fica só na lista de conversas (armazenamento único)
+        df_filtrado = df.iloc[indices_validos] if indices_validos else df
+        df_filtrado = df_filtrado.drop(columns=[coluna_conversa])
         
         return {
             "conversas": conversas_processadas,
@@ -1019,6 +2349,235 @@ def processar_csv(conteudo: str) -> Dict:
             st.code(traceback.format_exc())
         return {"conversas": [], "dataframe": None}
 
+# Largura da coluna de conversa nas planilhas exportadas
+LARGURA_COLUNA_CONVERSA = 100
+
+# Linhas convertidas por vez ao gravar planilhas (limita a memória da exportação)
+LINHAS_POR_BLOCO_EXCEL = 5000
+
+# Função para iterar as linhas de um DataFrame em blocos de valores Python
+def iterar_linhas_em_blocos(df: pd.DataFrame, tamanho_bloco: int = LINHAS_POR_BLOCO_EXCEL):
+    """Gera as linhas do DataFrame como listas de valores nativos (NaN → None), bloco a bloco"""
+    for inicio in range(0, len(df), tamanho_bloco):
+        bloco = df.iloc[inicio:inicio + tamanho_bloco].astype(object)
+        bloco = bloco.where(bloco.notna(), None)
+        yield from bloco.values.tolist()
+
+# Função para criar um nome de aba válido e único no Excel
+def nome_aba_excel(nome: str, existentes) -> str:
+    """Remove caracteres proibidos, limita a 31 caracteres e evita nomes repetidos"""
+    nome = re.sub(r'[\[\]:*?/\\]', '_', str(nome)).strip() or "Sem Nome"
+    candidato = nome[:31]
+    sufixo = 2
+    while candidato in existentes:
+        marcador = f" ({sufixo})"
+        candidato = nome[:31 - len(marcador)] + marcador
+        sufixo += 1
+    return candidato
+
+# Função para particionar o DataFrame por retailer em uma única passada
+def particionar_por_retailer(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Agrupa o DataFrame por retailer (groupby único); linhas sem retailer vão para 'Sem Retailer'"""
+    chave = df["retailer"].where(df["retailer"].notna(), "N/A").astype(str).str.strip()
+    chave = chave.where(chave != "", "N/A")
+
+    particoes = {}
+    for retailer, df_retailer in df.groupby(chave, sort=False):
+        nome = "Sem Retailer" if retailer == "N/A" else retailer
+        particoes[nome_aba_excel(nome, particoes)] = df_retailer
+    return particoes
+
+# Formatos disponíveis para o ZIP por retailer (Parquet depende do pyarrow)
+def formatos_zip_disponiveis() -> List[str]:
+    """Lista os formatos de arquivo suportados no ZIP por retailer"""
+    formatos = ["CSV"]
+    try:
+        import pyarrow  # noqa: F401
+        formatos.append("Parquet")
+    except ImportError:
+        pass
+    return formatos
+
+# Função para serializar uma partição em bytes
+def serializar_particao(df: pd.DataFrame, formato: str) -> bytes:
+    """Converte a partição em CSV (mesmo padrão do download CSV) ou Parquet"""
+    if formato == "Parquet":
+        buffer = BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    return df.to_csv(index=False, quoting=csv.QUOTE_ALL).encode('utf-8-sig')
+
+# Função para gerar ZIP com um arquivo por retailer
+def gerar_zip_por_retailer(particoes: Dict[str, pd.DataFrame], formato: str = "CSV") -> bytes:
+    """Serializa as partições em paralelo e grava um arquivo por retailer no ZIP"""
+    extensao = "parquet" if formato == "Parquet" else "csv"
+    nomes = list(particoes.keys())
+
+    with ThreadPoolExecutor(max_workers=min(len(nomes), 8) or 1) as executor:
+        conteudos = list(executor.map(lambda nome: serializar_particao(particoes[nome], formato), nomes))
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for nome, conteudo in zip(nomes, conteudos):
+            arquivo_zip.writestr(f"{nome}.{extensao}", conteudo)
+    return buffer.getvalue()
+
+# Função para gerar planilha Excel com writer em streaming
+def gerar_excel(abas: Dict[str, pd.DataFrame]) -> bytes:
+    """Gera um .xlsx com uma aba por DataFrame, gravando linha a linha e com estilo único na coluna de conversa"""
+    buffer = BytesIO()
+
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    if xlsxwriter is not None:
+        # constant_memory grava cada linha no disco assim que a próxima começa
+        workbook = xlsxwriter.Workbook(buffer, {
+            'constant_memory': True,
+            'strings_to_numbers': False,
+            'strings_to_formulas': False,
+            'strings_to_urls': False
+        })
+        formato_cabecalho = workbook.add_format({'bold': True, 'border': 1})
+        formato_conversa = workbook.add_format({'text_wrap': True, 'valign': 'top'})
+
+        for nome_aba, df in abas.items():
+            worksheet = workbook.add_worksheet(nome_aba)
+            colunas = [str(col) for col in df.columns]
+            if "conversa" in colunas:
+                col_idx = colunas.index("conversa")
+                worksheet.set_column(col_idx, col_idx, LARGURA_COLUNA_CONVERSA, formato_conversa)
+            worksheet.write_row(0, 0, colunas, formato_cabecalho)
+            for linha, valores in enumerate(iterar_linhas_em_blocos(df), 1):
+                worksheet.write_row(linha, 0, valores)
+
+        workbook.close()
+        return buffer.getvalue()
+
+    # Alternativa: openpyxl em modo write-only (sem manter as células em memória)
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    fonte_cabecalho = Font(bold=True)
+    alinhamento_conversa = Alignment(wrap_text=True, vertical='top')
+
+    for nome_aba, df in abas.items():
+        worksheet = workbook.create_sheet(nome_aba)
+        colunas = [str(col) for col in df.columns]
+        col_idx = colunas.index("conversa") if "conversa" in colunas else None
+        if col_idx is not None:
+            worksheet.column_dimensions[get_column_letter(col_idx + 1)].width = LARGURA_COLUNA_CONVERSA
+
+        cabecalho = []
+        for col in colunas:
+            celula = WriteOnlyCell(worksheet, value=col)
+            celula.font = fonte_cabecalho
+            cabecalho.append(celula)
+        worksheet.append(cabecalho)
+
+        for valores in iterar_linhas_em_blocos(df):
+            if col_idx is not None:
+                celula = WriteOnlyCell(worksheet, value=valores[col_idx])
+                celula.alignment = alinhamento_conversa
+                valores[col_idx] = celula
+            worksheet.append(valores)
+
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+# Conversas indexadas por lote durante a carga do arquivo
+TAMANHO_LOTE_INDICE = 1000
+
+# Índice de texto completo das conversas (SQLite FTS5, com índice invertido em memória como alternativa)
+class IndiceConversas:
+    """Índice invertido das conversas por conversa_numero; não guarda o texto (consulta o armazenamento único)"""
+
+    def __init__(self):
+        self.total = 0
+        self._conexao = None
+        self._tokens = None
+        try:
+            conexao = sqlite3.connect(":memory:", check_same_thread=False)
+            # content='' cria um índice sem cópia do texto (contentless)
+            conexao.execute(
+                "CREATE VIRTUAL TABLE conversas_fts USING fts5("
+                "texto, content='', tokenize=\"unicode61 remove_diacritics 2\")"
+            )
+            self._conexao = conexao
+        except sqlite3.OperationalError:
+            # SQLite sem FTS5: índice invertido posicional em memória (termo → {conversa_numero: posições})
+            self._tokens = {}
+            self._vocabulario = []
+
+    @property
+    def motor(self) -> str:
+        return "SQLite FTS5" if self._conexao is not None else "índice em memória"
+
+    def adicionar(self, itens: List[tuple]) -> None:
+        """Indexa os itens (conversa_numero, texto)"""
+        if self._conexao is not None:
+            with self._conexao:
+                self._conexao.executemany("INSERT INTO conversas_fts(rowid, texto) VALUES (?, ?)", itens)
+        else:
+            for numero, texto in itens:
+                for posicao, token in enumerate(tokenizar_busca(texto)):
+                    self._tokens.setdefault(token, {}).setdefault(numero, []).append(posicao)
+            self._vocabulario = sorted(self._tokens)
+        self.total += len(itens)
+
+    def buscar(self, termo: str) -> set:
+        """Retorna os conversa_numero que contêm os termos em sequência (o último termo aceita prefixo)"""
+        tokens = tokenizar_busca(termo)
+        if not tokens:
+            return set()
+        if self._conexao is not None:
+            consulta = '"' + " ".join(tokens) + '"*'
+            cursor = self._conexao.execute("SELECT rowid FROM conversas_fts WHERE conversas_fts MATCH ?", (consulta,))
+            return {linha[0] for linha in cursor}
+        # Alternativa com a mesma semântica da consulta FTS5 acima: frase exata com prefixo no último termo
+        ultimos = {}
+        inicio = bisect.bisect_left(self._vocabulario, tokens[-1])
+        for token in itertools.takewhile(lambda t: t.startswith(tokens[-1]), self._vocabulario[inicio:]):
+            for numero, posicoes in self._tokens[token].items():
+                ultimos.setdefault(numero, set()).update(posicoes)
+        anteriores = [self._tokens.get(token, {}) for token in tokens[:-1]]
+        encontrados = set()
+        for numero, posicoes_ultimo in ultimos.items():
+            if any(numero not in postagens for postagens in anteriores):
+                continue
+            # A frase começa em p se o termo i está em p + i
+            inicios = {posicao - len(anteriores) for posicao in posicoes_ultimo}
+            for deslocamento, postagens in enumerate(anteriores):
+                inicios &= {posicao - deslocamento for posicao in postagens[numero]}
+            if inicios:
+                encontrados.add(numero)
+        return encontrados
+
+# Função para quebrar texto em termos de busca (minúsculas, sem acentos)
+def tokenizar_busca(texto: str) -> List[str]:
+    """Normaliza o texto da mesma forma que o tokenizer unicode61 (remove_diacritics) e separa em termos"""
+    sem_acentos = unicodedata.normalize("NFKD", texto.lower())
+    sem_acentos = "".join(char for char in sem_acentos if not unicodedata.combining(char))
+    # "_" separa termos no unicode61 (só letras, números e Co são caracteres de token)
+    return re.findall(r"[^\W_]+", sem_acentos)
+
+# Função para indexar as conversas em lotes durante a carga
+def construir_indice_conversas(conversas: List[str], ao_progresso=None) -> IndiceConversas:
+    """Cria o índice adicionando as conversas lote a lote"""
+    indice = IndiceConversas()
+    total = len(conversas)
+    for inicio in range(0, total, TAMANHO_LOTE_INDICE):
+        lote = conversas[inicio:inicio + TAMANHO_LOTE_INDICE]
+        indice.adicionar([(inicio + posicao, texto) for posicao, texto in enumerate(lote, 1)])
+        if ao_progresso:
+            ao_progresso(min(inicio + TAMANHO_LOTE_INDICE, total) / total)
+    return indice
+
 # Interface principal
 st.header("📤 Upload de Arquivo")
 
@@ -1031,57 +2590,94 @@ uploaded_file = st.file_uploader(
 conversas_carregadas = []
 
 if uploaded_file is not None:
-    # Ler conteúdo do arquivo
-    if uploaded_file.name.endswith('.txt'):
-        try:
-            conteudo = str(uploaded_file.read(), "utf-8")
-            conversas_carregadas = processar_txt(conteudo)
-            st.session_state['conversas_carregadas_count'] = len(conversas_carregadas)
-            st.success(f"✅ {len(conversas_carregadas)} conversa(s) carregada(s) do arquivo TXT")
-        except Exception as e:
-            st.error(f"❌ Erro ao ler arquivo TXT: {str(e)}")
-            conversas_carregadas = []
+    # Processar o arquivo apenas quando ele muda: os reruns reaproveitam o armazenamento único da sessão
+    # Identidade pelo conteúdo: outro arquivo com o mesmo nome e tamanho precisa ser lido de novo
+    id_arquivo = f"{uploaded_file.name}:{hashlib.sha256(uploaded_file.getvalue()).hexdigest()[:16]}"
+    if st.session_state.get('arquivo_carregado_id') != id_arquivo:
+        st.session_state['arquivo_carregado_id'] = id_arquivo
+        conversas_lidas = []
+        st.session_state['df_csv_original'] = None
+        
+        # Ler conteúdo do arquivo
+        if uploaded_file.name.endswith('.txt'):
+            try:
+                conteudo = str(uploaded_file.read(), "utf-8")
+                conversas_lidas = processar_txt(conteudo)
+            except Exception as e:
+                st.error(f"❌ Erro ao ler arquivo TXT: {str(e)}")
+                conversas_lidas = []
+        
+        elif uploaded_file.name.endswith('.csv'):
+            try:
+                # Tentar diferentes encodings
+                bytes_data = uploaded_file.read()
+                conteudo = None
+                
+                for encoding in ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252']:
+                    try:
+                        conteudo = bytes_data.decode(encoding)
+                        break
+                    except:
+                        continue
+                
+                if conteudo is None:
+                    conteudo = bytes_data.decode('utf-8', errors='ignore')
+                
+                resultado_csv = processar_csv(conteudo)
+                conversas_lidas = resultado_csv.get("conversas", [])
+                
+                # Salvar metadados do CSV original (sem a coluna de conversa) no session state
+                st.session_state['df_csv_original'] = resultado_csv.get("dataframe", None)
+            except Exception as e:
+                st.error(f"❌ Erro ao ler arquivo CSV: {str(e)}")
+                import traceback
+                st.error(f"Detalhes: {traceback.format_exc()}")
+                conversas_lidas = []
+        
+        # Armazenamento único das conversas: resultados e exportações referenciam pelo conversa_numero
+        st.session_state['conversas_store'] = conversas_lidas
+        # Parse de cada conversa uma única vez, na carga, na mesma ordem do armazenamento (consultado pelo conversa_numero)
+        st.session_state['conversas_estruturadas'] = estruturar_conversas(conversas_lidas)
+        estruturas_lidas = st.session_state['conversas_estruturadas']
+        
+        # Índice de texto completo construído em lotes durante a carga
+        if conversas_lidas:
+            barra_indice = st.progress(0, text="🔎 Indexando conversas para busca...")
+            st.session_state['indice_conversas'] = construir_indice_conversas(
+                conversas_lidas,
+                ao_progresso=lambda fracao: barra_indice.progress(fracao, text="🔎 Indexando conversas para busca...")
+            )
+            barra_indice.empty()
+            # Métricas de tempo (latência do bot, espera até o transbordo, pausas) na mesma passada de carga
+            st.session_state['tempos_conversas'] = calcular_tempos_conversas(conversas_lidas, estruturas_lidas)
+            # Pontuação de risco por regras locais: define a ordem de análise antes de qualquer chamada à API
+            barra_risco = st.progress(0, text="🎯 Priorizando conversas por risco...")
+            st.session_state['riscos_conversas'] = calcular_riscos_conversas(
+                conversas_lidas,
+                ao_progresso=lambda fracao: barra_risco.progress(fracao, text="🎯 Priorizando conversas por risco..."),
+                estruturas=estruturas_lidas
+            )
+            barra_risco.empty()
+        else:
+            st.session_state['indice_conversas'] = None
+            st.session_state['tempos_conversas'] = None
+            st.session_state['riscos_conversas'] = None
+        st.session_state['conversas_carregadas_count'] = len(conversas_lidas)
+        
+        # Resultados anteriores referenciam conversas de outro arquivo
+        st.session_state['resultados_processados'] = False
+        st.session_state['fila_reprocessamento'] = []
+        st.session_state['aviso_job'] = None
+    
+    conversas_carregadas = st.session_state.get('conversas_store', [])
     
+    if conversas_carregadas:
+        tipo_arquivo = "TXT" if uploaded_file.name.endswith('.txt') else "CSV"
+        st.success(f"✅ {len(conversas_carregadas)} conversa(s) carregada(s) do arquivo {tipo_arquivo}")
+        # Mostrar prévia da primeira conversa para debug
+        st.info(f"📝 Prévia da primeira conversa (primeiros 300 caracteres): {conversas_carregadas[0][:300]}...")
     elif uploaded_file.name.endswith('.csv'):
-        try:
-            # Tentar diferentes encodings
-            bytes_data = uploaded_file.read()
-            conteudo = None
-            
-            for encoding in ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252']:
-                try:
-                    conteudo = bytes_data.decode(encoding)
-                    break
-                except:
-                    continue
-            
-            if conteudo is None:
-                conteudo = bytes_data.decode('utf-8', errors='ignore')
-            
-            resultado_csv = processar_csv(conteudo)
-            conversas_carregadas = resultado_csv.get("conversas", [])
-            df_original = resultado_csv.get("dataframe", None)
-            
-            # Salvar DataFrame original no session state
-            if df_original is not None:
-                st.session_state['df_csv_original'] = df_original
-            else:
-                st.session_state['df_csv_original'] = None
-            
-            if conversas_carregadas:
-                st.session_state['conversas_carregadas_count'] = len(conversas_carregadas)
-                st.success(f"✅ {len(conversas_carregadas)} conversa(s) carregada(s) do arquivo CSV")
-                # Mostrar prévia da primeira conversa para debug
-                if len(conversas_carregadas) > 0:
-                    st.info(f"📝 Prévia da primeira conversa (primeiros 300 caracteres): {conversas_carregadas[0][:300]}...")
-            else:
-                st.warning("⚠️ Nenhuma conversa foi encontrada no arquivo CSV. Verifique se a coluna 'Conversa' existe.")
-        except Exception as e:
-            st.error(f"❌ Erro ao ler arquivo CSV: {str(e)}")
-            import traceback
-            st.error(f"Detalhes: {traceback.format_exc()}")
-            conversas_carregadas = []
-            st.session_state['df_csv_original'] = None
+        st.warning("⚠️ Nenhuma conversa foi encontrada no arquivo CSV. Verifique se a coluna 'Conversa' existe.")
     
     # Mostrar prévia das conversas e informações sobre limite
     if conversas_carregadas:
@@ -1089,11 +2685,21 @@ if uploaded_file is not None:
         limite = st.session_state.get('limite_conversas', None)
         total_carregadas = len(conversas_carregadas)
         
-        if limite and limite < total_carregadas:
-            st.warning(f"⚠️ **Limite configurado**: Das {total_carregadas} conversas carregadas, apenas as primeiras **{limite}** serão analisadas. Para analisar todas, deixe o campo 'Número máximo de conversas' vazio na sidebar.")
+        selecao = "as de maior risco" if ordem_analise == ORDENS_ANALISE[0] else "as primeiras"
+        if amostragem_estratificada and tamanho_amostra < total_carregadas:
+            st.info(f"📐 **Amostragem estratificada**: serão analisadas {tamanho_amostra} de {total_carregadas} conversas, com estimativas para o arquivo inteiro.")
+        elif limite and limite < total_carregadas:
+            st.warning(f"⚠️ **Limite configurado**: Das {total_carregadas} conversas carregadas, apenas {selecao} **{limite}** serão analisadas. Para analisar todas, deixe o campo 'Número máximo de conversas' vazio na sidebar.")
         else:
             st.success(f"✅ **Todas as {total_carregadas} conversas** serão analisadas.")
         
+        riscos = st.session_state.get('riscos_conversas')
+        if ordem_analise == ORDENS_ANALISE[0] and riscos is not None and len(riscos):
+            st.caption(
+                f"🎯 Análise por ordem de risco: {int((riscos >= 3).sum())} conversa(s) com 3+ pontos vão primeiro "
+                f"(pontuação máxima {riscos.max():.1f}, mediana {float(np.median(riscos)):.1f})."
+            )
+        
         with st.expander("👁️ Prévia das conversas carregadas"):
             for idx, conversa in enumerate(conversas_carregadas[:3], 1):
                 st.markdown(f"**Conversa {idx}:**")
@@ -1103,30 +2709,336 @@ if uploaded_file is not None:
             if len(conversas_carregadas) > 3:
                 st.info(f"*E mais {len(conversas_carregadas) - 3} conversa(s)...*")
 
-# Função wrapper para análise via OpenAI
-def analisar_conversa(conversa: str, modelo: str, api_key_openai: str) -> Dict:
-    """Analisa uma conversa usando OpenAI API"""
-    if modelo is None:
-        return {
-            "acao_necessaria": True,
-            "tipo_falha": "Erro de configuração",
-            "motivo_transbordo": "N/A",
-            "descricao": "Erro: Modelo OpenAI não foi especificado",
-            "sugestao_solucao": "Selecionar um modelo OpenAI na barra lateral"
-        }
-    return analisar_conversa_openai(conversa, modelo, api_key_openai)
+# Máximo de trechos de uma mesma conversa analisados em paralelo
+MAX_SEGMENTOS_PARALELOS = 4
 
-# Processamento
-st.header("🔄 Processamento")
+# Função para estimar tokens de um texto
+def estimar_tokens(texto: str) -> int:
+    """Estima o número de tokens de um texto (aproximação de ~4 caracteres por token)"""
+    if not texto:
+        return 0
+    return len(texto) // 4 + 1
 
-# Mostrar método selecionado
-if not api_key:
-    st.warning("⚠️ Por favor, configure a OpenAI API Key na barra lateral antes de iniciar a análise.")
-else:
-    st.info(f"🔍 **Análise via IA (OpenAI)** | **Modelo:** {model_name}")
-    
-    # Aviso sobre rate limits se houver muitas conversas
-    if conversas_carregadas and len(conversas_carregadas) > 50:
+# Função para dividir conversa longa em trechos sobrepostos
+def dividir_conversa_em_segmentos(conversa: str, max_tokens: int, sobreposicao_tokens: int = 0) -> List[str]:
+    """Divide a conversa em trechos de até max_tokens, quebrando entre mensagens e repetindo o final do trecho anterior"""
+    if estimar_tokens(conversa) <= max_tokens:
+        return [conversa]
+
+    max_chars = max_tokens * 4
+
+    # Quebrar mensagens maiores que o próprio limite do trecho
+    estrutura = estruturar_conversa(conversa)
+    linhas = []
+    for i in range(len(estrutura)):
+        turno = estrutura.turno(i)
+        for linha in ([turno] if len(turno) <= max_chars else turno.split('\n')):
+            while len(linha) > max_chars:
+                linhas.append(linha[:max_chars])
+                linha = linha[max_chars:]
+            linhas.append(linha)
+
+    segmentos = []
+    atual = []
+    tokens_atual = 0
+    tokens_novos = 0  # Tokens do trecho atual que não vieram da sobreposição
+
+    for linha in linhas:
+        tokens_linha = estimar_tokens(linha)
+        if atual and tokens_atual + tokens_linha > max_tokens and tokens_novos > 0:
+            segmentos.append('\n'.join(atual))
+
+            # Reaproveitar as últimas linhas como contexto do próximo trecho
+            sobreposicao = []
+            tokens_sobreposicao = 0
+            for linha_anterior in reversed(atual):
+                tokens_anterior = estimar_tokens(linha_anterior)
+                if tokens_sobreposicao + tokens_anterior > sobreposicao_tokens:
+                    break
+                sobreposicao.insert(0, linha_anterior)
+                tokens_sobreposicao += tokens_anterior
+
+            # Garantir que a sobreposição + nova linha caiba no limite
+            while sobreposicao and tokens_sobreposicao + tokens_linha > max_tokens:
+                tokens_sobreposicao -= estimar_tokens(sobreposicao.pop(0))
+
+            atual = sobreposicao
+            tokens_atual = tokens_sobreposicao
+            tokens_novos = 0
+
+        atual.append(linha)
+        tokens_atual += tokens_linha
+        tokens_novos += tokens_linha
+
+    if atual and tokens_novos > 0:
+        segmentos.append('\n'.join(atual))
+
+    return [segmento for segmento in segmentos if segmento.strip()]
+
+# Função para consolidar os vereditos dos trechos (etapa de redução)
+def consolidar_vereditos_segmentos(vereditos: List[Dict]) -> Dict:
+    """Consolida os vereditos dos trechos de uma conversa em um único veredito no formato padrão"""
+    acao_necessaria = any(bool(v.get("acao_necessaria")) for v in vereditos)
+
+    # O transbordo efetivado costuma estar no fim da conversa: usar o último motivo válido
+    motivo_transbordo = "N/A"
+    for veredito in reversed(vereditos):
+        motivo = str(veredito.get("motivo_transbordo", "N/A")).strip()
+        if motivo and motivo.lower() not in ["n/a", "none", "null"]:
+            motivo_transbordo = motivo
+            break
+
+    # Descrição e sugestão vêm do primeiro trecho que sustenta o veredito final
+    base = next((v for v in vereditos if bool(v.get("acao_necessaria")) == acao_necessaria), vereditos[0])
+
+    resultado = dict(base)
+    resultado["acao_necessaria"] = acao_necessaria
+    resultado["motivo_transbordo"] = motivo_transbordo
+    resultado["descricao"] = f"{base.get('descricao', 'N/A')} (conversa analisada em {len(vereditos)} trechos)"
+
+    # A confiança da conversa é a do trecho menos confiável
+    confiancas = [v["confianca"] for v in vereditos if v.get("confianca") is not None]
+    if confiancas:
+        resultado["confianca"] = min(confiancas)
+    return resultado
+
+# Função para analisar conversa longa em trechos paralelos (map-reduce)
+def analisar_conversa_segmentada(conversa: str, modelo: str, api_key_openai: str, max_tokens: int, sobreposicao_tokens: int, incluir_confianca: bool = False,
+                                 provedor: ProvedorChat = None) -> Dict:
+    """Analisa cada trecho da conversa em paralelo via provedor de chat e consolida os vereditos (a falha de um trecho falha a conversa)"""
+    segmentos = dividir_conversa_em_segmentos(conversa, max_tokens, sobreposicao_tokens)
+    if len(segmentos) == 1:
+        return analisar_conversa_openai(conversa, modelo, api_key_openai, incluir_confianca=incluir_confianca, provedor=provedor)
+
+    total = len(segmentos)
+    trechos = [
+        f"[TRECHO {i} DE {total} DA CONVERSA - avalie apenas os eventos deste trecho; o início pode repetir o final do trecho anterior]\n\n{segmento}"
+        for i, segmento in enumerate(segmentos, 1)
+    ]
+
+    with ThreadPoolExecutor(max_workers=min(total, MAX_SEGMENTOS_PARALELOS)) as executor:
+        vereditos = list(executor.map(
+            lambda trecho: analisar_conversa_openai(trecho, modelo, api_key_openai, incluir_confianca=incluir_confianca, provedor=provedor),
+            trechos
+        ))
+
+    resultado = consolidar_vereditos_segmentos(vereditos)
+    resultado.update(combinar_metricas(vereditos, paralelas=True))
+    resultado["segmentos_analisados"] = total
+    return resultado
+
+# Função wrapper para análise via LLM
+def analisar_conversa(conversa: str, modelo: str, api_key_openai: str, max_tokens: int = None, sobreposicao_tokens: int = 0, ao_receber_campos=None, incluir_confianca: bool = False,
+                      provedor: ProvedorChat = None) -> Dict:
+    """Analisa uma conversa no provedor de chat (OpenAI por padrão), segmentando conversas acima de max_tokens"""
+    if modelo is None:
+        raise ErroConfiguracao("Modelo OpenAI não foi especificado. Selecione um modelo na barra lateral.")
+    if provedor is None:
+        provedor = ProvedorOpenAI(api_key_openai)
+    if max_tokens and estimar_tokens(conversa) > max_tokens:
+        return analisar_conversa_segmentada(conversa, modelo, api_key_openai, max_tokens, sobreposicao_tokens, incluir_confianca, provedor)
+    return analisar_conversa_openai(conversa, modelo, api_key_openai, ao_receber_campos=ao_receber_campos, incluir_confianca=incluir_confianca, provedor=provedor)
+
+# Preço aproximado por 1 milhão de tokens em USD (entrada, saída)
+PRECOS_MODELOS = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50)
+}
+
+# Tokens de saída esperados para o veredito compacto
+TOKENS_SAIDA_VEREDITO = 30
+
+# Fração do preço de entrada cobrada pelos tokens servidos do cache de prompt
+FATOR_PRECO_TOKENS_CACHE = 0.5
+
+# Função para calcular o custo de uma requisição a partir dos tokens consumidos
+def calcular_custo_tokens(modelo: str, tokens_entrada: int, tokens_saida: int, tokens_cache: int = 0) -> float:
+    """Custo em USD com os tokens em cache cobrados com desconto"""
+    preco_entrada, preco_saida = PRECOS_MODELOS.get(modelo, (0.0, 0.0))
+    tokens_sem_cache = tokens_entrada - tokens_cache
+    return (tokens_sem_cache * preco_entrada + tokens_cache * preco_entrada * FATOR_PRECO_TOKENS_CACHE
+            + tokens_saida * preco_saida) / 1_000_000
+
+# Função para estimar o custo de analisar uma conversa em um modelo (sem tokens medidos da API)
+def estimar_custo_analise(conversa: str, modelo: str) -> float:
+    """Estima o custo em USD de uma chamada de análise (prompt completo + veredito compacto)"""
+    preco_entrada, preco_saida = PRECOS_MODELOS.get(modelo, (0.0, 0.0))
+    tokens_entrada = estimar_tokens(criar_prompt_sistema(conversa))
+    return (tokens_entrada * preco_entrada + TOKENS_SAIDA_VEREDITO * preco_saida) / 1_000_000
+
+# Função para analisar em cascata (modelo econômico → modelo forte)
+def analisar_conversa_cascata(conversa: str, modelo_economico: str, modelo_forte: str, api_key_openai: str,
+                              limiar_confianca: float, max_tokens: int = None, sobreposicao_tokens: int = 0,
+                              ao_receber_campos=None, provedor: ProvedorChat = None) -> Dict:
+    """Analisa com o modelo econômico e reanalisa no modelo forte se a confiança for baixa ou houver necessidade de transbordo"""
+    if provedor is None:
+        provedor = ProvedorOpenAI(api_key_openai)
+    inicio = time.perf_counter()
+    resultado = analisar_conversa(
+        conversa, modelo_economico, api_key_openai, max_tokens, sobreposicao_tokens,
+        ao_receber_campos=ao_receber_campos, incluir_confianca=True, provedor=provedor
+    )
+    tempo_economico = time.perf_counter() - inicio
+
+    confianca = resultado.get("confianca")
+    escalar = confianca is None or confianca < limiar_confianca or bool(resultado.get("acao_necessaria"))
+
+    tempo_forte = 0.0
+    modelo_utilizado = modelo_economico
+    # Custo de usar só o modelo forte: medido quando escalona; senão, os tokens medidos da chamada econômica no preço do forte
+    custo_somente_forte = None
+    if "tokens_entrada" in resultado:
+        custo_somente_forte = calcular_custo_tokens(
+            modelo_forte, resultado["tokens_entrada"], resultado["tokens_saida"], resultado["tokens_cache"]
+        )
+    if escalar:
+        inicio = time.perf_counter()
+        resultado_forte = analisar_conversa(conversa, modelo_forte, api_key_openai, max_tokens, sobreposicao_tokens, provedor=provedor)
+        tempo_forte = time.perf_counter() - inicio
+        custo_somente_forte = resultado_forte.get("custo_usd", custo_somente_forte)
+        # Tokens, custo e espera das duas chamadas entram na conversa
+        resultado_forte.update(combinar_metricas([resultado, resultado_forte]))
+        resultado_forte["confianca"] = confianca
+        resultado = resultado_forte
+        modelo_utilizado = modelo_forte
+
+    resultado["modelo_utilizado"] = modelo_utilizado
+    resultado["escalado"] = escalar
+    resultado["confianca"] = confianca
+    resultado["tempo_modelo_economico_s"] = round(tempo_economico, 2)
+    resultado["tempo_modelo_forte_s"] = round(tempo_forte, 2)
+    resultado["custo_somente_forte_usd"] = (
+        custo_somente_forte if custo_somente_forte is not None else estimar_custo_analise(conversa, modelo_forte)
+    )
+    return resultado
+
+# Função para analisar uma conversa com o classificador destilado
+def analisar_conversa_classificador(conversa: str, classificador: ClassificadorDestilado) -> Dict:
+    """Veredito no mesmo formato do LLM; confiança = menor probabilidade entre transbordo e motivo"""
+    inicio = time.perf_counter()
+    previsoes = classificador.prever(conversa)
+    had_need_to_transfer, prob_transbordo = previsoes["had_need_to_transfer"]
+    motivo, prob_motivo = previsoes.get("motivo_transbordo", ("N/A", 1.0))
+    veredito = montar_veredito({
+        "had_need_to_transfer": bool(had_need_to_transfer),
+        "motivo_transbordo": None if motivo == "N/A" else motivo
+    })
+    veredito.update({
+        "confianca_classificador": round(min(prob_transbordo, prob_motivo), 4),
+        "modelo_utilizado": f"classificador {classificador.versao}",
+        "latencia_s": round(time.perf_counter() - inicio, 6),
+        "tentativas": 0,  # Tentativas extras (como no caminho do LLM): o classificador não repete
+        "tempo_espera_s": 0.0,
+        "hedges": 0,
+        "tokens_entrada": 0,
+        "tokens_saida": 0,
+        "tokens_cache": 0,
+        "tokens_estimados": False,
+        "custo_usd": 0.0
+    })
+    return veredito
+
+# Função para triar com o classificador e recorrer ao LLM abaixo do limiar de confiança
+def analisar_com_triagem(conversa: str, classificador: ClassificadorDestilado, limiar_confianca: float, analisar_llm,
+                         ao_receber_campos=None) -> Dict:
+    """Limiar 0 desliga o LLM: o classificador responde todas as conversas, inclusive as com bot em looping"""
+    veredito = analisar_conversa_classificador(conversa, classificador)
+    # Bot em looping é a falha mais cara de errar: vai ao LLM mesmo com o classificador confiante (se o LLM estiver em uso)
+    em_laco = limiar_confianca > 0 and detectar_repeticoes_bot(estruturar_conversa(conversa))["maior_repeticao"] >= MIN_ENVIOS_LACO
+    if veredito["confianca_classificador"] >= limiar_confianca and not em_laco:
+        return veredito
+    resultado = analisar_llm(conversa, ao_receber_campos)
+    resultado["confianca_classificador"] = veredito["confianca_classificador"]
+    return resultado
+
+# Função para resumir a execução em cascata
+def resumir_cascata(resultados: List[Dict]) -> Dict:
+    """Calcula taxa de escalonamento e economia de custo/tempo em relação a usar só o modelo forte"""
+    cascata = [r for r in resultados if "escalado" in r]
+    if not cascata:
+        return None
+
+    escalados = [r for r in cascata if r["escalado"]]
+    # custo_usd já soma as duas chamadas das conversas escalonadas (tokens medidos pela API)
+    custo_cascata = sum(r["custo_usd"] for r in cascata if pd.notna(r.get("custo_usd")))
+    custo_somente_forte = sum(r["custo_somente_forte_usd"] for r in cascata)
+    tempo_cascata = sum(r["tempo_modelo_economico_s"] + r["tempo_modelo_forte_s"] for r in cascata)
+
+    # Tempo do modelo forte nas não escalonadas estimado pela média observada nas escalonadas
+    tempo_somente_forte = None
+    if escalados:
+        media_forte = sum(r["tempo_modelo_forte_s"] for r in escalados) / len(escalados)
+        tempo_somente_forte = media_forte * len(cascata)
+
+    return {
+        "total": len(cascata),
+        "escalados": len(escalados),
+        "taxa_escalonamento": len(escalados) / len(cascata),
+        "custo_cascata_usd": custo_cascata,
+        "custo_somente_forte_usd": custo_somente_forte,
+        "economia_custo_usd": custo_somente_forte - custo_cascata,
+        "tempo_cascata_s": tempo_cascata,
+        "tempo_somente_forte_s": tempo_somente_forte,
+        "economia_tempo_s": (tempo_somente_forte - tempo_cascata) if tempo_somente_forte is not None else None
+    }
+
+# Percentis exibidos no resumo das requisições
+PERCENTIS_METRICAS = (0.50, 0.95, 0.99)
+
+# Função para resumir a instrumentação das requisições da execução
+def resumir_metricas_requisicoes(df_resultados: pd.DataFrame) -> Dict:
+    """Calcula percentis de latência/espera, totais de tokens e custo, e o detalhamento por retailer"""
+    if "latencia_s" not in df_resultados.columns:
+        return None
+    df = df_resultados[df_resultados["latencia_s"].notna()]
+    if df.empty:
+        return None
+
+    percentis = {
+        coluna: {f"p{int(p * 100)}": float(valor) for p, valor in df[coluna].quantile(list(PERCENTIS_METRICAS)).items()}
+        for coluna in ["latencia_s", "tempo_espera_s", "tokens_entrada", "tokens_saida"]
+    }
+
+    por_retailer = df.groupby("retailer").agg(
+        conversas=("conversa_numero", "size"),
+        latencia_p50_s=("latencia_s", "median"),
+        latencia_p95_s=("latencia_s", lambda serie: serie.quantile(0.95)),
+        tempo_espera_s=("tempo_espera_s", "sum"),
+        tentativas=("tentativas", "sum"),
+        hedges=("hedges", "sum"),
+        tokens_entrada=("tokens_entrada", "sum"),
+        tokens_saida=("tokens_saida", "sum"),
+        tokens_cache=("tokens_cache", "sum"),
+        custo_usd=("custo_usd", "sum")
+    ).sort_values("custo_usd", ascending=False).reset_index()
+
+    return {
+        "requisicoes": len(df),
+        "percentis": percentis,
+        "tentativas": int(df["tentativas"].sum()),
+        "tempo_espera_s": float(df["tempo_espera_s"].sum()),
+        "hedges": int(df["hedges"].sum()),
+        "tokens_entrada": int(df["tokens_entrada"].sum()),
+        "tokens_saida": int(df["tokens_saida"].sum()),
+        "tokens_cache": int(df["tokens_cache"].sum()),
+        "tokens_estimados": int(df["tokens_estimados"].astype(bool).sum()),
+        "custo_usd": float(df["custo_usd"].sum()),
+        "por_retailer": por_retailer
+    }
+
+# Processamento
+st.header("🔄 Processamento")
+
+# Mostrar método selecionado
+if not api_key:
+    st.warning("⚠️ Por favor, configure a OpenAI API Key na barra lateral antes de iniciar a análise.")
+else:
+    st.info(f"🔍 **Análise via IA** | **Provedor:** {provedor_llm} | **Modelo:** {model_name}")
+    
+    # Aviso sobre rate limits se houver muitas conversas
+    if conversas_carregadas and len(conversas_carregadas) > 50:
         st.warning(f"⚠️ **Atenção**: Você tem {len(conversas_carregadas)} conversas para analisar. Para evitar rate limits, recomendamos:")
         st.markdown("""
         - **Aumentar o delay entre requisições** na sidebar (10-15 segundos para contas gratuitas)
@@ -1134,7 +3046,1095 @@ else:
         - **Aguarde alguns minutos** se receber erros de rate limit
         """)
 
-if conversas_carregadas and st.button("🚀 Iniciar Análise", type="primary", use_container_width=True):
+# Função auxiliar para encontrar coluna por nome (case-insensitive)
+def encontrar_coluna(df, nomes_possiveis):
+    """Retorna o nome da primeira coluna do DataFrame que corresponde a um dos nomes (ou None)"""
+    if df is None:
+        return None
+    for nome in nomes_possiveis:
+        for col in df.columns:
+            if col.strip().lower() == nome.lower():
+                return col
+    return None
+
+# Nomes aceitos (sem diferenciar maiúsculas) para as colunas de metadados do CSV original
+NOMES_COLUNAS_METADADOS = {
+    "retailer": ['retailer', 'cliente', 'customer', 'loja', 'store'],
+    "data": ['data', 'date', 'data_hora', 'datetime', 'timestamp'],
+    "hora": ['hora', 'time', 'horario'],
+    "csr_id": ['csr id', 'csr_id', 'csrid', 'csr', 'atendente id', 'atendente_id'],
+    "chat_id": ['chat id', 'chat_id', 'chatid', 'chat', 'conversation id', 'conversation_id']
+}
+
+# Amostragem estratificada: estratos = retailer × dia × faixa de risco local, agrupados quando pequenos demais
+LIMIAR_RISCO_ALTO = 3.0          # pontuação de pontuar_risco_conversa a partir da qual o estrato é "risco alto"
+MIN_AMOSTRA_POR_ESTRATO = 2      # mínimo para estimar a variância dentro do estrato
+VARIANCIA_MAXIMA_BERNOULLI = 0.25  # p(1-p) no pior caso: usada nos estratos com menos de 2 conversas analisadas
+# Níveis de agrupamento, do mais fino ao mais grosso, a partir de (retailer, dia, risco)
+NIVEIS_ESTRATOS = [
+    lambda retailer, dia, risco: f"{retailer} | {dia} | {risco}",
+    lambda retailer, dia, risco: f"{retailer} | {risco}",
+    lambda retailer, dia, risco: retailer,
+    lambda retailer, dia, risco: f"demais retailers | {risco}",
+    lambda retailer, dia, risco: "demais retailers"
+]
+SEMENTE_AMOSTRAGEM = 42
+
+# Função para definir o estrato de cada conversa carregada
+def estratos_conversas(conversas: List[str], df_original=None, riscos: np.ndarray = None,
+                       estruturas: List[ConversaEstruturada] = None) -> List[str]:
+    """Retorna "retailer | dd/mm/aaaa | risco alto/baixo" por conversa; sem data no CSV, usa a da primeira mensagem"""
+    total = len(conversas)
+    coluna_retailer = encontrar_coluna(df_original, NOMES_COLUNAS_METADADOS["retailer"])
+    coluna_data = encontrar_coluna(df_original, NOMES_COLUNAS_METADADOS["data"])
+    retailers = pd.Series(["N/A"] * total)
+    datas = pd.Series([None] * total, dtype=object)
+    if df_original is not None and len(df_original) == total:
+        if coluna_retailer:
+            retailers = df_original[coluna_retailer].astype(str).str.strip().replace("", "N/A").reset_index(drop=True)
+        if coluna_data:
+            datas = pd.to_datetime(df_original[coluna_data].astype(str), dayfirst=True, errors="coerce", format="mixed")
+            datas = datas.dt.strftime("%d/%m/%Y").reset_index(drop=True)
+    estratos = []
+    for posicao, conversa in enumerate(conversas):
+        data = datas.iloc[posicao]
+        if not isinstance(data, str):
+            inicio = (estruturas[posicao] if estruturas is not None else estruturar_conversa(conversa)).primeira_data_hora()
+            data = inicio.strftime("%d/%m/%Y") if inicio else "sem data"
+        risco = "risco alto" if riscos is not None and riscos[posicao] >= LIMIAR_RISCO_ALTO else "risco baixo"
+        estratos.append(f"{retailers.iloc[posicao]} | {data} | {risco}")
+    return estratos
+
+# Função para agrupar os estratos que não comportam o mínimo da amostra
+def consolidar_estratos(estratos: List[str], tamanho: int) -> List[str]:
+    """Sobe cada estrato pequeno para o nível pai (sem o dia, depois sem o risco, depois os demais retailers) até a alocação proporcional dar MIN_AMOSTRA_POR_ESTRATO"""
+    partes = [estrato.rsplit(" | ", 2) for estrato in estratos]
+    consolidados = pd.Series([NIVEIS_ESTRATOS[0](*parte) for parte in partes])
+    minimo_populacao = MIN_AMOSTRA_POR_ESTRATO * len(estratos) / max(tamanho, 1)
+    for nivel in NIVEIS_ESTRATOS[1:]:
+        tamanhos = consolidados.map(consolidados.value_counts())
+        pequenos = tamanhos < minimo_populacao
+        if not pequenos.any():
+            break
+        consolidados[pequenos] = [nivel(*partes[posicao]) for posicao in np.flatnonzero(pequenos)]
+    return consolidados.tolist()
+
+# Função para sortear a amostra estratificada
+def sortear_amostra_estratificada(estratos: List[str], tamanho: int, semente: int = SEMENTE_AMOSTRAGEM) -> List[int]:
+    """Alocação proporcional ao tamanho do estrato (mínimo MIN_AMOSTRA_POR_ESTRATO quando cabe) e sorteio simples dentro de cada um; retorna conversa_numero"""
+    grupos = pd.Series(range(1, len(estratos) + 1)).groupby(pd.Series(estratos)).apply(list)
+    tamanhos = np.array([len(numeros) for numeros in grupos])
+    if tamanho >= tamanhos.sum():
+        return list(range(1, len(estratos) + 1))
+    ideal = tamanho * tamanhos / tamanhos.sum()
+    minimo = np.minimum(tamanhos, MIN_AMOSTRA_POR_ESTRATO) if tamanho >= np.minimum(tamanhos, MIN_AMOSTRA_POR_ESTRATO).sum() else np.zeros_like(tamanhos)
+    alocacao = np.minimum(tamanhos, np.maximum(np.floor(ideal).astype(int), minimo))
+    # Ajuste do total pelas maiores diferenças em relação à alocação ideal
+    while alocacao.sum() < tamanho:
+        folga = np.where(alocacao < tamanhos, ideal - alocacao, -np.inf)
+        alocacao[np.argmax(folga)] += 1
+    while alocacao.sum() > tamanho:
+        excesso = np.where(alocacao > minimo, alocacao - ideal, -np.inf)
+        alocacao[np.argmax(excesso)] -= 1
+    aleatorio = np.random.default_rng(semente)
+    amostra = []
+    for numeros, quantidade in zip(grupos, alocacao):
+        amostra += aleatorio.choice(numeros, size=quantidade, replace=False).tolist()
+    return sorted(amostra)
+
+# Função para calcular o intervalo de Wilson com o tamanho efetivo da amostra
+def intervalo_wilson(proporcao: float, tamanho_efetivo: float, nivel_confianca: float) -> tuple:
+    if tamanho_efetivo <= 0:
+        return (0.0, 1.0)
+    z = NormalDist().inv_cdf((1 + nivel_confianca) / 2)
+    denominador = 1 + z ** 2 / tamanho_efetivo
+    centro = (proporcao + z ** 2 / (2 * tamanho_efetivo)) / denominador
+    margem = z * float(np.sqrt(proporcao * (1 - proporcao) / tamanho_efetivo + z ** 2 / (4 * tamanho_efetivo ** 2))) / denominador
+    return (max(0.0, centro - margem), min(1.0, centro + margem))
+
+# Função para estimar as taxas da população a partir dos resultados da amostra
+def estimar_taxas_populacao(df_resultados: pd.DataFrame, plano: Dict, nivel_confianca: float = 0.95) -> Dict:
+    """Estimador estratificado (pesos N_h/N) com correção de população finita e intervalo de Wilson no tamanho efetivo"""
+    def booleano(serie: pd.Series) -> pd.Series:
+        return serie.apply(lambda valor: valor if isinstance(valor, bool) else str(valor).strip().lower() in ("true", "sim", "yes", "1"))
+
+    df = pd.DataFrame({"estrato": df_resultados["conversa_numero"].map(plano["estrato"])})
+    df["transbordo"] = booleano(df_resultados["acao_necessaria"]) if "acao_necessaria" in df_resultados.columns else False
+    # Atenção: transbordo ou bot em looping; no motor local, a coluna precisa_atencao das regras
+    if "precisa_atencao" in df_resultados.columns:
+        df["atencao"] = booleano(df_resultados["precisa_atencao"])
+    else:
+        em_laco = pd.to_numeric(df_resultados.get("maior_repeticao_bot", pd.Series(0, index=df_resultados.index)), errors="coerce").fillna(0) >= MIN_ENVIOS_LACO
+        df["atencao"] = df["transbordo"] | em_laco
+    df = df.dropna(subset=["estrato"])
+
+    tamanhos = pd.Series(plano["tamanhos_estratos"], name="populacao")
+    por_estrato = df.groupby("estrato").agg(amostra=("transbordo", "size"), transbordo=("transbordo", "mean"), atencao=("atencao", "mean"))
+    por_estrato = por_estrato.join(tamanhos, how="right")
+    por_estrato["amostra"] = por_estrato["amostra"].fillna(0).astype(int)
+    populacao_coberta = por_estrato.loc[por_estrato["amostra"] > 0, "populacao"].sum()
+    pesos = por_estrato["populacao"] / por_estrato["populacao"].sum()
+    fracao_amostral = por_estrato["amostra"] / por_estrato["populacao"]
+
+    resumo = {
+        "populacao": int(tamanhos.sum()),
+        "populacao_coberta": int(populacao_coberta),
+        "amostra": int(por_estrato["amostra"].sum()),
+        "estratos": len(tamanhos),
+        "estratos_sem_amostra": int((por_estrato["amostra"] == 0).sum()),
+        "nivel_confianca": nivel_confianca,
+        "taxas": {},
+        "por_estrato": por_estrato[por_estrato["amostra"] > 0].reset_index(names="estrato").sort_values("populacao", ascending=False)
+    }
+    com_amostra = por_estrato["amostra"] > 0
+    for taxa in ("transbordo", "atencao"):
+        # Estratos sem conversa analisada entram com a taxa dos demais e a variância do pior caso (não somem do peso)
+        cobertos = pesos[com_amostra]
+        taxa_cobertos = float((cobertos * por_estrato.loc[com_amostra, taxa]).sum() / cobertos.sum()) if cobertos.sum() else 0.0
+        proporcoes = por_estrato[taxa].astype(float).fillna(taxa_cobertos)
+        estimativa = float((pesos * proporcoes).sum())
+        # Variância no estrato: p(1-p)/(n-1); com n < 2 não há como estimá-la, então usa o pior caso p(1-p) = 1/4
+        variancia_estratos = np.where(
+            por_estrato["amostra"] >= 2,
+            proporcoes * (1 - proporcoes) / (por_estrato["amostra"] - 1).clip(lower=1),
+            VARIANCIA_MAXIMA_BERNOULLI / por_estrato["amostra"].clip(lower=1)
+        ) * (1 - fracao_amostral)
+        variancia = float((pesos ** 2 * variancia_estratos).sum())
+        # Tamanho efetivo: n com a mesma variância numa amostra aleatória simples (sem variância, a própria amostra)
+        tamanho_efetivo = estimativa * (1 - estimativa) / variancia if variancia > 0 and 0 < estimativa < 1 else resumo["amostra"]
+        inferior, superior = intervalo_wilson(estimativa, tamanho_efetivo, nivel_confianca)
+        resumo["taxas"][taxa] = {
+            "estimativa": estimativa,
+            "ic_inferior": inferior,
+            "ic_superior": superior,
+            "conversas_estimadas": round(estimativa * resumo["populacao"])
+        }
+    return resumo
+
+# Função para adicionar ao resultado as informações do CSV original
+def adicionar_metadados_csv(resultado: Dict, idx: int, df_original, conversa: str = None,
+                            estrutura: ConversaEstruturada = None) -> None:
+    """Preenche retailer, data, hora, csr_id e chat_id da linha idx (1-based) do CSV original; sem data/hora no CSV, usa a primeira mensagem da conversa"""
+    # Identificar colunas relevantes no CSV original
+    colunas = {campo: encontrar_coluna(df_original, nomes) for campo, nomes in NOMES_COLUNAS_METADADOS.items()}
+    
+    if df_original is None or idx > len(df_original):
+        for campo in colunas:
+            resultado[campo] = "N/A"
+    else:
+        linha_original = df_original.iloc[idx - 1]
+        for campo, coluna in colunas.items():
+            if coluna:
+                valor = linha_original.get(coluna, "N/A")
+                resultado[campo] = str(valor).strip() if pd.notna(valor) else "N/A"
+            else:
+                resultado[campo] = "N/A"
+    
+    if conversa and resultado["data"] == "N/A":
+        inicio = (estrutura if estrutura is not None else estruturar_conversa(conversa)).primeira_data_hora()
+        if inicio:
+            resultado["data"] = inicio.strftime("%d/%m/%Y")
+            if resultado["hora"] == "N/A":
+                resultado["hora"] = inicio.strftime("%H:%M:%S")
+
+# Circuit breaker para falhas consecutivas da API
+class DisjuntorFalhas:
+    """Conta falhas consecutivas da mesma classe e decide se a execução continua, pausa ou é abortada"""
+
+    def __init__(self, limite_falhas: int, max_pausas: int = 1):
+        self.limite_falhas = limite_falhas
+        self.max_pausas = max_pausas
+        self.estado = "fechado"  # fechado | pausado | aberto
+        self.classe = None
+        self.consecutivas = 0
+        self.pausas = 0
+        self.ultimo_erro = None
+
+    def registrar_sucesso(self) -> None:
+        self.estado = "fechado"
+        self.classe = None
+        self.consecutivas = 0
+        self.pausas = 0
+
+    def registrar_falha(self, erro: ErroAnaliseAPI) -> str:
+        """Registra a falha e retorna o novo estado do disjuntor"""
+        self.ultimo_erro = erro
+        if erro.classe != self.classe:
+            self.classe = erro.classe
+            self.consecutivas = 0
+        self.consecutivas += 1
+
+        if erro.fatal:
+            # Chave inválida, cota esgotada ou configuração: todas as próximas chamadas falhariam
+            self.estado = "aberto"
+        elif self.consecutivas >= self.limite_falhas:
+            self.estado = "pausado" if self.pausas < self.max_pausas else "aberto"
+        return self.estado
+
+    def retomar(self) -> None:
+        """Fecha o disjuntor após a pausa (a próxima sequência de falhas aborta a execução)"""
+        self.pausas += 1
+        self.consecutivas = 0
+        self.estado = "fechado"
+
+# Pausa aplicada quando o disjuntor abre por falhas transitórias repetidas
+PAUSA_DISJUNTOR_S = 60
+
+# Função para executar a análise de uma lista de conversas
+def executar_analise(itens: List[tuple], analisar, delay: float, disjuntor: DisjuntorFalhas,
+                     df_original=None, ao_status=None, ao_progresso=None, cancelar: threading.Event = None,
+                     log_execucao: LogExecucao = None, tempos_conversas: pd.DataFrame = None,
+                     estruturas: List[ConversaEstruturada] = None, nome_provedor: str = "OpenAI") -> Dict:
+    """Analisa os itens (conversa_numero, conversa) e separa resultados válidos das falhas (fila de reprocessamento)"""
+    resultados = []
+    falhas = []
+    interrompido = False
+    cancelado = False
+    total = len(itens)
+    
+    # Espera que termina antes do prazo quando a execução é cancelada
+    def aguardar(segundos):
+        if cancelar is not None:
+            cancelar.wait(segundos)
+        else:
+            time.sleep(segundos)
+
+    # Veredito e colunas derivadas de uma conversa; qualquer outra exceção (bug no parser, no classificador, nos
+    # metadados ou erro não classificado do SDK) vira ErroAnaliseAPI e só esta conversa vai para a fila
+    def analisar_item(idx, conversa, ao_receber_campos):
+        try:
+            resultado = analisar(conversa, ao_receber_campos)
+            # O texto da conversa não é copiado para o resultado: fica no armazenamento único (conversa_numero)
+            resultado["conversa_numero"] = idx
+            resultado.setdefault("segmentos_analisados", 1)
+
+            # Estrutura montada na carga do arquivo, pelo conversa_numero
+            estrutura = estruturas[idx - 1] if estruturas is not None and idx <= len(estruturas) else None
+
+            # Adicionar informações do CSV original se disponível
+            adicionar_metadados_csv(resultado, idx, df_original, conversa, estrutura)
+            resultado.update(colunas_repeticao_bot(conversa, estrutura))
+            adicionar_tempos_conversa(resultado, idx, tempos_conversas)
+            return resultado
+        except ErroAnaliseAPI:
+            raise
+        except Exception as e:
+            raise ErroAnaliseAPI(f"Erro inesperado ({type(e).__name__}): {e}") from e
+
+    for posicao, (idx, conversa) in enumerate(itens, 1):
+        if cancelar is not None and cancelar.is_set():
+            # Conversas não analisadas voltam para a fila de reprocessamento
+            for idx_pendente, _ in itens[posicao - 1:]:
+                falhas.append({
+                    "conversa_numero": idx_pendente,
+                    "classe_erro": "cancelada",
+                    "mensagem": "Execução cancelada pelo usuário"
+                })
+            cancelado = True
+            if log_execucao:
+                log_execucao.registrar("execucao_cancelada", conversas_pendentes=len(itens) - posicao + 1)
+            break
+
+        if ao_status:
+            ao_status(f"📊 Analisando conversa {posicao}/{total} via {nome_provedor}...")
+
+        # Mostrar o veredito parcial assim que o campo chega no streaming
+        def mostrar_campos_recebidos(campos, posicao=posicao):
+            if ao_status and "had_need_to_transfer" in campos:
+                transbordo = "Sim" if campos["had_need_to_transfer"] is True else "Não"
+                ao_status(f"📊 Analisando conversa {posicao}/{total} via {nome_provedor}... necessidade de transbordo: {transbordo}")
+
+        try:
+            resultado = analisar_item(idx, conversa, mostrar_campos_recebidos)
+            disjuntor.registrar_sucesso()
+        except ErroAnaliseAPI as erro:
+            falhas.append({"conversa_numero": idx, "classe_erro": erro.classe, "mensagem": str(erro)})
+            METRICAS.registrar_conversa(None, "falha")
+            if log_execucao:
+                log_execucao.registrar("conversa_falhou", conversa_numero=idx, classe_erro=erro.classe, mensagem=str(erro))
+            estado = disjuntor.registrar_falha(erro)
+            if estado == "aberto":
+                # Conversas ainda não tentadas também vão para a fila de reprocessamento
+                for idx_pendente, _ in itens[posicao:]:
+                    falhas.append({
+                        "conversa_numero": idx_pendente,
+                        "classe_erro": "interrompida",
+                        "mensagem": f"Execução interrompida pelo circuit breaker ({erro.classe})"
+                    })
+                interrompido = True
+                if log_execucao:
+                    log_execucao.registrar("disjuntor_aberto", classe_erro=erro.classe, conversas_pendentes=len(itens) - posicao)
+                break
+            if estado == "pausado":
+                if log_execucao:
+                    log_execucao.registrar("disjuntor_pausado", classe_erro=erro.classe, pausa_s=PAUSA_DISJUNTOR_S)
+                if ao_status:
+                    ao_status(f"⏸️ {disjuntor.consecutivas} falhas consecutivas ({erro.classe}). Pausando {PAUSA_DISJUNTOR_S}s antes de continuar...")
+                aguardar(PAUSA_DISJUNTOR_S)
+                disjuntor.retomar()
+            if ao_progresso:
+                ao_progresso(posicao / total)
+            continue
+
+        # Delay configurável para evitar rate limiting
+        aguardar(delay)
+
+        resultados.append(resultado)
+        METRICAS.registrar_conversa(resultado.get("modelo_utilizado"), "sucesso")
+        if log_execucao:
+            log_execucao.registrar(
+                "conversa_analisada",
+                **{campo: valor for campo, valor in resultado.items() if campo not in ("descricao", "sugestao_solucao")}
+            )
+
+        # Atualizar progresso
+        if ao_progresso:
+            ao_progresso(posicao / total)
+
+    return {
+        "resultados": resultados,
+        "falhas": falhas,
+        "interrompido": interrompido,
+        "cancelado": cancelado,
+        "ultimo_erro": disjuntor.ultimo_erro
+    }
+
+# Função para montar o DataFrame final de resultados
+def montar_df_resultados(resultados: List[Dict]) -> pd.DataFrame:
+    """Cria o DataFrame de resultados com colunas padronizadas (sem o texto das conversas)"""
+    df_resultados = pd.DataFrame(resultados)
+    
+    # Garantir que colunas essenciais existam e preencher valores vazios
+    for coluna in ["sugestao_solucao", "retailer", "data", "hora", "csr_id", "chat_id", "motivo_transbordo"]:
+        if coluna not in df_resultados.columns:
+            df_resultados[coluna] = "N/A"
+        df_resultados[coluna] = df_resultados[coluna].fillna("N/A")
+    
+    # Reordenar colunas
+    colunas_ordenadas = [
+        "conversa_numero",
+        "retailer",
+        "data",
+        "hora",
+        "csr_id",
+        "chat_id",
+        "acao_necessaria",
+        "tipo_falha",
+        "motivo_transbordo",
+        "descricao",
+        "sugestao_solucao",
+        "segmentos_analisados"
+    ]
+    if "latencia_s" in df_resultados.columns:
+        colunas_ordenadas += [
+            "modelo_utilizado",
+            "latencia_s",
+            "tentativas",
+            "tempo_espera_s",
+            "hedges",
+            "tokens_entrada",
+            "tokens_saida",
+            "tokens_cache",
+            "tokens_estimados",
+            "custo_usd"
+        ]
+    if "escalado" in df_resultados.columns:
+        if "modelo_utilizado" not in colunas_ordenadas:
+            colunas_ordenadas.append("modelo_utilizado")
+        colunas_ordenadas += [
+            "escalado",
+            "confianca",
+            "tempo_modelo_economico_s",
+            "tempo_modelo_forte_s",
+            "custo_somente_forte_usd"
+        ]
+    if "confianca_classificador" in df_resultados.columns:
+        colunas_ordenadas.append("confianca_classificador")
+    if "repeticoes_bot" in df_resultados.columns:
+        colunas_ordenadas += ["repeticoes_bot", "maior_repeticao_bot", "mensagens_repetidas_bot"]
+    if "duracao_sessao_s" in df_resultados.columns:
+        colunas_ordenadas += COLUNAS_TEMPOS_CONVERSA
+    if "origem_veredito" in df_resultados.columns:
+        df_resultados["origem_veredito"] = df_resultados["origem_veredito"].fillna("nova análise")
+        colunas_ordenadas.append("origem_veredito")
+    
+    # Verificar se todas as colunas existem antes de reordenar
+    colunas_existentes = [col for col in colunas_ordenadas if col in df_resultados.columns]
+    if len(colunas_existentes) == len(colunas_ordenadas):
+        df_resultados = df_resultados[colunas_ordenadas]
+    
+    return df_resultados
+
+# Função para obter a conversa completa pelo número
+def obter_conversa(conversas: List[str], conversa_numero) -> str:
+    """Retorna o texto da conversa no armazenamento único (ou vazio se o número não existir)"""
+    try:
+        posicao = int(conversa_numero) - 1
+    except (TypeError, ValueError):
+        return ""
+    return conversas[posicao] if 0 <= posicao < len(conversas) else ""
+
+# Função para juntar o texto das conversas aos resultados (somente na exibição/exportação)
+def anexar_conversas(df: pd.DataFrame, conversas: List[str], max_caracteres: int = None) -> pd.DataFrame:
+    """Retorna cópia do DataFrame com a coluna 'conversa' (completa ou prévia de max_caracteres)"""
+    df = df.copy()
+    textos = [obter_conversa(conversas, numero) for numero in df["conversa_numero"]]
+    if max_caracteres:
+        textos = [texto[:max_caracteres] + "..." if len(texto) > max_caracteres else texto for texto in textos]
+    df["conversa"] = textos
+    return df
+
+# Colunas do download filtrado, nesta ordem (as demais vão ao final)
+COLUNAS_DOWNLOAD_FILTRADO = [
+    "retailer", "data", "hora", "csr_id", "chat_id", "conversa_numero", "acao_necessaria",
+    "tipo_falha", "motivo_transbordo", "descricao", "sugestao_solucao", "conversa"
+]
+
+# Função para montar o DataFrame do download filtrado (conversas que precisam de atenção)
+def montar_download_filtrado(df_com_atencao: pd.DataFrame, conversas: List[str]) -> pd.DataFrame:
+    """Texto completo juntado só aqui; ordena por retailer, data e hora e reordena as colunas"""
+    df_download = anexar_conversas(df_com_atencao, conversas)
+    colunas_ordenacao = [coluna for coluna in ("retailer", "data", "hora") if coluna in df_download.columns]
+    if colunas_ordenacao:
+        df_download = df_download.sort_values(by=colunas_ordenacao)
+    colunas_finais = [coluna for coluna in COLUNAS_DOWNLOAD_FILTRADO if coluna in df_download.columns]
+    return df_download[colunas_finais + [coluna for coluna in df_download.columns if coluna not in colunas_finais]]
+
+# Função para gerar os arquivos do download filtrado (CSV, Excel por retailer e ZIP por retailer)
+def gerar_arquivos_download_filtrado(df_com_atencao: pd.DataFrame, conversas: List[str], formato_zip: str = None) -> Dict[str, bytes]:
+    df_download = montar_download_filtrado(df_com_atencao, conversas)
+    # Agrupar por retailer se disponível (uma aba por retailer); sem retailer ou com apenas um, uma única aba
+    if "retailer" in df_download.columns and df_download["retailer"].nunique() > 1:
+        abas = particionar_por_retailer(df_download)
+    else:
+        abas = {'Conversas Atenção': df_download}
+    arquivos = {
+        # QUOTE_ALL para garantir que conversas com vírgulas sejam preservadas
+        "csv": df_download.to_csv(index=False, quoting=csv.QUOTE_ALL).encode('utf-8-sig'),
+        "excel": gerar_excel(abas)
+    }
+    if formato_zip and "retailer" in df_download.columns:
+        arquivos["zip"] = gerar_zip_por_retailer(particionar_por_retailer(df_download), formato_zip)
+    return arquivos
+
+# Função para gerar os arquivos do download completo (CSV e Excel com todas as conversas)
+def gerar_arquivos_download_completo(df_resultados: pd.DataFrame, conversas: List[str]) -> Dict[str, bytes]:
+    df_download = anexar_conversas(df_resultados, conversas)
+    return {
+        "csv": df_download.to_csv(index=False, quoting=csv.QUOTE_ALL).encode('utf-8-sig'),
+        "excel": gerar_excel({'Resultados': df_download})
+    }
+
+# Função para obter os arquivos de download já gerados para os resultados atuais
+def arquivos_download_gerados(df_resultados: pd.DataFrame, secao: str, parametros: tuple = ()) -> Dict:
+    """Arquivos gerados sob demanda ficam na sessão até os resultados (ou os parâmetros da seção) mudarem"""
+    gerados = st.session_state.get('arquivos_download')
+    if not gerados or gerados["resultados"] is not df_resultados:
+        return None
+    secao_gerada = gerados["secoes"].get(secao)
+    return secao_gerada if secao_gerada and secao_gerada["parametros"] == parametros else None
+
+# Função para guardar na sessão os arquivos de download gerados
+def guardar_arquivos_download(df_resultados: pd.DataFrame, secao: str, arquivos: Dict[str, bytes], parametros: tuple = ()) -> Dict:
+    gerados = st.session_state.get('arquivos_download')
+    if not gerados or gerados["resultados"] is not df_resultados:
+        # Resultados novos: descarta os arquivos da análise anterior
+        gerados = {"resultados": df_resultados, "secoes": {}}
+        st.session_state['arquivos_download'] = gerados
+    gerados["secoes"][secao] = {
+        "arquivos": arquivos,
+        "parametros": parametros,
+        "sufixo": datetime.now().strftime('%Y%m%d_%H%M%S')
+    }
+    return gerados["secoes"][secao]
+
+# Arquivo SQLite com o histórico de vereditos (modo delta)
+ARQUIVO_HISTORICO_ANALISES = os.environ.get("HISTORICO_ANALISES_PATH", "historico_analises.db")
+
+# Campos do resultado que não fazem parte do veredito (metadados da linha e custos da execução)
+CAMPOS_FORA_DO_HISTORICO = {
+    "conversa_numero", "retailer", "data", "hora", "csr_id", "chat_id", "origem_veredito",
+    "escalado", "tempo_modelo_economico_s", "tempo_modelo_forte_s", "custo_somente_forte_usd",
+    "latencia_s", "tentativas", "tempo_espera_s", "hedges", "tokens_entrada", "tokens_saida", "tokens_cache", "tokens_estimados", "custo_usd",
+    *COLUNAS_TEMPOS_CONVERSA
+}
+
+# Histórico persistente de vereditos por conversa (chat_id ou hash do conteúdo)
+class HistoricoAnalises:
+    """Guarda o veredito de cada conversa analisada para que uploads seguintes reanalisem só o que é novo ou mudou"""
+
+    def __init__(self, caminho: str = ARQUIVO_HISTORICO_ANALISES):
+        self.caminho = caminho
+        # Conexão única compartilhada por sessões e jobs (obter_historico_analises): a trava serializa as transações
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._trava = threading.Lock()
+        with self._conexao:
+            self._conexao.execute(
+                "CREATE TABLE IF NOT EXISTS analises ("
+                "chave TEXT PRIMARY KEY, hash_conteudo TEXT NOT NULL, veredito TEXT NOT NULL, "
+                "versao_app TEXT NOT NULL, analisado_em TEXT NOT NULL)"
+            )
+
+    def total(self) -> int:
+        with self._trava:
+            return self._conexao.execute("SELECT COUNT(*) FROM analises").fetchone()[0]
+
+    def buscar(self, chaves: List[str]) -> Dict[str, tuple]:
+        """Retorna {chave: (hash_conteudo, veredito, versao_app)} das chaves presentes no histórico"""
+        encontrados = {}
+        # Consultas em blocos para respeitar o limite de parâmetros do SQLite
+        for inicio in range(0, len(chaves), 500):
+            bloco = chaves[inicio:inicio + 500]
+            with self._trava:
+                linhas = self._conexao.execute(
+                    f"SELECT chave, hash_conteudo, veredito, versao_app FROM analises WHERE chave IN ({','.join('?' * len(bloco))})",
+                    bloco
+                ).fetchall()
+            for chave, hash_conteudo, veredito, versao_app in linhas:
+                encontrados[chave] = (hash_conteudo, json.loads(veredito), versao_app)
+        return encontrados
+
+    def salvar(self, registros: List[tuple]) -> None:
+        """Grava (ou substitui) os registros (chave, hash_conteudo, veredito)"""
+        analisado_em = datetime.now().isoformat(timespec="seconds")
+        with self._trava, self._conexao:
+            self._conexao.executemany(
+                "INSERT OR REPLACE INTO analises (chave, hash_conteudo, veredito, versao_app, analisado_em) VALUES (?, ?, ?, ?, ?)",
+                [(chave, hash_conteudo, json.dumps(veredito, ensure_ascii=False), APP_VERSION, analisado_em)
+                 for chave, hash_conteudo, veredito in registros]
+            )
+
+    def limpar(self) -> None:
+        with self._trava, self._conexao:
+            self._conexao.execute("DELETE FROM analises")
+
+# Histórico único por processo: reruns, sessões e jobs reutilizam a mesma conexão em vez de abrir uma a cada uso
+@st.cache_resource
+def obter_historico_analises() -> HistoricoAnalises:
+    return HistoricoAnalises()
+
+# Função para gerar a chave da conversa no histórico
+def chave_conversa(chat_id, conversa: str) -> tuple:
+    """Retorna (chave, hash do conteúdo): a chave é o chat_id quando existe, senão o próprio hash"""
+    hash_conteudo = hashlib.sha256(conversa.strip().encode("utf-8")).hexdigest()
+    chat_id = str(chat_id).strip() if chat_id is not None else ""
+    if chat_id and chat_id != "N/A":
+        return f"chat:{chat_id}", hash_conteudo
+    return f"hash:{hash_conteudo}", hash_conteudo
+
+# Função para listar os modelos cujos vereditos valem para a configuração atual (modo delta)
+def modelos_aceitos_delta(modelo: str, modo_cascata: bool = False, modelo_forte: str = None,
+                          classificador: "ClassificadorDestilado" = None) -> set:
+    """modelo_utilizado que a execução atual poderia ter produzido: o modelo, o forte na cascata e o classificador na triagem"""
+    modelos = {modelo}
+    if modo_cascata and modelo_forte:
+        modelos.add(modelo_forte)
+    if classificador is not None:
+        modelos.add(f"classificador {classificador.versao}")
+    return modelos
+
+# Função para separar as conversas novas/alteradas das que já têm veredito no histórico
+def separar_delta(itens: List[tuple], historico: HistoricoAnalises, df_original=None, tempos_conversas: pd.DataFrame = None,
+                  modelos_aceitos: set = None) -> tuple:
+    """Retorna (itens a analisar, resultados reaproveitados do histórico); com modelos_aceitos, vereditos de outro modelo/motor são refeitos"""
+    chaves = {}
+    for idx, conversa in itens:
+        metadados = {}
+        adicionar_metadados_csv(metadados, idx, df_original, conversa)
+        chaves[idx] = (metadados, *chave_conversa(metadados["chat_id"], conversa))
+
+    registros = historico.buscar([chave for _, chave, _ in chaves.values()])
+    versao_major = APP_VERSION.split(".")[0]
+
+    pendentes = []
+    reaproveitados = []
+    for idx, conversa in itens:
+        metadados, chave, hash_conteudo = chaves[idx]
+        registro = registros.get(chave)
+        # Reanalisa se a conversa é nova, se o conteúdo mudou, se o veredito é de outra versão MAJOR do prompt
+        # ou se veio de outro modelo/motor (ex.: veredito do classificador numa execução só com o LLM)
+        if (registro is None or registro[0] != hash_conteudo or registro[2].split(".")[0] != versao_major
+                or (modelos_aceitos is not None and registro[1].get("modelo_utilizado") not in modelos_aceitos)):
+            pendentes.append((idx, conversa))
+            continue
+        resultado = dict(registro[1])
+        resultado.update(metadados)
+        adicionar_tempos_conversa(resultado, idx, tempos_conversas)
+        resultado["conversa_numero"] = idx
+        resultado["origem_veredito"] = "histórico"
+        reaproveitados.append(resultado)
+    METRICAS.registrar_cache_hits("historico", len(reaproveitados))
+    return pendentes, reaproveitados
+
+# Função para gravar no histórico os vereditos de uma execução
+def registrar_no_historico(historico: HistoricoAnalises, resultados: List[Dict], conversas: List[str]) -> None:
+    """Salva o veredito de cada resultado novo, identificado pelo chat_id ou hash da conversa"""
+    registros = []
+    for resultado in resultados:
+        chave, hash_conteudo = chave_conversa(resultado.get("chat_id"), obter_conversa(conversas, resultado["conversa_numero"]))
+        veredito = {campo: valor for campo, valor in resultado.items() if campo not in CAMPOS_FORA_DO_HISTORICO}
+        registros.append((chave, hash_conteudo, veredito))
+    historico.salvar(registros)
+
+# Opções de linhas por página na tabela de resultados
+TAMANHOS_PAGINA = [25, 50, 100, 200]
+
+# Função para listar valores distintos de uma coluna (opções dos filtros)
+def valores_distintos(df: pd.DataFrame, coluna: str) -> List[str]:
+    """Retorna os valores distintos da coluna como texto, em ordem alfabética"""
+    if coluna not in df.columns:
+        return []
+    return sorted(df[coluna].dropna().astype(str).unique().tolist())
+
+# Função para filtrar os resultados no servidor
+def filtrar_resultados(df: pd.DataFrame, conversas: List[str], retailers: List[str] = None, motivos: List[str] = None,
+                       tipos_falha: List[str] = None, apenas_acao: bool = False, termo_busca: str = "",
+                       indice: IndiceConversas = None) -> pd.DataFrame:
+    """Aplica os filtros de retailer, motivo, tipo de falha, ação necessária e busca no texto da conversa"""
+    mascara = pd.Series(True, index=df.index)
+    if retailers:
+        mascara &= df["retailer"].astype(str).isin(retailers)
+    if motivos:
+        mascara &= df["motivo_transbordo"].astype(str).isin(motivos)
+    if tipos_falha:
+        mascara &= df["tipo_falha"].astype(str).isin(tipos_falha)
+    if apenas_acao and "acao_necessaria" in df.columns:
+        mascara &= df["acao_necessaria"].apply(
+            lambda x: x if isinstance(x, bool) else str(x).lower() in ["true", "sim", "yes", "1"]
+        )
+
+    termo = termo_busca.strip().lower()
+    if termo and indice is not None:
+        mascara &= df["conversa_numero"].isin(indice.buscar(termo))
+    elif termo:
+        # Sem índice: varredura do texto das conversas
+        candidatos = df.loc[mascara, "conversa_numero"]
+        encontrados = [termo in obter_conversa(conversas, numero).lower() for numero in candidatos]
+        mascara.loc[candidatos.index] = encontrados
+
+    return df[mascara]
+
+# Função para ordenar os resultados pelo campo escolhido
+def ordenar_resultados(df: pd.DataFrame, coluna_ordenacao: str, crescente: bool) -> pd.DataFrame:
+    if coluna_ordenacao in df.columns:
+        # Ordenar como texto evita erro de comparação entre tipos misturados (ex.: bool e str)
+        df = df.sort_values(by=coluna_ordenacao, ascending=crescente, kind="stable",
+                            key=lambda serie: serie if pd.api.types.is_numeric_dtype(serie) else serie.astype(str))
+    return df
+
+# Função para recortar a página visível
+def paginar_resultados(df: pd.DataFrame, pagina: int, tamanho_pagina: int) -> pd.DataFrame:
+    """Retorna apenas as linhas da página solicitada (1-based) do DataFrame já filtrado e ordenado"""
+    inicio = (pagina - 1) * tamanho_pagina
+    return df.iloc[inicio:inicio + tamanho_pagina]
+
+# Função para reaproveitar entre reruns uma visão dos resultados (filtrada ou ordenada)
+def visao_resultados(nome: str, df_resultados: pd.DataFrame, chave: tuple, calcular) -> pd.DataFrame:
+    """Recalcula só quando os resultados ou a chave (filtros, ordenação) mudam: trocar de página apenas recorta a visão"""
+    visao = st.session_state.get(nome)
+    if visao is None or visao["resultados"] is not df_resultados or visao["chave"] != chave:
+        visao = {"resultados": df_resultados, "chave": chave, "df": calcular()}
+        st.session_state[nome] = visao
+    return visao["df"]
+
+# Função para estimar a memória usada pela sessão
+def calcular_memoria_sessao(estado) -> Dict[str, int]:
+    """Estima os bytes de cada item do session state (strings compartilhadas contadas uma única vez)"""
+    vistos = set()
+    
+    def tamanho(valor) -> int:
+        if id(valor) in vistos:
+            return 0
+        vistos.add(id(valor))
+        if isinstance(valor, pd.DataFrame):
+            return int(valor.memory_usage(deep=True).sum())
+        if isinstance(valor, (list, tuple)):
+            return sys.getsizeof(valor) + sum(tamanho(item) for item in valor)
+        if isinstance(valor, dict):
+            return sys.getsizeof(valor) + sum(tamanho(k) + tamanho(v) for k, v in valor.items())
+        return sys.getsizeof(valor)
+    
+    memoria = {}
+    for chave in list(estado.keys()):
+        memoria[chave] = tamanho(estado[chave])
+    return memoria
+
+# Intervalo de atualização do painel de progresso do job (segundos)
+INTERVALO_ATUALIZACAO_JOB_S = 1.0
+
+# Tempo que um job encerrado fica no registro esperando a sessão voltar (depois disso é descartado)
+TTL_JOB_ENCERRADO_S = 30 * 60
+
+# Registro dos jobs de análise em segundo plano, indexado pelo token secreto do job
+# (sobrevive aos reruns e à reconexão do navegador; o ID curto é só para exibição e logs)
+@st.cache_resource
+def registro_jobs_analise() -> Dict:
+    return {}
+
+# Função para descartar jobs encerrados há mais que o TTL (libera conversas, DataFrame e a função de análise)
+def limpar_jobs_expirados(ttl_s: float = TTL_JOB_ENCERRADO_S) -> None:
+    registro = registro_jobs_analise()
+    agora = datetime.now()
+    for token, job in list(registro.items()):
+        if job.encerrado_em is not None and (agora - job.encerrado_em).total_seconds() > ttl_s:
+            registro.pop(token, None)
+
+# Job de análise executado em thread própria, desacoplado da execução do script
+class JobAnalise:
+    """Roda executar_analise em segundo plano; a interface só consulta progresso/estado e pode cancelar"""
+
+    def __init__(self, itens: List[tuple], analisar, delay: float, limite_falhas: int, df_original=None,
+                 conversas: List[str] = None, arquivo_id: str = None, reaproveitados: List[Dict] = None,
+                 reprocessamento: bool = False, modo_delta: bool = False, gravar_historico: bool = False, parametros: Dict = None,
+                 tempos_conversas: pd.DataFrame = None, estruturas: List[ConversaEstruturada] = None, amostragem: Dict = None):
+        self.id = uuid.uuid4().hex[:8]
+        # Token da URL: só quem o tem reencontra o job (o ID curto pode ser adivinhado)
+        self.token = secrets.token_urlsafe(24)
+        self.sessao_id = None  # Sessão que criou o job (a única que o cancela por troca de arquivo ou o remove)
+        self.encerrado_em = None
+        self.parametros = parametros or {}
+        self.arquivo_id = arquivo_id
+        self.conversas = conversas or []
+        self.df_original = df_original
+        self.tempos_conversas = tempos_conversas
+        self.estruturas = estruturas  # Mantém as conversas estruturadas vivas mesmo se a sessão trocar de arquivo
+        self.amostragem = amostragem
+        self.total = len(itens)
+        self.reaproveitados = reaproveitados or []
+        self.reprocessamento = reprocessamento
+        self.modo_delta = modo_delta  # Junta os vereditos reaproveitados aos novos no resultado final
+        self.gravar_historico = gravar_historico  # Grava os vereditos novos no histórico (desligado para o mock local)
+        self.historico = obter_historico_analises() if gravar_historico else None
+        self.criado_em = datetime.now()
+        self.progresso = 0.0
+        self.status = "⏳ Iniciando análise..."
+        self.estado = "executando"  # executando | concluido | cancelado | interrompido | erro
+        self.execucao = None
+        self.erro = None
+        self._cancelar = threading.Event()
+        self._thread = threading.Thread(
+            target=self._executar,
+            args=(itens, analisar, delay, limite_falhas),
+            name=f"job-analise-{self.id}",
+            daemon=True
+        )
+
+    @property
+    def ativo(self) -> bool:
+        return self._thread.is_alive()
+
+    def iniciar(self) -> None:
+        self._thread.start()
+
+    def cancelar(self) -> None:
+        self.status = "🛑 Cancelando após a conversa atual..."
+        self._cancelar.set()
+
+    def _atualizar_status(self, texto: str) -> None:
+        if not self._cancelar.is_set():
+            self.status = texto
+
+    def _atualizar_progresso(self, fracao: float) -> None:
+        self.progresso = fracao
+
+    def _executar(self, itens, analisar, delay, limite_falhas) -> None:
+        # Log estruturado da execução (ignorado se o diretório não puder ser criado, ex.: disco somente leitura)
+        try:
+            log_execucao = LogExecucao(self.id)
+        except OSError:
+            log_execucao = None
+        if log_execucao:
+            log_execucao.registrar(
+                "execucao_iniciada",
+                versao_app=APP_VERSION,
+                conversas=self.total,
+                reaproveitadas_historico=len(self.reaproveitados),
+                reprocessamento=self.reprocessamento,
+                arquivo=self.arquivo_id,
+                parametros=self.parametros
+            )
+        inicio = time.perf_counter()
+        try:
+            execucao = executar_analise(
+                itens,
+                analisar,
+                delay,
+                DisjuntorFalhas(limite_falhas),
+                df_original=self.df_original,
+                ao_status=self._atualizar_status,
+                ao_progresso=self._atualizar_progresso,
+                cancelar=self._cancelar,
+                log_execucao=log_execucao,
+                tempos_conversas=self.tempos_conversas,
+                estruturas=self.estruturas,
+                nome_provedor=self.parametros.get("provedor_llm", "OpenAI")
+            )
+            # Modo delta: os vereditos novos vão para o histórico mesmo que ninguém esteja acompanhando o job
+            if self.gravar_historico and execucao["resultados"]:
+                registrar_no_historico(self.historico, execucao["resultados"], self.conversas)
+            self.execucao = execucao
+            if execucao["cancelado"]:
+                self.estado = "cancelado"
+            elif execucao["interrompido"]:
+                self.estado = "interrompido"
+            else:
+                self.estado = "concluido"
+            if log_execucao:
+                resultados = execucao["resultados"]
+                log_execucao.registrar(
+                    "execucao_finalizada",
+                    estado=self.estado,
+                    duracao_s=round(time.perf_counter() - inicio, 2),
+                    analisadas=len(resultados),
+                    falhas=len(execucao["falhas"]),
+                    tokens_entrada=sum(r.get("tokens_entrada", 0) for r in resultados),
+                    tokens_saida=sum(r.get("tokens_saida", 0) for r in resultados),
+                    custo_usd=sum(r.get("custo_usd", 0.0) for r in resultados)
+                )
+        except Exception as e:
+            self.erro = e
+            self.estado = "erro"
+            if log_execucao:
+                log_execucao.registrar("execucao_erro", erro=repr(e), duracao_s=round(time.perf_counter() - inicio, 2))
+        finally:
+            self.encerrado_em = datetime.now()
+
+# Função para montar a função de análise com as configurações atuais da sidebar
+def criar_funcao_analise():
+    """Copia as configurações do rerun atual para que o job não dependa dos widgets"""
+    configuracao = {
+        "modo_cascata": modo_cascata,
+        "modelo": model_name,
+        "modelo_forte": modelo_forte,
+        "api_key": api_key,
+        "provedor": ProvedorOpenAI(
+            api_key, base_url_llm, provedor_llm, timeout_requisicao_s,
+            PoliticaHedge(percentil_hedge, orcamento_hedge / 100) if usar_hedge else None
+        ),
+        "limiar_confianca": limiar_confianca_cascata,
+        "max_tokens": limiar_tokens_segmentacao if segmentar_conversas_longas else None,
+        "sobreposicao_tokens": sobreposicao_tokens_segmentacao,
+        "classificador": classificador_destilado if usar_classificador else None,
+        "limiar_classificador": limiar_confianca_classificador
+    }
+    
+    # Analisar conversa no provedor de LLM (em cascata se habilitado)
+    def analisar_llm(conversa, ao_receber_campos):
+        if configuracao["modo_cascata"]:
+            return analisar_conversa_cascata(
+                conversa,
+                configuracao["modelo"],
+                configuracao["modelo_forte"],
+                configuracao["api_key"],
+                configuracao["limiar_confianca"],
+                max_tokens=configuracao["max_tokens"],
+                sobreposicao_tokens=configuracao["sobreposicao_tokens"],
+                ao_receber_campos=ao_receber_campos,
+                provedor=configuracao["provedor"]
+            )
+        return analisar_conversa(
+            conversa,
+            configuracao["modelo"],
+            configuracao["api_key"],
+            max_tokens=configuracao["max_tokens"],
+            sobreposicao_tokens=configuracao["sobreposicao_tokens"],
+            ao_receber_campos=ao_receber_campos,
+            provedor=configuracao["provedor"]
+        )
+    
+    # Triagem local antes da API, se habilitada
+    def analisar(conversa, ao_receber_campos):
+        if configuracao["classificador"] is not None:
+            return analisar_com_triagem(
+                conversa, configuracao["classificador"], configuracao["limiar_classificador"], analisar_llm, ao_receber_campos
+            )
+        return analisar_llm(conversa, ao_receber_campos)
+    
+    return analisar
+
+# Função para iniciar a análise de um lote em segundo plano
+def iniciar_job_analise(itens: List[tuple], reprocessamento: bool = False, reaproveitados: List[Dict] = None,
+                        amostragem: Dict = None) -> JobAnalise:
+    """Cria o job, registra pelo token e associa à sessão (e à URL, para reconectar em outra aba)"""
+    job = JobAnalise(
+        itens,
+        criar_funcao_analise(),
+        delay_entre_requisicoes,
+        limite_falhas_disjuntor,
+        df_original=st.session_state.get('df_csv_original', None),
+        conversas=st.session_state.get('conversas_store', []),
+        tempos_conversas=st.session_state.get('tempos_conversas'),
+        estruturas=st.session_state.get('conversas_estruturadas'),
+        amostragem=amostragem,
+        arquivo_id=st.session_state.get('arquivo_carregado_id'),
+        reaproveitados=reaproveitados,
+        reprocessamento=reprocessamento,
+        modo_delta=modo_delta,
+        gravar_historico=modo_delta and provedor_llm != "Mock local (offline)",  # Vereditos sintéticos não entram no histórico
+        parametros={
+            "provedor_llm": provedor_llm,
+            "base_url_llm": base_url_llm,
+            "modelo": model_name,
+            "modo_cascata": modo_cascata,
+            "modelo_forte": modelo_forte if modo_cascata else None,
+            "limiar_confianca_cascata": limiar_confianca_cascata if modo_cascata else None,
+            "delay_entre_requisicoes": delay_entre_requisicoes,
+            "timeout_requisicao_s": timeout_requisicao_s,
+            "hedge_percentil": percentil_hedge if usar_hedge else None,
+            "hedge_orcamento": orcamento_hedge / 100 if usar_hedge else None,
+            "limite_falhas_disjuntor": limite_falhas_disjuntor,
+            "segmentacao_max_tokens": limiar_tokens_segmentacao if segmentar_conversas_longas else None,
+            "modo_delta": modo_delta,
+            "ordem_analise": ordem_analise,
+            "amostra_estratificada": tamanho_amostra if amostragem else None
+        }
+    )
+    job.sessao_id = id_sessao()
+    registro_jobs_analise()[job.token] = job
+    job.iniciar()
+    st.session_state['job_token'] = job.token
+    st.query_params["job"] = job.token
+    return job
+
+# Função para desassociar o job da sessão; só a sessão que o criou o remove do registro
+def descartar_job(token: str) -> None:
+    job = registro_jobs_analise().get(token)
+    if job is not None and job.sessao_id == id_sessao():
+        registro_jobs_analise().pop(token, None)
+    st.session_state.pop('job_token', None)
+    if st.query_params.get("job") == token:
+        del st.query_params["job"]
+
+# Função para salvar no session state o resultado de um job encerrado
+def finalizar_job(job: JobAnalise) -> None:
+    """Atualiza resultados e fila de reprocessamento com o que o job produziu"""
+    descartar_job(job.token)
+    
+    # Sessão reconectada pela URL (sem o arquivo carregado): adotar as conversas do job
+    if st.session_state.get('arquivo_carregado_id') is None:
+        st.session_state['arquivo_carregado_id'] = job.arquivo_id
+        st.session_state['conversas_store'] = job.conversas
+        st.session_state['conversas_estruturadas'] = job.estruturas
+        st.session_state['df_csv_original'] = job.df_original
+        st.session_state['conversas_carregadas_count'] = len(job.conversas)
+    
+    # Mensagem guardada na sessão: continua visível nos reruns seguintes (ex.: ao iniciar o reprocessamento da fila)
+    if job.estado == "erro":
+        st.session_state['aviso_job'] = ("error", f"❌ **Erro inesperado no job {job.id}**: {job.erro}")
+        return
+    
+    execucao = job.execucao
+    if job.estado == "interrompido":
+        erro = execucao["ultimo_erro"]
+        st.session_state['aviso_job'] = (
+            "error",
+            f"❌ **Análise interrompida** ({erro.classe}): {erro}. As conversas restantes foram mantidas na fila de reprocessamento."
+        )
+    elif job.estado == "cancelado":
+        st.session_state['aviso_job'] = (
+            "warning",
+            f"🛑 Análise cancelada: {len(execucao['resultados'])} conversa(s) analisadas. As restantes foram para a fila de reprocessamento."
+        )
+    else:
+        st.session_state['aviso_job'] = ("success", f"✅ Análise concluída! (job {job.id})")
+    
+    st.session_state['fila_reprocessamento'] = execucao["falhas"]
+    
+    # Modo delta: juntar os vereditos reaproveitados do histórico
+    resultados = execucao["resultados"]
+    if job.modo_delta:
+        for resultado in resultados:
+            resultado["origem_veredito"] = "nova análise"
+        resultados = resultados + job.reaproveitados
+    # A ordem de análise pode ser por risco: a tabela volta para a ordem do arquivo
+    resultados = sorted(resultados, key=lambda r: r["conversa_numero"])
+    
+    df_resultados = montar_df_resultados(resultados) if resultados else None
+    
+    # Juntar com resultados anteriores quando for reprocessamento da fila
+    if job.reprocessamento and st.session_state.get('resultados_processados'):
+        df_anterior = st.session_state['df_resultados']
+        df_resultados = df_anterior if df_resultados is None else (
+            pd.concat([df_anterior, df_resultados], ignore_index=True).sort_values("conversa_numero", ignore_index=True)
+        )
+    
+    # Plano da amostra estratificada (o reprocessamento da fila continua a mesma amostra)
+    if not job.reprocessamento:
+        st.session_state['plano_amostragem'] = job.amostragem
+    
+    if df_resultados is None or df_resultados.empty:
+        st.session_state['resultados_processados'] = False
+        st.session_state['resumo_cascata'] = None
+        st.session_state['resumo_requisicoes'] = None
+        st.session_state['resumo_amostragem'] = None
+        return
+    
+    # Resumo do modo cascata (None quando desabilitado)
+    st.session_state['resumo_cascata'] = resumir_cascata(df_resultados.to_dict('records'))
+    
+    # Latência, tokens, tentativas e custo por requisição (None sem instrumentação, ex.: só histórico)
+    st.session_state['resumo_requisicoes'] = resumir_metricas_requisicoes(df_resultados)
+    
+    # Estimativas da população quando só uma amostra estratificada foi analisada
+    plano_amostragem = st.session_state.get('plano_amostragem')
+    st.session_state['resumo_amostragem'] = (
+        estimar_taxas_populacao(df_resultados, plano_amostragem, plano_amostragem["nivel_confianca"]) if plano_amostragem else None
+    )
+    
+    # Salvar no session state
+    st.session_state['df_resultados'] = df_resultados
+    st.session_state['resultados_processados'] = True
+
+# Painel de acompanhamento do job (atualizado sem rerun da página inteira)
+@st.fragment(run_every=INTERVALO_ATUALIZACAO_JOB_S)
+def painel_job(job: JobAnalise) -> None:
+    if not job.ativo:
+        # Job terminou: rerun completo para carregar os resultados
+        st.rerun()
+    
+    st.progress(job.progresso, text=job.status)
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.caption(
+            f"🆔 Job **{job.id}** • {job.total} conversa(s) • iniciado às {job.criado_em.strftime('%H:%M:%S')}. "
+            "A análise continua no servidor mesmo se esta aba for fechada: reabra o endereço atual desta página "
+            f"(com `?job=...`) em até {TTL_JOB_ENCERRADO_S // 60} min após o fim para recuperar os resultados."
+        )
+    with col2:
+        if st.button("🛑 Cancelar análise", use_container_width=True, key=f"cancelar_job_{job.id}"):
+            job.cancelar()
+
+# Reconectar ao job desta sessão (ou ao informado na URL pelo token)
+limpar_jobs_expirados()
+job_token = st.session_state.get('job_token') or st.query_params.get("job")
+job_atual = registro_jobs_analise().get(job_token) if job_token else None
+if job_token and job_atual is None:
+    # Job inexistente (servidor reiniciado, token inválido ou expirado após o TTL)
+    descartar_job(job_token)
+elif job_atual is not None:
+    st.session_state['job_token'] = job_atual.token
+    if st.session_state.get('arquivo_carregado_id') not in (None, job_atual.arquivo_id):
+        # Outro arquivo foi carregado: os resultados do job não correspondem mais às conversas da sessão.
+        # Só a sessão que criou o job o cancela; as demais apenas deixam de acompanhá-lo
+        if job_atual.sessao_id == id_sessao():
+            job_atual.cancelar()
+        descartar_job(job_atual.token)
+        job_atual = None
+    elif not job_atual.ativo:
+        finalizar_job(job_atual)
+        job_atual = None
+
+# Resultado do último job encerrado (substituído quando o próximo job terminar)
+aviso_job = st.session_state.get('aviso_job')
+if aviso_job:
+    tipo_aviso, texto_aviso = aviso_job
+    getattr(st, tipo_aviso)(texto_aviso)
+
+if job_atual is not None:
+    st.subheader("⏳ Análise em andamento")
+    painel_job(job_atual)
+
+if conversas_carregadas and st.button("🚀 Iniciar Análise", type="primary", use_container_width=True, disabled=job_atual is not None):
     if len(conversas_carregadas) == 0:
         st.error("❌ Nenhuma conversa encontrada para analisar!")
     else:
@@ -1145,200 +4145,86 @@ if conversas_carregadas and st.button("🚀 Iniciar Análise", type="primary", u
         
         # Aplicar limite de conversas se configurado
         limite = st.session_state.get('limite_conversas', None)
-        conversas_para_analisar = conversas_carregadas
+        total_para_analisar = len(conversas_carregadas)
         
+        selecao = "as de maior risco" if ordem_analise == ORDENS_ANALISE[0] else "as primeiras"
         if limite and limite < len(conversas_carregadas):
-            conversas_para_analisar = conversas_carregadas[:limite]
-            st.info(f"📊 **Limite aplicado**: Analisando apenas as primeiras {limite} de {len(conversas_carregadas)} conversas carregadas.")
+            total_para_analisar = limite
+            st.info(f"📊 **Limite aplicado**: Analisando apenas {selecao} {limite} de {len(conversas_carregadas)} conversas carregadas.")
         else:
             st.info(f"📊 Analisando todas as {len(conversas_carregadas)} conversas carregadas.")
         
-        # Salvar conversas para análise no session state para garantir acesso posterior
-        st.session_state['conversas_para_analisar'] = conversas_para_analisar
-        
-        # Inicializar lista de resultados
-        resultados = []
-        
-        # Barra de progresso
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        # Obter DataFrame original se disponível
-        df_original = st.session_state.get('df_csv_original', None)
-        
-        # Função auxiliar para encontrar coluna por nome (case-insensitive)
-        def encontrar_coluna(df, nomes_possiveis):
-            if df is None:
-                return None
-            for nome in nomes_possiveis:
-                for col in df.columns:
-                    if col.strip().lower() == nome.lower():
-                        return col
-            return None
-        
-        # Identificar colunas relevantes no CSV original
-        col_retailer = encontrar_coluna(df_original, ['retailer', 'cliente', 'customer', 'loja', 'store'])
-        col_data = encontrar_coluna(df_original, ['data', 'date', 'data_hora', 'datetime', 'timestamp'])
-        col_hora = encontrar_coluna(df_original, ['hora', 'time', 'horario'])
-        col_conversa_original = encontrar_coluna(df_original, ['conversa', 'conversation'])
-        col_csr_id = encontrar_coluna(df_original, ['csr id', 'csr_id', 'csrid', 'csr', 'atendente id', 'atendente_id'])
-        col_chat_id = encontrar_coluna(df_original, ['chat id', 'chat_id', 'chatid', 'chat', 'conversation id', 'conversation_id'])
-        
-        # Iterar sobre as conversas (limitadas)
-        total_conversas = len(conversas_para_analisar)
-        for idx, conversa in enumerate(conversas_para_analisar, 1):
-            status_text.text(f"📊 Analisando conversa {idx}/{total_conversas} (OpenAI API)...")
-            
-            # Analisar conversa usando OpenAI API
-            resultado = analisar_conversa(conversa, model_name, api_key)
-            # Delay configurável para evitar rate limiting
-            time.sleep(delay_entre_requisicoes)
-            
-            resultado["conversa_numero"] = idx
-            resultado["conversa"] = conversa[:200] + "..." if len(conversa) > 200 else conversa
-            resultado["conversa_completa"] = conversa  # Manter conversa completa para download
-            
-            # Adicionar informações do CSV original se disponível
-            if df_original is not None and idx <= len(df_original):
-                linha_original = df_original.iloc[idx - 1]
-                
-                # Adicionar retailer/cliente
-                if col_retailer:
-                    resultado["retailer"] = str(linha_original.get(col_retailer, "N/A")).strip()
-                else:
-                    resultado["retailer"] = "N/A"
-                
-                # Adicionar data
-                if col_data:
-                    data_valor = linha_original.get(col_data, "N/A")
-                    resultado["data"] = str(data_valor).strip() if pd.notna(data_valor) else "N/A"
-                else:
-                    resultado["data"] = "N/A"
-                
-                # Adicionar hora (se coluna separada)
-                if col_hora:
-                    hora_valor = linha_original.get(col_hora, "N/A")
-                    resultado["hora"] = str(hora_valor).strip() if pd.notna(hora_valor) else "N/A"
-                else:
-                    resultado["hora"] = "N/A"
-                
-                # Adicionar csr id
-                if col_csr_id:
-                    csr_id_valor = linha_original.get(col_csr_id, "N/A")
-                    resultado["csr_id"] = str(csr_id_valor).strip() if pd.notna(csr_id_valor) else "N/A"
-                else:
-                    resultado["csr_id"] = "N/A"
-                
-                # Adicionar chat id
-                if col_chat_id:
-                    chat_id_valor = linha_original.get(col_chat_id, "N/A")
-                    resultado["chat_id"] = str(chat_id_valor).strip() if pd.notna(chat_id_valor) else "N/A"
-                else:
-                    resultado["chat_id"] = "N/A"
-            else:
-                resultado["retailer"] = "N/A"
-                resultado["data"] = "N/A"
-                resultado["hora"] = "N/A"
-                resultado["csr_id"] = "N/A"
-                resultado["chat_id"] = "N/A"
-            
-            resultados.append(resultado)
-            
-            # Atualizar progresso
-            progress = idx / total_conversas
-            progress_bar.progress(progress)
-        
-        status_text.text("✅ Análise concluída!")
-        
-        # Criar DataFrame com resultados
-        df_resultados = pd.DataFrame(resultados)
-        
-        # Garantir que colunas essenciais existam (adicionar se não estiverem presentes)
-        if "sugestao_solucao" not in df_resultados.columns:
-            df_resultados["sugestao_solucao"] = "N/A"
-        if "retailer" not in df_resultados.columns:
-            df_resultados["retailer"] = "N/A"
-        if "data" not in df_resultados.columns:
-            df_resultados["data"] = "N/A"
-        if "hora" not in df_resultados.columns:
-            df_resultados["hora"] = "N/A"
-        if "csr_id" not in df_resultados.columns:
-            df_resultados["csr_id"] = "N/A"
-        if "chat_id" not in df_resultados.columns:
-            df_resultados["chat_id"] = "N/A"
-        if "conversa_completa" not in df_resultados.columns:
-            # Se não existe, tentar recriar a partir das conversas originais
-            # Isso pode acontecer se houver algum problema no processamento
-            df_resultados["conversa_completa"] = ""
-        if "motivo_transbordo" not in df_resultados.columns:
-            df_resultados["motivo_transbordo"] = "N/A"
-        
-        # Garantir que conversa_completa não seja uma versão resumida
-        # Se conversa_completa está vazia ou é igual à conversa resumida, tentar recuperar da lista original
-        conversas_originais = st.session_state.get('conversas_para_analisar', conversas_para_analisar if 'conversas_para_analisar' in locals() else [])
-        
-        if "conversa_completa" in df_resultados.columns and "conversa" in df_resultados.columns:
-            for idx in df_resultados.index:
-                conv_completa = str(df_resultados.loc[idx, "conversa_completa"]).strip()
-                conv_resumida = str(df_resultados.loc[idx, "conversa"]).strip()
-                
-                # Se conversa_completa está vazia ou é igual à resumida (e a resumida termina com "...")
-                if not conv_completa or (conv_resumida.endswith("...") and conv_completa == conv_resumida):
-                    # Tentar recuperar da lista de conversas originais
-                    num_conversa = df_resultados.loc[idx, "conversa_numero"] if "conversa_numero" in df_resultados.columns else None
-                    if num_conversa and isinstance(num_conversa, (int, float)) and conversas_originais and int(num_conversa) <= len(conversas_originais):
-                        idx_original = int(num_conversa) - 1
-                        if 0 <= idx_original < len(conversas_originais):
-                            df_resultados.loc[idx, "conversa_completa"] = conversas_originais[idx_original]
-                    elif conv_resumida and not conv_resumida.endswith("..."):
-                        # Se a conversa não está resumida, usar ela como completa
-                        df_resultados.loc[idx, "conversa_completa"] = conv_resumida
-        
-        # Preencher valores vazios
-        df_resultados["sugestao_solucao"] = df_resultados["sugestao_solucao"].fillna("N/A")
-        df_resultados["retailer"] = df_resultados["retailer"].fillna("N/A")
-        df_resultados["data"] = df_resultados["data"].fillna("N/A")
-        df_resultados["hora"] = df_resultados["hora"].fillna("N/A")
-        df_resultados["csr_id"] = df_resultados["csr_id"].fillna("N/A") if "csr_id" in df_resultados.columns else "N/A"
-        df_resultados["chat_id"] = df_resultados["chat_id"].fillna("N/A") if "chat_id" in df_resultados.columns else "N/A"
-        df_resultados["motivo_transbordo"] = df_resultados["motivo_transbordo"].fillna("N/A") if "motivo_transbordo" in df_resultados.columns else "N/A"
-        df_resultados["conversa_completa"] = df_resultados["conversa_completa"].fillna("")
+        # Itens referenciam o armazenamento único (sem cópia da lista de conversas), na ordem de análise escolhida
+        ordem = ordenar_conversas_analise(len(conversas_carregadas), st.session_state.get('riscos_conversas'), ordem_analise)
+        plano_amostragem = None
+        if amostragem_estratificada:
+            estratos = consolidar_estratos(
+                estratos_conversas(
+                    conversas_carregadas, st.session_state.get('df_csv_original', None), st.session_state.get('riscos_conversas'),
+                    st.session_state.get('conversas_estruturadas')
+                ),
+                tamanho_amostra
+            )
+            amostra = set(sortear_amostra_estratificada(estratos, tamanho_amostra))
+            ordem = [idx for idx in ordem if idx in amostra]
+            total_para_analisar = len(ordem)
+            plano_amostragem = {
+                "estrato": {idx: estratos[idx - 1] for idx in ordem},
+                "tamanhos_estratos": pd.Series(estratos).value_counts().to_dict(),
+                "nivel_confianca": nivel_confianca
+            }
+            st.info(
+                f"📐 **Amostragem estratificada**: {total_para_analisar} de {len(conversas_carregadas)} conversas "
+                f"em {len(plano_amostragem['tamanhos_estratos'])} estrato(s) (retailer × dia × risco local, agrupados quando pequenos)."
+            )
+        itens = [(idx, conversas_carregadas[idx - 1]) for idx in ordem[:total_para_analisar]]
         
-        # Garantir que conversa_completa nunca seja vazia - usar conversa como fallback
-        if "conversa" in df_resultados.columns:
-            mask_vazia = (df_resultados["conversa_completa"].isna()) | (df_resultados["conversa_completa"].astype(str).str.strip() == "")
-            df_resultados.loc[mask_vazia, "conversa_completa"] = df_resultados.loc[mask_vazia, "conversa"]
+        # Modo delta: analisar só as conversas novas ou alteradas desde o último upload
+        reaproveitados = []
+        if modo_delta:
+            itens, reaproveitados = separar_delta(
+                itens, obter_historico_analises(), st.session_state.get('df_csv_original', None), st.session_state.get('tempos_conversas'),
+                modelos_aceitos=modelos_aceitos_delta(
+                    model_name, modo_cascata, modelo_forte, classificador_destilado if usar_classificador else None
+                )
+            )
+            st.info(f"♻️ **Modo delta**: {len(reaproveitados)} conversa(s) reaproveitadas do histórico, {len(itens)} nova(s) ou alterada(s) para analisar.")
         
-        # Reordenar colunas
-        colunas_ordenadas = [
-            "conversa_numero",
-            "retailer",
-            "data",
-            "hora",
-            "csr_id",
-            "chat_id",
-            "acao_necessaria",
-            "tipo_falha",
-            "motivo_transbordo",
-            "descricao",
-            "sugestao_solucao",
-            "conversa"
+        iniciar_job_analise(itens, reaproveitados=reaproveitados, amostragem=plano_amostragem)
+        st.rerun()
+
+# Fila de reprocessamento (conversas que falharam, fora de df_resultados)
+fila_reprocessamento = st.session_state.get('fila_reprocessamento', [])
+if fila_reprocessamento:
+    st.subheader("🔁 Fila de Reprocessamento")
+    df_fila = pd.DataFrame(fila_reprocessamento)
+    contagem_classes = df_fila["classe_erro"].value_counts()
+    st.warning(
+        f"⚠️ {len(df_fila)} conversa(s) não foram analisadas: "
+        + ", ".join(f"{classe}: {qtd}" for classe, qtd in contagem_classes.items())
+    )
+    with st.expander("🔍 Detalhes das falhas"):
+        st.dataframe(df_fila, use_container_width=True, hide_index=True)
+    
+    if st.button("🔁 Reprocessar fila", use_container_width=True, disabled=job_atual is not None):
+        if not api_key:
+            st.error("❌ Por favor, configure a OpenAI API Key na barra lateral!")
+            st.stop()
+        conversas_store = st.session_state.get('conversas_store', [])
+        itens = [
+            (falha["conversa_numero"], conversas_store[falha["conversa_numero"] - 1])
+            for falha in fila_reprocessamento
+            if 0 < falha["conversa_numero"] <= len(conversas_store)
         ]
-        
-        # Verificar se todas as colunas existem antes de reordenar
-        colunas_existentes = [col for col in colunas_ordenadas if col in df_resultados.columns]
-        if len(colunas_existentes) == len(colunas_ordenadas):
-            df_resultados = df_resultados[colunas_ordenadas]
-        
-        # Salvar no session state
-        st.session_state['df_resultados'] = df_resultados
-        st.session_state['resultados_processados'] = True
+        iniciar_job_analise(itens, reprocessamento=True)
+        st.rerun()
 
 # Exibição dos resultados
 if 'resultados_processados' in st.session_state and st.session_state['resultados_processados']:
     st.header("📊 Resultados da Análise")
     
     df_resultados = st.session_state['df_resultados']
+    conversas_store = st.session_state.get('conversas_store', [])
     
     # Estatísticas rápidas
     col1, col2, col3 = st.columns(3)
@@ -1366,11 +4252,202 @@ if 'resultados_processados' in st.session_state and st.session_state['resultados
         else:
             st.metric("Sem Ação Necessária", 0)
     
-    # Dataframe com destaque
+    # Estimativas da população (amostragem estratificada)
+    resumo_amostragem = st.session_state.get('resumo_amostragem')
+    if resumo_amostragem:
+        st.subheader("📐 Estimativas para o Arquivo Inteiro")
+        nivel = f"{resumo_amostragem['nivel_confianca']:.0%}"
+        col_a1, col_a2, col_a3 = st.columns(3)
+        for coluna_metrica, rotulo, taxa in ((col_a1, "Taxa de transbordo", "transbordo"), (col_a2, "Taxa de atenção", "atencao")):
+            estimativa = resumo_amostragem['taxas'][taxa]
+            with coluna_metrica:
+                st.metric(
+                    rotulo,
+                    f"{estimativa['estimativa']:.1%}",
+                    delta=f"IC {nivel}: {estimativa['ic_inferior']:.1%} – {estimativa['ic_superior']:.1%}",
+                    delta_color="off"
+                )
+                st.caption(f"≈ {estimativa['conversas_estimadas']:,} de {resumo_amostragem['populacao']:,} conversas".replace(",", "."))
+        with col_a3:
+            st.metric(
+                "Amostra analisada",
+                f"{resumo_amostragem['amostra']:,}".replace(",", "."),
+                delta=f"{resumo_amostragem['amostra'] / resumo_amostragem['populacao']:.1%} do arquivo",
+                delta_color="off"
+            )
+        st.caption(
+            f"Estimador estratificado em {resumo_amostragem['estratos']} estrato(s) (retailer × dia × risco local, agrupados quando pequenos), com intervalo de Wilson. "
+            "Atenção = transbordo ou bot repetindo a mesma mensagem 3+ vezes (no motor local, a coluna precisa_atencao)."
+        )
+        if resumo_amostragem['estratos_sem_amostra']:
+            st.warning(
+                f"⚠️ {resumo_amostragem['estratos_sem_amostra']} estrato(s) sem conversa analisada: as estimativas cobrem "
+                f"{resumo_amostragem['populacao_coberta']:,} de {resumo_amostragem['populacao']:,} conversas.".replace(",", ".")
+            )
+        with st.expander("📊 Taxas por estrato"):
+            st.dataframe(resumo_amostragem['por_estrato'], use_container_width=True, hide_index=True)
+    
+    # Resumo do modo cascata
+    resumo_cascata = st.session_state.get('resumo_cascata')
+    if resumo_cascata:
+        st.subheader("🪜 Modo Cascata")
+        col_c1, col_c2, col_c3 = st.columns(3)
+        with col_c1:
+            st.metric(
+                "Taxa de Escalonamento",
+                f"{resumo_cascata['taxa_escalonamento']*100:.1f}%",
+                delta=f"{resumo_cascata['escalados']} de {resumo_cascata['total']}",
+                delta_color="off"
+            )
+        with col_c2:
+            economia_custo = resumo_cascata['economia_custo_usd']
+            st.metric(
+                "Custo (USD)",
+                f"${resumo_cascata['custo_cascata_usd']:.4f}",
+                delta=f"{'-' if economia_custo >= 0 else '+'}${abs(economia_custo):.4f} vs. só modelo forte",
+                delta_color="inverse"
+            )
+        with col_c3:
+            if resumo_cascata['economia_tempo_s'] is not None:
+                economia_tempo = resumo_cascata['economia_tempo_s']
+                st.metric(
+                    "Tempo de Análise",
+                    f"{resumo_cascata['tempo_cascata_s']:.0f}s",
+                    delta=f"{'-' if economia_tempo >= 0 else '+'}{abs(economia_tempo):.0f}s vs. só modelo forte (estimado)",
+                    delta_color="inverse"
+                )
+            else:
+                st.metric("Tempo de Análise", f"{resumo_cascata['tempo_cascata_s']:.0f}s")
+                st.caption("Nenhuma conversa escalonada: sem amostra de latência do modelo forte para estimar a economia de tempo.")
+    
+    # Instrumentação das requisições (latência, tokens, tentativas e custo)
+    resumo_requisicoes = st.session_state.get('resumo_requisicoes')
+    if resumo_requisicoes:
+        st.subheader("⏱️ Requisições à API")
+        percentis = resumo_requisicoes['percentis']
+        col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+        with col_r1:
+            st.metric(
+                "Latência p50 / p95 / p99",
+                f"{percentis['latencia_s']['p50']:.2f}s",
+                delta=f"p95 {percentis['latencia_s']['p95']:.2f}s • p99 {percentis['latencia_s']['p99']:.2f}s",
+                delta_color="off"
+            )
+        with col_r2:
+            st.metric(
+                "Tempo em Backoff",
+                f"{resumo_requisicoes['tempo_espera_s']:.0f}s",
+                delta=f"{resumo_requisicoes['tentativas']} nova(s) tentativa(s)",
+                delta_color="off"
+            )
+        with col_r3:
+            st.metric(
+                "Tokens (entrada / saída)",
+                f"{resumo_requisicoes['tokens_entrada']:,} / {resumo_requisicoes['tokens_saida']:,}".replace(",", "."),
+                delta=f"{resumo_requisicoes['tokens_cache']:,} em cache".replace(",", "."),
+                delta_color="off"
+            )
+        with col_r4:
+            st.metric("Custo (USD)", f"${resumo_requisicoes['custo_usd']:.4f}")
+        if resumo_requisicoes['hedges']:
+            st.caption(
+                f"🏁 {resumo_requisicoes['hedges']} requisição(ões) lenta(s) ganharam uma cópia (hedge); "
+                "a latência registrada é a da primeira resposta."
+            )
+        if resumo_requisicoes['tokens_estimados']:
+            st.caption(
+                f"ℹ️ {resumo_requisicoes['tokens_estimados']} de {resumo_requisicoes['requisicoes']} conversa(s) com tokens estimados "
+                "(o streaming foi encerrado antes do bloco de uso da API)."
+            )
+        with st.expander("📈 Percentis e custo por retailer"):
+            st.dataframe(
+                pd.DataFrame(percentis).T.rename_axis("métrica"),
+                use_container_width=True
+            )
+            st.dataframe(resumo_requisicoes['por_retailer'], use_container_width=True, hide_index=True)
+    
+    # Tempos do atendimento extraídos dos timestamps das mensagens (sem custo de API)
+    resumo_tempos = resumir_tempos_atendimento(df_resultados)
+    if resumo_tempos:
+        st.subheader("🕒 Tempos do Atendimento")
+        col_t1, col_t2, col_t3, col_t4 = st.columns(4)
+        for coluna_metrica, rotulo, campo in (
+            (col_t1, "Latência do bot (mediana)", "latencia_bot_media_s"),
+            (col_t2, "Espera até o transbordo", "espera_transbordo_s"),
+            (col_t3, "Duração da sessão", "duracao_sessao_s")
+        ):
+            with coluna_metrica:
+                if resumo_tempos[campo]:
+                    st.metric(rotulo, f"{resumo_tempos[campo]['p50']:.0f}s", delta=f"p90 {resumo_tempos[campo]['p90']:.0f}s", delta_color="off")
+                else:
+                    st.metric(rotulo, "N/A")
+        with col_t4:
+            st.metric(
+                "Abandono do cliente",
+                resumo_tempos['abandonos'],
+                delta=f"{resumo_tempos['pausas_longas']} com pausa de {LIMIAR_PAUSA_LONGA_S // 60}+ min",
+                delta_color="off"
+            )
+        st.caption(
+            f"Espera até o transbordo medida em {resumo_tempos['com_transbordo']} de {resumo_tempos['total']} conversa(s): "
+            "da primeira mensagem do cliente até o bot transferir ou direcionar ao SAC."
+        )
+    
+    # Tabela paginada: filtros, busca e ordenação no servidor, refeitos só quando mudam; trocar de página só recorta a visão
     st.subheader("Tabela de Resultados")
     
-    # Preparar dataframe para exibição com destaque
-    df_display = df_resultados.copy()
+    col_f1, col_f2, col_f3 = st.columns(3)
+    with col_f1:
+        filtro_retailers = st.multiselect("Retailer", options=valores_distintos(df_resultados, "retailer"), key="filtro_retailer")
+    with col_f2:
+        filtro_motivos = st.multiselect("Motivo do transbordo", options=valores_distintos(df_resultados, "motivo_transbordo"), key="filtro_motivo")
+    with col_f3:
+        filtro_tipos = st.multiselect("Tipo de falha", options=valores_distintos(df_resultados, "tipo_falha"), key="filtro_tipo_falha")
+    
+    col_b1, col_b2 = st.columns([3, 1])
+    with col_b1:
+        termo_busca = st.text_input(
+            "🔎 Buscar no texto das conversas",
+            value="",
+            key="busca_conversas",
+            help="Busca por termos em sequência, sem diferenciar acentos e maiúsculas (ex.: troque.app, não recebi, código de rastreio). O último termo aceita prefixo."
+        )
+    with col_b2:
+        filtro_acao = st.checkbox("Apenas conversas que requerem ação", value=False, key="filtro_acao")
+    
+    chave_filtros = (tuple(filtro_retailers), tuple(filtro_motivos), tuple(filtro_tipos), filtro_acao, termo_busca)
+    df_filtrado = visao_resultados('visao_filtrada', df_resultados, chave_filtros, lambda: filtrar_resultados(
+        df_resultados,
+        conversas_store,
+        retailers=filtro_retailers,
+        motivos=filtro_motivos,
+        tipos_falha=filtro_tipos,
+        apenas_acao=filtro_acao,
+        termo_busca=termo_busca,
+        indice=st.session_state.get('indice_conversas')
+    ))
+    
+    col_o1, col_o2, col_o3, col_o4 = st.columns(4)
+    with col_o1:
+        coluna_ordenacao = st.selectbox("Ordenar por", options=list(df_resultados.columns), key="ordenar_por")
+    with col_o2:
+        ordem_crescente = st.selectbox("Ordem", options=["Crescente", "Decrescente"], key="ordem") == "Crescente"
+    with col_o3:
+        tamanho_pagina = st.selectbox("Linhas por página", options=TAMANHOS_PAGINA, index=1, key="tamanho_pagina")
+    total_paginas = max(1, -(-len(df_filtrado) // tamanho_pagina))
+    with col_o4:
+        pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1, key="pagina_resultados")
+    
+    df_ordenado = visao_resultados(
+        'visao_ordenada', df_resultados, (chave_filtros, coluna_ordenacao, ordem_crescente),
+        lambda: ordenar_resultados(df_filtrado, coluna_ordenacao, ordem_crescente)
+    )
+    df_pagina = paginar_resultados(df_ordenado, pagina, tamanho_pagina)
+    
+    st.caption(f"Mostrando {len(df_pagina)} de {len(df_filtrado)} conversa(s) filtrada(s) ({len(df_resultados)} no total) • página {pagina} de {total_paginas}")
+    
+    # Preparar a página para exibição com prévia de 200 caracteres da conversa
+    df_display = anexar_conversas(df_pagina, conversas_store, max_caracteres=200)
     
     # Exibir dataframe
     st.dataframe(
@@ -1380,7 +4457,25 @@ if 'resultados_processados' in st.session_state and st.session_state['resultados
         hide_index=True
     )
     
-    # Seção de Sugestões de Solução
+    # Abrir a conversa completa de uma linha da página
+    if not df_pagina.empty:
+        conversa_aberta = st.selectbox(
+            "📄 Abrir conversa completa",
+            options=[None] + df_pagina["conversa_numero"].tolist(),
+            format_func=lambda numero: "Selecione uma conversa da página" if numero is None else f"Conversa #{numero}",
+            key="conversa_aberta"
+        )
+        if conversa_aberta is not None:
+            with st.expander(f"💬 Conversa #{conversa_aberta}", expanded=True):
+                st.text(obter_conversa(conversas_store, conversa_aberta))
+    
+    if filtro_acao:
+        if not df_filtrado.empty:
+            st.warning(f"⚠️ {len(df_filtrado)} conversa(s) requer(em) ação/intervenção!")
+        else:
+            st.success("✅ Nenhuma conversa requer ação especial!")
+    
+    # Seção de Sugestões de Solução (apenas para as conversas da página atual)
     if "acao_necessaria" in df_display.columns and "sugestao_solucao" in df_display.columns:
         # Filtrar conversas que precisam de ação e têm sugestão
         df_com_sugestoes = df_display[
@@ -1394,91 +4489,27 @@ if 'resultados_processados' in st.session_state and st.session_state['resultados
         
         if not df_com_sugestoes.empty:
             st.subheader("💡 Sugestões de Solução")
-            st.info(f"📋 Encontradas {len(df_com_sugestoes)} conversa(s) com problemas e sugestões de solução:")
+            st.info(f"📋 {len(df_com_sugestoes)} conversa(s) desta página com problemas e sugestões de solução:")
             
             for idx, row in df_com_sugestoes.iterrows():
                 with st.expander(f"🔧 Conversa #{row.get('conversa_numero', idx)} - {row.get('tipo_falha', 'Problema identificado')}"):
                     st.markdown(f"**Problema:** {row.get('descricao', 'N/A')}")
                     st.markdown(f"**💡 Sugestão de Solução:** {row.get('sugestao_solucao', 'N/A')}")
     
-    # Filtro para destacar conversas que precisam ação
-    st.info("💡 **Dica:** Use o filtro abaixo para visualizar apenas as conversas que requerem ação/intervenção.")
-    
-    filtro_acao = st.checkbox("Mostrar apenas conversas que requerem ação", value=False)
-    
-    if filtro_acao:
-        if "acao_necessaria" in df_display.columns:
-            df_filtrado = df_display[df_display['acao_necessaria'].apply(
-                lambda x: x if isinstance(x, bool) else str(x).lower() in ["true", "sim", "yes", "1"]
-            )]
-            if not df_filtrado.empty:
-                st.dataframe(
-                    df_filtrado,
-                    use_container_width=True,
-                    height=300,
-                    hide_index=True
-                )
-                st.warning(f"⚠️ {len(df_filtrado)} conversa(s) requer(em) ação/intervenção!")
-            else:
-                st.success("✅ Nenhuma conversa requer ação especial!")
-        else:
-            st.warning("⚠️ Campo 'acao_necessaria' não encontrado nos resultados.")
-    
     # Botões de download
     st.subheader("💾 Download do Relatório")
     
-    # Validação: Comparar conversas originais com conversas no DataFrame final
+    # Validação: todas as conversas exportadas vêm do armazenamento único da sessão
     st.markdown("### ✅ Validação de Integridade das Conversas")
     
-    conversas_originais = st.session_state.get('conversas_para_analisar', [])
-    problemas_encontrados = []
-    conversas_validadas = 0
-    
-    if conversas_originais and "conversa_completa" in df_resultados.columns and "conversa_numero" in df_resultados.columns:
-        for idx in df_resultados.index:
-            num_conversa = df_resultados.loc[idx, "conversa_numero"]
-            if isinstance(num_conversa, (int, float)) and int(num_conversa) <= len(conversas_originais):
-                idx_original = int(num_conversa) - 1
-                if 0 <= idx_original < len(conversas_originais):
-                    conversa_original = str(conversas_originais[idx_original])
-                    conversa_no_df = str(df_resultados.loc[idx, "conversa_completa"])
-                    
-                    # Comparar número de caracteres
-                    chars_original = len(conversa_original)
-                    chars_no_df = len(conversa_no_df)
-                    
-                    if chars_original != chars_no_df:
-                        problemas_encontrados.append({
-                            "conversa_numero": int(num_conversa),
-                            "chars_original": chars_original,
-                            "chars_no_df": chars_no_df,
-                            "diferenca": chars_original - chars_no_df
-                        })
-                    else:
-                        conversas_validadas += 1
-        
-        # Exibir resultado da validação
-        if problemas_encontrados:
-            st.error(f"❌ **ATENÇÃO**: {len(problemas_encontrados)} conversa(s) com diferença no número de caracteres detectada(s)!")
-            with st.expander("🔍 Detalhes das conversas com problema", expanded=False):
-                df_problemas = pd.DataFrame(problemas_encontrados)
-                st.dataframe(df_problemas, use_container_width=True, hide_index=True)
-                st.warning("⚠️ As conversas serão corrigidas automaticamente antes do download.")
-            
-            # Corrigir automaticamente as conversas com problema
-            for problema in problemas_encontrados:
-                num_conv = problema["conversa_numero"]
-                idx_original = num_conv - 1
-                if 0 <= idx_original < len(conversas_originais):
-                    # Encontrar a linha no DataFrame
-                    mask = df_resultados["conversa_numero"] == num_conv
-                    if mask.any():
-                        df_resultados.loc[mask, "conversa_completa"] = conversas_originais[idx_original]
-                        st.info(f"✅ Conversa #{num_conv} corrigida: {problema['chars_original']} caracteres restaurados.")
-        else:
-            st.success(f"✅ **Validação concluída**: Todas as {conversas_validadas} conversa(s) têm o mesmo número de caracteres da conversa original analisada!")
+    numeros_sem_conversa = [
+        int(numero) for numero in df_resultados["conversa_numero"]
+        if not obter_conversa(conversas_store, numero)
+    ]
+    if numeros_sem_conversa:
+        st.error(f"❌ **ATENÇÃO**: {len(numeros_sem_conversa)} conversa(s) sem texto no armazenamento da sessão (ex.: #{', #'.join(map(str, numeros_sem_conversa[:10]))}). Carregue novamente o arquivo analisado.")
     else:
-        st.info("ℹ️ Validação não disponível: conversas originais não encontradas no session state.")
+        st.success(f"✅ **Validação concluída**: Todas as {len(df_resultados)} conversa(s) serão exportadas com o texto completo do arquivo carregado!")
     
     st.markdown("---")
     
@@ -1492,227 +4523,64 @@ if 'resultados_processados' in st.session_state and st.session_state['resultados
             df_resultados['acao_necessaria'].apply(
                 lambda x: x if isinstance(x, bool) else str(x).lower() in ["true", "sim", "yes", "1"]
             )
-        ].copy()
+        ]
         
         if not df_com_atencao.empty:
-            # Preparar DataFrame para download filtrado
-            df_download_filtrado = df_com_atencao.copy()
-            
-            # Garantir que conversa_completa contém a conversa completa original
-            # Se conversa_completa não existe ou está truncada, recuperar da lista original
-            conversas_originais = st.session_state.get('conversas_para_analisar', [])
-            
-            if "conversa_completa" in df_download_filtrado.columns:
-                # Verificar e corrigir cada linha para garantir conversa completa
-                for idx in df_download_filtrado.index:
-                    conv_completa_atual = str(df_download_filtrado.loc[idx, "conversa_completa"])
-                    conv_resumida = str(df_download_filtrado.loc[idx, "conversa"]) if "conversa" in df_download_filtrado.columns else ""
-                    
-                    # Se conversa_completa está vazia, truncada ou igual à resumida, recuperar original
-                    if (not conv_completa_atual or 
-                        conv_completa_atual.endswith("...") or 
-                        (conv_resumida.endswith("...") and conv_completa_atual == conv_resumida)):
-                        # Tentar recuperar da lista original
-                        num_conversa = df_download_filtrado.loc[idx, "conversa_numero"] if "conversa_numero" in df_download_filtrado.columns else None
-                        if num_conversa and isinstance(num_conversa, (int, float)) and conversas_originais and int(num_conversa) <= len(conversas_originais):
-                            idx_original = int(num_conversa) - 1
-                            if 0 <= idx_original < len(conversas_originais):
-                                df_download_filtrado.loc[idx, "conversa_completa"] = conversas_originais[idx_original]
-                
-                # Substituir conversa resumida pela conversa completa
-                df_download_filtrado["conversa"] = df_download_filtrado["conversa_completa"].astype(str)
-            
-            # Validação final: Verificar se todas as conversas têm o mesmo número de caracteres da original
-            conversas_originais_validacao = st.session_state.get('conversas_para_analisar', [])
-            if conversas_originais_validacao and "conversa_numero" in df_download_filtrado.columns:
-                for idx in df_download_filtrado.index:
-                    num_conversa = df_download_filtrado.loc[idx, "conversa_numero"]
-                    if isinstance(num_conversa, (int, float)) and int(num_conversa) <= len(conversas_originais_validacao):
-                        idx_original = int(num_conversa) - 1
-                        if 0 <= idx_original < len(conversas_originais_validacao):
-                            conversa_original = str(conversas_originais_validacao[idx_original])
-                            conversa_no_df = str(df_download_filtrado.loc[idx, "conversa_completa"])
-                            
-                            # Se número de caracteres diferente, corrigir
-                            if len(conversa_original) != len(conversa_no_df):
-                                df_download_filtrado.loc[idx, "conversa_completa"] = conversa_original
-            
-            # Selecionar colunas para download (remover conversa_completa se existir)
-            colunas_download = [col for col in df_download_filtrado.columns if col != "conversa_completa"]
-            df_download_filtrado = df_download_filtrado[colunas_download]
-            
-            # Ordenar por retailer (cliente) e depois por data/hora se disponível
-            colunas_ordenacao = []
-            if "retailer" in df_download_filtrado.columns:
-                colunas_ordenacao.append("retailer")
-            if "data" in df_download_filtrado.columns:
-                colunas_ordenacao.append("data")
-            if "hora" in df_download_filtrado.columns:
-                colunas_ordenacao.append("hora")
-            
-            if colunas_ordenacao:
-                df_download_filtrado = df_download_filtrado.sort_values(by=colunas_ordenacao)
-            
-            # Reordenar colunas para download
-            colunas_ordenadas_download = [
-                "retailer",
-                "data",
-                "hora",
-                "csr_id",
-                "chat_id",
-                "conversa_numero",
-                "acao_necessaria",
-                "tipo_falha",
-                "motivo_transbordo",
-                "descricao",
-                "sugestao_solucao",
-                "conversa"
-            ]
-            
-            # Manter apenas colunas que existem
-            colunas_finais = [col for col in colunas_ordenadas_download if col in df_download_filtrado.columns]
-            # Adicionar outras colunas que não estão na lista
-            outras_colunas = [col for col in df_download_filtrado.columns if col not in colunas_finais]
-            colunas_finais = colunas_finais + outras_colunas
-            
-            df_download_filtrado = df_download_filtrado[colunas_finais]
-            
-            st.success(f"✅ {len(df_download_filtrado)} conversa(s) que precisam de atenção encontrada(s).")
-            
-            # Validação final antes do download: Comparar número de caracteres
-            conversas_originais_final = st.session_state.get('conversas_para_analisar', [])
-            validacao_final = []
-            if conversas_originais_final and "conversa_numero" in df_download_filtrado.columns and "conversa" in df_download_filtrado.columns:
-                for idx in df_download_filtrado.index:
-                    num_conversa = df_download_filtrado.loc[idx, "conversa_numero"]
-                    if isinstance(num_conversa, (int, float)) and int(num_conversa) <= len(conversas_originais_final):
-                        idx_original = int(num_conversa) - 1
-                        if 0 <= idx_original < len(conversas_originais_final):
-                            conversa_original = str(conversas_originais_final[idx_original])
-                            conversa_no_df = str(df_download_filtrado.loc[idx, "conversa"])
-                            chars_original = len(conversa_original)
-                            chars_no_df = len(conversa_no_df)
-                            validacao_final.append({
-                                "conversa": int(num_conversa),
-                                "chars_original": chars_original,
-                                "chars_planilha": chars_no_df,
-                                "igual": chars_original == chars_no_df
-                            })
-            
-            # Exibir resumo da validação final
-            if validacao_final:
-                todas_iguais = all(v["igual"] for v in validacao_final)
-                if todas_iguais:
-                    st.success(f"✅ **Validação Final**: Todas as {len(validacao_final)} conversa(s) na planilha têm o mesmo número de caracteres da conversa analisada!")
-                else:
-                    diferentes = [v for v in validacao_final if not v["igual"]]
-                    st.error(f"❌ **ATENÇÃO**: {len(diferentes)} conversa(s) com diferença detectada! Corrigindo automaticamente...")
-                    # Corrigir automaticamente
-                    for v in diferentes:
-                        num_conv = v["conversa"]
-                        idx_original = num_conv - 1
-                        if 0 <= idx_original < len(conversas_originais_final):
-                            mask = df_download_filtrado["conversa_numero"] == num_conv
-                            if mask.any():
-                                df_download_filtrado.loc[mask, "conversa"] = conversas_originais_final[idx_original]
-                    st.success("✅ Conversas corrigidas automaticamente!")
-            
-            col_filtrado1, col_filtrado2 = st.columns(2)
+            st.success(f"✅ {len(df_com_atencao)} conversa(s) que precisam de atenção encontrada(s).")
             
-            with col_filtrado1:
-                # CSV filtrado - garantir que conversa seja string completa
-                # Converter conversa para string explícita para evitar truncamento
-                if "conversa" in df_download_filtrado.columns:
-                    df_download_filtrado["conversa"] = df_download_filtrado["conversa"].astype(str)
-                
-                # Salvar CSV sem limitações
-                csv_filtrado = df_download_filtrado.to_csv(
-                    index=False,
-                    quoting=csv.QUOTE_ALL  # QUOTE_ALL para garantir que conversas com vírgulas sejam preservadas
-                ).encode('utf-8-sig')
-                
-                st.download_button(
-                    label="📥 Download CSV (Filtrado)",
-                    data=csv_filtrado,
-                    file_name=f"conversas_atencao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv",
-                    use_container_width=True,
-                    key="download_csv_filtrado"
+            # ZIP com um arquivo por retailer
+            formato_zip = None
+            if "retailer" in df_com_atencao.columns:
+                formato_zip = st.selectbox(
+                    "Formato dos arquivos do ZIP por retailer",
+                    options=formatos_zip_disponiveis(),
+                    key="formato_zip_retailer"
                 )
             
-            with col_filtrado2:
-                # Excel filtrado - criar em memória
-                # Garantir que conversa seja string completa
-                if "conversa" in df_download_filtrado.columns:
-                    df_download_filtrado["conversa"] = df_download_filtrado["conversa"].astype(str)
-                
-                # Importar openpyxl para ajustar formatação
-                try:
-                    import openpyxl
-                    from openpyxl.styles import Alignment
-                except ImportError:
-                    openpyxl = None
-                    Alignment = None
+            # Arquivos gerados só quando pedidos (e guardados até os resultados mudarem), não a cada rerun
+            download_filtrado = arquivos_download_gerados(df_resultados, "filtrado", (formato_zip,))
+            if download_filtrado is None:
+                if st.button("⚙️ Preparar download filtrado", use_container_width=True, key="preparar_download_filtrado"):
+                    with st.spinner("Gerando CSV, Excel e ZIP das conversas que precisam de atenção..."):
+                        download_filtrado = guardar_arquivos_download(
+                            df_resultados, "filtrado",
+                            gerar_arquivos_download_filtrado(df_com_atencao, conversas_store, formato_zip),
+                            (formato_zip,)
+                        )
+            
+            if download_filtrado is not None:
+                arquivos_filtrado = download_filtrado["arquivos"]
+                col_filtrado1, col_filtrado2 = st.columns(2)
                 
-                excel_buffer_filtrado = BytesIO()
-                with pd.ExcelWriter(excel_buffer_filtrado, engine='openpyxl') as writer:
-                    # Agrupar por retailer se disponível
-                    if "retailer" in df_download_filtrado.columns and df_download_filtrado["retailer"].nunique() > 1:
-                        retailers = df_download_filtrado["retailer"].unique()
-                        for retailer in retailers:
-                            if pd.notna(retailer) and str(retailer).strip() != "N/A":
-                                df_retailer = df_download_filtrado[df_download_filtrado["retailer"] == retailer]
-                                sheet_name = str(retailer)[:31]  # Limite de 31 caracteres para nome da aba
-                                df_retailer.to_excel(writer, index=False, sheet_name=sheet_name)
-                                
-                                # Ajustar largura da coluna de conversa para não truncar
-                                worksheet = writer.sheets[sheet_name]
-                                if "conversa" in df_retailer.columns:
-                                    col_idx = df_retailer.columns.get_loc("conversa") + 1
-                                    worksheet.column_dimensions[worksheet.cell(row=1, column=col_idx).column_letter].width = 100
-                                    # Habilitar quebra de texto
-                                    for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=col_idx, max_col=col_idx):
-                                        for cell in row:
-                                            if Alignment:
-                                                cell.alignment = Alignment(wrap_text=True, vertical='top')
-                            else:
-                                # Conversas sem retailer definido
-                                df_sem_retailer = df_download_filtrado[
-                                    (df_download_filtrado["retailer"].isna()) | 
-                                    (df_download_filtrado["retailer"].astype(str).str.strip() == "N/A")
-                                ]
-                                if not df_sem_retailer.empty:
-                                    df_sem_retailer.to_excel(writer, index=False, sheet_name="Sem Retailer")
-                                    # Ajustar largura da coluna de conversa
-                                    worksheet = writer.sheets["Sem Retailer"]
-                                    if "conversa" in df_sem_retailer.columns:
-                                        col_idx = df_sem_retailer.columns.get_loc("conversa") + 1
-                                        worksheet.column_dimensions[worksheet.cell(row=1, column=col_idx).column_letter].width = 100
-                                        for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=col_idx, max_col=col_idx):
-                                            for cell in row:
-                                                cell.alignment = openpyxl.styles.Alignment(wrap_text=True, vertical='top')
-                    else:
-                        # Se não há retailer ou apenas um, criar uma única aba
-                        df_download_filtrado.to_excel(writer, index=False, sheet_name='Conversas Atenção')
-                        # Ajustar largura da coluna de conversa
-                        worksheet = writer.sheets['Conversas Atenção']
-                        if "conversa" in df_download_filtrado.columns:
-                            col_idx = df_download_filtrado.columns.get_loc("conversa") + 1
-                            worksheet.column_dimensions[worksheet.cell(row=1, column=col_idx).column_letter].width = 100
-                            for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=col_idx, max_col=col_idx):
-                                for cell in row:
-                                    cell.alignment = openpyxl.styles.Alignment(wrap_text=True, vertical='top')
+                with col_filtrado1:
+                    st.download_button(
+                        label="📥 Download CSV (Filtrado)",
+                        data=arquivos_filtrado["csv"],
+                        file_name=f"conversas_atencao_{download_filtrado['sufixo']}.csv",
+                        mime="text/csv",
+                        use_container_width=True,
+                        key="download_csv_filtrado"
+                    )
                 
-                excel_data_filtrado = excel_buffer_filtrado.getvalue()
+                with col_filtrado2:
+                    st.download_button(
+                        label="📥 Download Excel (Filtrado)",
+                        data=arquivos_filtrado["excel"],
+                        file_name=f"conversas_atencao_{download_filtrado['sufixo']}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True,
+                        key="download_excel_filtrado"
+                    )
                 
-                st.download_button(
-                    label="📥 Download Excel (Filtrado)",
-                    data=excel_data_filtrado,
-                    file_name=f"conversas_atencao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                    key="download_excel_filtrado"
-                )
+                if "zip" in arquivos_filtrado:
+                    st.download_button(
+                        label="📦 Download ZIP (um arquivo por retailer)",
+                        data=arquivos_filtrado["zip"],
+                        file_name=f"conversas_atencao_por_retailer_{download_filtrado['sufixo']}.zip",
+                        mime="application/zip",
+                        use_container_width=True,
+                        key="download_zip_retailer"
+                    )
         else:
             st.info("ℹ️ Nenhuma conversa precisa de atenção. Todos os downloads abaixo incluem todas as conversas.")
     else:
@@ -1721,148 +4589,55 @@ if 'resultados_processados' in st.session_state and st.session_state['resultados
     st.markdown("---")
     st.markdown("### 📊 Download Completo - Todas as Conversas")
     
-    # Preparar DataFrame para download completo com conversas completas
-    df_download_completo = df_resultados.copy()
-    
-    # Garantir que conversa_completa contém a conversa completa original
-    # Se conversa_completa não existe ou está truncada, recuperar da lista original
-    conversas_originais = st.session_state.get('conversas_para_analisar', [])
-    
-    if "conversa_completa" in df_download_completo.columns:
-        # Verificar e corrigir cada linha para garantir conversa completa
-        for idx in df_download_completo.index:
-            conv_completa_atual = str(df_download_completo.loc[idx, "conversa_completa"])
-            conv_resumida = str(df_download_completo.loc[idx, "conversa"]) if "conversa" in df_download_completo.columns else ""
-            
-            # Se conversa_completa está vazia, truncada ou igual à resumida, recuperar original
-            if (not conv_completa_atual or 
-                conv_completa_atual.endswith("...") or 
-                (conv_resumida.endswith("...") and conv_completa_atual == conv_resumida)):
-                # Tentar recuperar da lista original
-                num_conversa = df_download_completo.loc[idx, "conversa_numero"] if "conversa_numero" in df_download_completo.columns else None
-                if num_conversa and isinstance(num_conversa, (int, float)) and conversas_originais and int(num_conversa) <= len(conversas_originais):
-                    idx_original = int(num_conversa) - 1
-                    if 0 <= idx_original < len(conversas_originais):
-                        df_download_completo.loc[idx, "conversa_completa"] = conversas_originais[idx_original]
-        
-        # Validação final: Verificar se todas as conversas têm o mesmo número de caracteres da original
-        conversas_originais_validacao = st.session_state.get('conversas_para_analisar', [])
-        if conversas_originais_validacao and "conversa_numero" in df_download_completo.columns:
-            for idx in df_download_completo.index:
-                num_conversa = df_download_completo.loc[idx, "conversa_numero"]
-                if isinstance(num_conversa, (int, float)) and int(num_conversa) <= len(conversas_originais_validacao):
-                    idx_original = int(num_conversa) - 1
-                    if 0 <= idx_original < len(conversas_originais_validacao):
-                        conversa_original = str(conversas_originais_validacao[idx_original])
-                        conversa_no_df = str(df_download_completo.loc[idx, "conversa_completa"])
-                        
-                        # Se número de caracteres diferente, corrigir
-                        if len(conversa_original) != len(conversa_no_df):
-                            df_download_completo.loc[idx, "conversa_completa"] = conversa_original
-        
-        # Substituir conversa resumida pela conversa completa
-        df_download_completo["conversa"] = df_download_completo["conversa_completa"].astype(str)
-    
-    # Remover coluna conversa_completa se existir (já foi copiada para conversa)
-    if "conversa_completa" in df_download_completo.columns:
-        df_download_completo = df_download_completo.drop(columns=["conversa_completa"])
-    
-    # Validação final antes do download completo: Comparar número de caracteres
-    conversas_originais_final_completo = st.session_state.get('conversas_para_analisar', [])
-    validacao_final_completo = []
-    if conversas_originais_final_completo and "conversa_numero" in df_download_completo.columns and "conversa" in df_download_completo.columns:
-        for idx in df_download_completo.index:
-            num_conversa = df_download_completo.loc[idx, "conversa_numero"]
-            if isinstance(num_conversa, (int, float)) and int(num_conversa) <= len(conversas_originais_final_completo):
-                idx_original = int(num_conversa) - 1
-                if 0 <= idx_original < len(conversas_originais_final_completo):
-                    conversa_original = str(conversas_originais_final_completo[idx_original])
-                    conversa_no_df = str(df_download_completo.loc[idx, "conversa"])
-                    chars_original = len(conversa_original)
-                    chars_no_df = len(conversa_no_df)
-                    validacao_final_completo.append({
-                        "conversa": int(num_conversa),
-                        "chars_original": chars_original,
-                        "chars_planilha": chars_no_df,
-                        "igual": chars_original == chars_no_df
-                    })
-    
-    # Exibir resumo da validação final
-    if validacao_final_completo:
-        todas_iguais = all(v["igual"] for v in validacao_final_completo)
-        if todas_iguais:
-            st.success(f"✅ **Validação Final**: Todas as {len(validacao_final_completo)} conversa(s) na planilha têm o mesmo número de caracteres da conversa analisada!")
-        else:
-            diferentes = [v for v in validacao_final_completo if not v["igual"]]
-            st.error(f"❌ **ATENÇÃO**: {len(diferentes)} conversa(s) com diferença detectada! Corrigindo automaticamente...")
-            # Corrigir automaticamente
-            for v in diferentes:
-                num_conv = v["conversa"]
-                idx_original = num_conv - 1
-                if 0 <= idx_original < len(conversas_originais_final_completo):
-                    mask = df_download_completo["conversa_numero"] == num_conv
-                    if mask.any():
-                        df_download_completo.loc[mask, "conversa"] = conversas_originais_final_completo[idx_original]
-            st.success("✅ Conversas corrigidas automaticamente!")
-    
-    col1, col2 = st.columns(2)
+    # Arquivos gerados só quando pedidos (e guardados até os resultados mudarem), não a cada rerun
+    download_completo = arquivos_download_gerados(df_resultados, "completo")
+    if download_completo is None:
+        if st.button("⚙️ Preparar download completo", use_container_width=True, key="preparar_download_completo"):
+            with st.spinner("Gerando CSV e Excel com todas as conversas..."):
+                download_completo = guardar_arquivos_download(
+                    df_resultados, "completo", gerar_arquivos_download_completo(df_resultados, conversas_store)
+                )
     
-    with col1:
-        # CSV - garantir que conversa seja string completa
-        if "conversa" in df_download_completo.columns:
-            df_download_completo["conversa"] = df_download_completo["conversa"].astype(str)
-        
-        # Salvar CSV sem limitações
-        csv = df_download_completo.to_csv(
-            index=False,
-            quoting=csv.QUOTE_ALL  # QUOTE_ALL para garantir que conversas com vírgulas sejam preservadas
-        ).encode('utf-8-sig')
+    if download_completo is not None:
+        col1, col2 = st.columns(2)
         
-        st.download_button(
-            label="📥 Download CSV (Completo)",
-            data=csv,
-            file_name=f"relatorio_qa_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
-    
-    with col2:
-        # Excel - criar em memória
-        # Garantir que conversa seja string completa
-        if "conversa" in df_download_completo.columns:
-            df_download_completo["conversa"] = df_download_completo["conversa"].astype(str)
-        
-        # Importar openpyxl para ajustar formatação
-        try:
-            import openpyxl
-            from openpyxl.styles import Alignment
-        except ImportError:
-            openpyxl = None
-            Alignment = None
-        
-        excel_buffer = BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            df_download_completo.to_excel(writer, index=False, sheet_name='Resultados')
-            
-            # Ajustar largura da coluna de conversa para não truncar
-            worksheet = writer.sheets['Resultados']
-            if "conversa" in df_download_completo.columns:
-                col_idx = df_download_completo.columns.get_loc("conversa") + 1
-                worksheet.column_dimensions[worksheet.cell(row=1, column=col_idx).column_letter].width = 100
-                # Habilitar quebra de texto
-                for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=col_idx, max_col=col_idx):
-                    for cell in row:
-                        if Alignment:
-                            cell.alignment = Alignment(wrap_text=True, vertical='top')
-        
-        excel_data = excel_buffer.getvalue()
+        with col1:
+            st.download_button(
+                label="📥 Download CSV (Completo)",
+                data=download_completo["arquivos"]["csv"],
+                file_name=f"relatorio_qa_completo_{download_completo['sufixo']}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
         
-        st.download_button(
-            label="📥 Download Excel (Completo)",
-            data=excel_data,
-            file_name=f"relatorio_qa_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True
-        )
+        with col2:
+            st.download_button(
+                label="📥 Download Excel (Completo)",
+                data=download_completo["arquivos"]["excel"],
+                file_name=f"relatorio_qa_completo_{download_completo['sufixo']}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
 
+# Histórico do modo delta (mostrado no fim do script, após gravar a execução atual)
+if modo_delta:
+    historico_sidebar = obter_historico_analises()
+    st.sidebar.markdown("---")
+    st.sidebar.caption(f"🗂️ Histórico: **{historico_sidebar.total()}** conversa(s) em `{historico_sidebar.caminho}`")
+    if st.sidebar.button("🗑️ Limpar histórico"):
+        historico_sidebar.limpar()
+        st.rerun()
 
+# Observabilidade: exportador de métricas e logs das execuções
+if METRICAS.ativo:
+    st.sidebar.caption(f"📡 Métricas Prometheus em `:{METRICAS.porta}/metrics` • logs em `{DIRETORIO_LOGS_EXECUCAO}/`")
+elif METRICAS_PROMETHEUS_PORTA and prometheus_client is None:
+    st.sidebar.caption("📡 METRICAS_PROMETHEUS_PORTA definida, mas prometheus_client não está instalado (pip install prometheus-client)")
+
+# Memória ocupada pela sessão (calculada no fim do script, após carga e análise)
+memoria_sessao = calcular_memoria_sessao(st.session_state)
+st.sidebar.markdown("---")
+st.sidebar.metric("💾 Memória da sessão", f"{sum(memoria_sessao.values()) / 1024 / 1024:.1f} MB")
+with st.sidebar.expander("Detalhes de memória"):
+    for chave, tamanho in sorted(memoria_sessao.items(), key=lambda item: item[1], reverse=True)[:10]:
+        st.caption(f"{chave}: {tamanho / 1024:.0f} KB")
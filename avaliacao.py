@@ -0,0 +1,298 @@
+"""
+Avaliação de acurácia × custo dos motores de análise contra os rótulos humanos do conversas_analise.csv
+
+Roda um motor (local, openai, cascata ou classificador destilado) sobre um CSV rotulado e compara os vereditos com as colunas
+preenchidas pela revisão humana: "Necessidade de transbordo", "Realmente teve necessidade de transbordar?",
+"Precisa de atenção?", "Agente agiu corretamente?" e "Motivo do transbordo".
+Para cada campo reporta acurácia, precisão, revocação, F1 e kappa de Cohen, ao lado de tokens, latência e custo
+por conversa. As chamadas à API passam pelo servidor mock em modo gravar/reproduzir (servidor_mock_openai.py),
+de modo que a mesma configuração pode ser reavaliada sem custo depois da primeira gravação.
+
+Uso:
+    python avaliacao.py --motor local
+    python avaliacao.py --motor openai --modelo gpt-4o-mini --mock gravar --cassete cassete_avaliacao.jsonl
+    python avaliacao.py --motor openai --modelo gpt-4o-mini --mock reproduzir --cassete cassete_avaliacao.jsonl
+    python avaliacao.py --motor cascata --modelo gpt-4o-mini --modelo-forte gpt-4o --limiar-confianca 0.8 --saida avaliacao.json
+    python avaliacao.py --motor classificador --limiar-classificador 0.9 --mock reproduzir --cassete cassete_avaliacao.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+# O app roda em modo "bare" do Streamlit ao ser importado: silenciar os avisos de contexto
+logging.disable(logging.WARNING)
+
+from servidor_mock_openai import CasseteRespostas, ConfiguracaoMock, iniciar_servidor
+
+# Colunas de rótulo humano → campo avaliado (valores "Sim"/"Possivelmente" contam como positivo)
+COLUNAS_ROTULO = {
+    "necessidade_transbordo": "Necessidade de transbordo",
+    "real_necessidade": "Realmente teve necessidade de transbordar?",
+    "precisa_atencao": "Precisa de atenção?",
+    "agente_agiu_corretamente": "Agente agiu corretamente?"
+}
+COLUNA_MOTIVO = "Motivo do transbordo"
+VALORES_POSITIVOS = {"sim", "possivelmente", "true", "1"}
+VALORES_NEGATIVOS = {"não", "nao", "false", "0"}
+
+# Função para converter um rótulo textual em booleano (None quando não rotulado)
+def rotulo_booleano(valor):
+    if isinstance(valor, bool):
+        return valor
+    texto = str(valor).strip().lower()
+    if texto in VALORES_POSITIVOS:
+        return True
+    if texto in VALORES_NEGATIVOS:
+        return False
+    return None
+
+# Função para extrair os campos avaliados do resultado de cada motor
+def previsoes_do_resultado(motor: str, resultado: dict) -> dict:
+    """Normaliza o veredito para os campos de COLUNAS_ROTULO; campos que o motor não produz ficam None"""
+    if motor == "local":
+        transbordo = rotulo_booleano(resultado.get("necessidade_transbordo"))
+        return {
+            "necessidade_transbordo": transbordo,
+            "real_necessidade": transbordo,
+            "precisa_atencao": rotulo_booleano(resultado.get("precisa_atencao")),
+            "agente_agiu_corretamente": rotulo_booleano(resultado.get("agente_agiu_corretamente")),
+            "motivo_transbordo": resultado.get("motivo_transbordo")
+        }
+    transbordo = resultado.get("had_need_to_transfer")
+    return {
+        "necessidade_transbordo": transbordo,
+        "real_necessidade": transbordo,
+        "precisa_atencao": resultado.get("acao_necessaria"),
+        "agente_agiu_corretamente": None,
+        "motivo_transbordo": resultado.get("motivo_transbordo")
+    }
+
+# Função para calcular as métricas de concordância de um campo binário
+def metricas_concordancia(pares: list) -> dict:
+    """pares: lista de (rótulo, previsto) booleanos; retorna acurácia, precisão, revocação, F1 e kappa"""
+    vp = sum(1 for rotulo, previsto in pares if rotulo and previsto)
+    vn = sum(1 for rotulo, previsto in pares if not rotulo and not previsto)
+    fp = sum(1 for rotulo, previsto in pares if not rotulo and previsto)
+    fn = sum(1 for rotulo, previsto in pares if rotulo and not previsto)
+    total = len(pares)
+    if not total:
+        return {"n": 0}
+
+    acuracia = (vp + vn) / total
+    precisao = vp / (vp + fp) if vp + fp else None
+    revocacao = vp / (vp + fn) if vp + fn else None
+    f1 = 2 * precisao * revocacao / (precisao + revocacao) if precisao and revocacao else 0.0
+    # Kappa de Cohen: concordância além do acaso, dadas as proporções de positivos de cada lado
+    concordancia_acaso = ((vp + fn) * (vp + fp) + (vn + fp) * (vn + fn)) / total ** 2
+    kappa = (acuracia - concordancia_acaso) / (1 - concordancia_acaso) if concordancia_acaso < 1 else None
+
+    return {
+        "n": total,
+        "acuracia": round(acuracia, 4),
+        "precisao": round(precisao, 4) if precisao is not None else None,
+        "revocacao": round(revocacao, 4) if revocacao is not None else None,
+        "f1": round(f1, 4),
+        "kappa": round(kappa, 4) if kappa is not None else None,
+        "matriz": {"vp": vp, "fp": fp, "fn": fn, "vn": vn}
+    }
+
+# Função para montar a função de análise do motor escolhido
+def criar_funcao_avaliada(app, args):
+    if args.motor == "local":
+        return app.analisar_conversa_local
+    max_tokens = args.segmentar_acima_de or None
+    # Um cliente só para todas as conversas (OPENAI_BASE_URL aponta para o mock quando usado)
+    provedor = app.ProvedorOpenAI(args.api_key)
+    if args.motor == "classificador":
+        classificador = app.ClassificadorDestilado.carregar(args.classificador or app.caminho_classificador_mais_recente())
+        return lambda conversa: app.analisar_com_triagem(
+            conversa, classificador, args.limiar_classificador,
+            lambda conversa_adiada, _: app.analisar_conversa(
+                conversa_adiada, args.modelo, args.api_key, max_tokens=max_tokens, sobreposicao_tokens=args.sobreposicao_tokens,
+                provedor=provedor
+            )
+        )
+    if args.motor == "cascata":
+        return lambda conversa: app.analisar_conversa_cascata(
+            conversa, args.modelo, args.modelo_forte, args.api_key, args.limiar_confianca,
+            max_tokens=max_tokens, sobreposicao_tokens=args.sobreposicao_tokens, provedor=provedor
+        )
+    return lambda conversa: app.analisar_conversa(
+        conversa, args.modelo, args.api_key, max_tokens=max_tokens, sobreposicao_tokens=args.sobreposicao_tokens,
+        provedor=provedor
+    )
+
+# Função para avaliar uma conversa, medindo a latência de ponta a ponta
+def avaliar_conversa(analisar, conversa: str) -> tuple:
+    inicio = time.perf_counter()
+    try:
+        resultado, erro = analisar(conversa), None
+    except Exception as excecao:
+        resultado, erro = None, f"{type(excecao).__name__}: {excecao}"
+    return resultado, erro, time.perf_counter() - inicio
+
+# Função para executar o motor sobre o arquivo rotulado
+def executar_avaliacao(app, df: pd.DataFrame, coluna_conversa: str, args) -> pd.DataFrame:
+    """Retorna uma linha por conversa com rótulos, previsões, tokens, latência e custo"""
+    analisar = criar_funcao_avaliada(app, args)
+    conversas = df[coluna_conversa].astype(str).tolist()
+    with ThreadPoolExecutor(max_workers=1 if args.motor == "local" else args.paralelas) as executor:
+        saidas = list(executor.map(lambda conversa: avaliar_conversa(analisar, conversa), conversas))
+
+    linhas = []
+    for indice, (resultado, erro, latencia) in enumerate(saidas):
+        linha = {"linha": indice + 1, "erro": erro, "latencia_total_s": round(latencia, 4)}
+        rotulos = df.iloc[indice]
+        for campo, coluna in COLUNAS_ROTULO.items():
+            linha[f"rotulo_{campo}"] = rotulo_booleano(rotulos[coluna]) if coluna in df.columns else None
+        linha["rotulo_motivo_transbordo"] = str(rotulos.get(COLUNA_MOTIVO, "")).strip() or None
+        if resultado is not None:
+            for campo, valor in previsoes_do_resultado(args.motor, resultado).items():
+                linha[f"previsto_{campo}"] = valor
+            for campo in ("modelo_utilizado", "tentativas", "tokens_entrada", "tokens_saida", "tokens_cache", "custo_usd", "escalado", "confianca_classificador"):
+                linha[campo] = resultado.get(campo)
+        linhas.append(linha)
+    return pd.DataFrame(linhas)
+
+# Função para resumir concordância e custo da avaliação
+def resumir_avaliacao(df_avaliacao: pd.DataFrame) -> dict:
+    validas = df_avaliacao[df_avaliacao["erro"].isna()]
+    concordancia = {}
+    for campo in COLUNAS_ROTULO:
+        coluna_rotulo, coluna_previsto = f"rotulo_{campo}", f"previsto_{campo}"
+        if coluna_previsto not in validas.columns:
+            continue
+        pares = [
+            (bool(rotulo), bool(previsto))
+            for rotulo, previsto in zip(validas[coluna_rotulo], validas[coluna_previsto])
+            if rotulo is not None and previsto is not None and not pd.isna(rotulo) and not pd.isna(previsto)
+        ]
+        concordancia[campo] = metricas_concordancia(pares)
+
+    # Motivo é texto livre na revisão humana: tabela cruzada em vez de métrica de acerto
+    motivos = validas.dropna(subset=["rotulo_motivo_transbordo"])
+    tabela_motivos = {}
+    if "previsto_motivo_transbordo" in motivos.columns and not motivos.empty:
+        contagem = motivos.groupby(["rotulo_motivo_transbordo", "previsto_motivo_transbordo"]).size()
+        for (rotulo, previsto), quantidade in contagem.items():
+            tabela_motivos.setdefault(rotulo, {})[previsto] = int(quantidade)
+
+    def total(coluna):
+        return float(validas[coluna].fillna(0).sum()) if coluna in validas.columns else 0.0
+
+    quantidade = len(validas)
+    latencias = validas["latencia_total_s"]
+    custo_total = total("custo_usd")
+    return {
+        "conversas": len(df_avaliacao),
+        "falhas": int(df_avaliacao["erro"].notna().sum()),
+        "concordancia": concordancia,
+        "motivo_transbordo": tabela_motivos,
+        "custo": {
+            "tokens_entrada": int(total("tokens_entrada")),
+            "tokens_saida": int(total("tokens_saida")),
+            "tokens_cache": int(total("tokens_cache")),
+            "tokens_por_conversa": round((total("tokens_entrada") + total("tokens_saida")) / quantidade, 1) if quantidade else None,
+            "custo_total_usd": round(custo_total, 6),
+            "custo_por_conversa_usd": round(custo_total / quantidade, 8) if quantidade else None,
+            "latencia_media_s": round(float(latencias.mean()), 4) if quantidade else None,
+            "latencia_p95_s": round(float(latencias.quantile(0.95)), 4) if quantidade else None,
+            "escalonadas": int(validas["escalado"].fillna(False).astype(bool).sum()) if validas["escalado"].notna().any() else None,
+            "resolvidas_pelo_classificador": int(validas["modelo_utilizado"].astype(str).str.startswith("classificador").sum())
+            if validas["confianca_classificador"].notna().any() else None
+        }
+    }
+
+# Função para imprimir o resumo legível no terminal
+def imprimir_resumo(resumo: dict) -> None:
+    print(f"\n📊 {resumo['conversas']} conversas avaliadas ({resumo['falhas']} falha(s))", file=sys.stderr)
+    for campo, metricas in resumo["concordancia"].items():
+        if not metricas["n"]:
+            continue
+        print(
+            f"  {campo:<26} n={metricas['n']:<4} acurácia={metricas['acuracia']:.3f}  F1={metricas['f1']:.3f}  "
+            f"kappa={metricas['kappa'] if metricas['kappa'] is not None else '-'}",
+            file=sys.stderr
+        )
+    custo = resumo["custo"]
+    print(
+        f"  💰 {custo['tokens_por_conversa']} tokens/conversa · US$ {custo['custo_por_conversa_usd']}/conversa · "
+        f"latência média {custo['latencia_media_s']}s (p95 {custo['latencia_p95_s']}s)",
+        file=sys.stderr
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Avaliação de acurácia × custo contra rótulos humanos")
+    parser.add_argument("--arquivo", default="conversas_analise.csv", help="CSV rotulado")
+    parser.add_argument("--motor", choices=["local", "openai", "cascata", "classificador"], default="local")
+    parser.add_argument("--modelo", default="gpt-4o-mini")
+    parser.add_argument("--modelo-forte", default="gpt-4o", help="Modelo de escalonamento do motor cascata")
+    parser.add_argument("--limiar-confianca", type=float, default=0.8)
+    parser.add_argument("--classificador", default=None, help="Artefato do classificador destilado (padrão: o mais recente)")
+    parser.add_argument("--limiar-classificador", type=float, default=0.9, help="Abaixo desta confiança a conversa vai para --modelo (0 = nunca)")
+    parser.add_argument("--segmentar-acima-de", type=int, default=0, help="Segmentar conversas acima deste nº de tokens (0 desativa)")
+    parser.add_argument("--sobreposicao-tokens", type=int, default=0)
+    parser.add_argument("--paralelas", type=int, default=4, help="Conversas analisadas em paralelo pelos motores via API")
+    parser.add_argument("--limite", type=int, default=0, help="Avaliar só as N primeiras conversas (0 = todas)")
+    parser.add_argument("--somente-rotuladas", action="store_true", help="Avaliar só as linhas com revisão humana completa")
+    parser.add_argument("--mock", choices=["reproduzir", "gravar", "sintetico", "desligado"], default="reproduzir",
+                        help="Modo do servidor mock; 'desligado' chama a API configurada diretamente")
+    parser.add_argument("--cassete", default="cassete_avaliacao.jsonl", help="Arquivo de respostas gravadas")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="API real chamada no modo gravar")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY", "sk-mock"))
+    parser.add_argument("--saida", default=None, help="Arquivo JSON do relatório (padrão: stdout)")
+    parser.add_argument("--saida-detalhe", default=None, help="CSV com o resultado de cada conversa")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.arquivo, keep_default_na=False)
+    coluna_conversa = "Conversa" if "Conversa" in df.columns else "conversa"
+    if args.somente_rotuladas:
+        df = df[df[COLUNAS_ROTULO["real_necessidade"]].astype(str).str.strip() != ""]
+    if args.limite:
+        df = df.head(args.limite)
+    df = df.reset_index(drop=True)
+
+    # O mock precisa estar no ar antes de importar o app (o cliente lê OPENAI_BASE_URL).
+    # Sobe também para o classificador com limiar 0: se alguma conversa escapar para o LLM, ela não chega à API real
+    servidor = configuracao_mock = None
+    if args.motor != "local" and args.mock != "desligado":
+        configuracao_mock = ConfiguracaoMock(
+            latencia_ms=0, jitter_ms=0, modo=args.mock,
+            cassete=CasseteRespostas(args.cassete) if args.mock != "sintetico" else None,
+            upstream=args.upstream
+        )
+        servidor, base_url = iniciar_servidor(configuracao_mock)
+        os.environ["OPENAI_BASE_URL"] = base_url
+
+    import app
+
+    df_avaliacao = executar_avaliacao(app, df, coluna_conversa, args)
+    if servidor:
+        servidor.shutdown()
+
+    resumo = resumir_avaliacao(df_avaliacao)
+    relatorio = {
+        "versao_app": app.APP_VERSION,
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "parametros": {campo: valor for campo, valor in vars(args).items() if campo != "api_key"},
+        "mock_openai": configuracao_mock.contadores if configuracao_mock else None,
+        **resumo
+    }
+    imprimir_resumo(resumo)
+
+    if args.saida_detalhe:
+        df_avaliacao.to_csv(args.saida_detalhe, index=False)
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2, default=str)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+        print(f"\n💾 Relatório salvo em {args.saida}", file=sys.stderr)
+    else:
+        print(texto)
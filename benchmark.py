@@ -0,0 +1,321 @@
+"""
+Benchmark das etapas de ingestão, análise e exportação do app
+
+Gera corpora sintéticos no formato do conversas_analise.csv (1k, 10k e 100k linhas por padrão),
+mede tempo, throughput e pico de RSS de cada etapa e grava o resultado em JSON.
+O caminho via LLM usa o servidor mock local (servidor_mock_openai.py), com latência e erros 429 configuráveis.
+
+Uso:
+    python benchmark.py --tamanhos 1000 10000 --saida benchmark.json
+    python benchmark.py --tamanhos 1000 --comparar benchmark_base.json --tolerancia 0.2
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+
+# O app roda em modo "bare" do Streamlit ao ser importado: silenciar os avisos de contexto
+logging.disable(logging.WARNING)
+
+from servidor_mock_openai import ConfiguracaoMock, iniciar_servidor
+
+RETAILERS = ["crocs", "vans", "reserva", "arezzo", "netshoes", "centauro", "mizuno", "olympikus"]
+
+FALAS_CLIENTE = [
+    "Olá boa tarde",
+    "Ajuda",
+    "Já comprei",
+    "Troca e Devolução",
+    "Não recebi meu pedido",
+    "Meu pedido está atrasado, o código de rastreio não atualiza",
+    "Quero cancelar a compra",
+    "Quero falar com um atendente",
+    "O estorno ainda não caiu no meu cartão",
+    "Comprei o tamanho errado, como faço a troca?",
+    "O produto veio com defeito"
+]
+
+FALAS_BOT = [
+    "Olá, bem-vindo(a) de volta!",
+    "Ao dar sequência nesta conversa, você confirma que está ciente e concorda com a Política de Privacidade.",
+    "Para solicitar troca ou devolução acesse https://loja.troque.app.br e siga o passo a passo indicado lá 💚.",
+    "Trocas podem ser feitas em até 90 dias da nota fiscal para produtos com defeito ou avaria.",
+    "Informe o número do pedido, por favor.",
+    "Seu pedido está em transporte. Código de rastreio: BR123456789.",
+    "Vou te transferir para um de nossos especialistas, aguarde um momento.",
+    "Posso ajudar em algo mais?"
+]
+
+# Medidor de pico de RSS por amostragem (a memória do processo inteiro, não só do Python)
+class MedidorRSS:
+    """Amostra o RSS atual do processo em uma thread enquanto a etapa executa"""
+
+    def __init__(self, intervalo_s: float = 0.01):
+        self.intervalo_s = intervalo_s
+        self.inicio = 0
+        self.pico = 0
+        self._parar = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def rss_atual() -> int:
+        """RSS atual em bytes (Linux via /proc; nos demais sistemas usa o pico do processo)"""
+        try:
+            with open("/proc/self/statm") as arquivo:
+                return int(arquivo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return pico if sys.platform == "darwin" else pico * 1024
+
+    def _amostrar(self) -> None:
+        while not self._parar.wait(self.intervalo_s):
+            self.pico = max(self.pico, self.rss_atual())
+
+    def __enter__(self):
+        self.inicio = self.pico = self.rss_atual()
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+        self.pico = max(self.pico, self.rss_atual())
+
+def gerar_conversa(aleatorio: random.Random, inicio: datetime) -> str:
+    """Conversa sintética com o mesmo formato de linhas do export (AUTOR - data hora - mensagem)"""
+    linhas = []
+    momento = inicio
+    for _ in range(aleatorio.randint(3, 14)):
+        autor, falas = aleatorio.choice([("CLIENTE", FALAS_CLIENTE), ("ATENDENTE BOT", FALAS_BOT), ("WHIZZ PÓS-VENDAS", FALAS_BOT)])
+        momento += timedelta(seconds=aleatorio.randint(2, 120))
+        linhas.append(f"{autor} - {momento.strftime('%d/%m/%Y %H:%M:%S')} - {aleatorio.choice(falas)}")
+    return "\n\n".join(linhas)
+
+def gerar_corpus(total: int, semente: int = 42) -> list:
+    """Lista de linhas (Retailer, Csr_id, Chat_id, Conversa) reproduzível pela semente"""
+    aleatorio = random.Random(semente)
+    base = datetime(2026, 1, 5, 8, 0, 0)
+    linhas = []
+    for numero in range(total):
+        inicio = base + timedelta(minutes=aleatorio.randint(0, 7 * 24 * 60))
+        linhas.append({
+            "Retailer": aleatorio.choice(RETAILERS),
+            "Csr_id": f"csr{aleatorio.randint(1, 500):05d}",
+            "Chat_id": f"chat{numero:08d}",
+            "Conversa": gerar_conversa(aleatorio, inicio)
+        })
+    return linhas
+
+def corpus_para_csv(linhas: list) -> str:
+    saida = StringIO()
+    escritor = csv.DictWriter(saida, fieldnames=["Retailer", "Csr_id", "Chat_id", "Conversa"])
+    escritor.writeheader()
+    escritor.writerows(linhas)
+    return saida.getvalue()
+
+def corpus_para_txt(linhas: list) -> str:
+    return "\n---\n".join(linha["Conversa"] for linha in linhas)
+
+def medir(etapa: str, linhas: int, funcao):
+    """Executa a etapa medindo tempo e RSS; retorna (retorno da função, registro da medição)"""
+    with MedidorRSS() as medidor:
+        inicio = time.perf_counter()
+        retorno = funcao()
+        segundos = time.perf_counter() - inicio
+    registro = {
+        "etapa": etapa,
+        "linhas": linhas,
+        "segundos": round(segundos, 4),
+        "linhas_por_s": round(linhas / segundos, 1) if segundos > 0 else None,
+        "pico_rss_mb": round(medidor.pico / 1024 / 1024, 1),
+        "delta_rss_mb": round((medidor.pico - medidor.inicio) / 1024 / 1024, 1)
+    }
+    print(f"  {etapa:<28} {linhas:>7} linhas  {segundos:8.3f}s  {registro['linhas_por_s'] or 0:>10.1f} linhas/s  pico RSS {registro['pico_rss_mb']} MB", file=sys.stderr)
+    return retorno, registro
+
+def executar_benchmark(app, tamanho: int, conversas_llm: int, conversas_local: int, semente: int,
+                       timeout_s: float = None, hedge_percentil: float = 0, hedge_orcamento: float = 0.10) -> list:
+    """Mede todas as etapas para um corpus de `tamanho` linhas"""
+    print(f"\n📊 Corpus de {tamanho} conversas", file=sys.stderr)
+    medicoes = []
+    linhas = gerar_corpus(tamanho, semente)
+    conteudo_csv = corpus_para_csv(linhas)
+    conteudo_txt = corpus_para_txt(linhas)
+    del linhas
+
+    # Ingestão
+    resultado_csv, registro = medir("processar_csv", tamanho, lambda: app.processar_csv(conteudo_csv))
+    medicoes.append(registro)
+    conversas = resultado_csv["conversas"]
+    df_original = resultado_csv["dataframe"]
+    _, registro = medir("processar_txt", tamanho, lambda: app.processar_txt(conteudo_txt))
+    medicoes.append(registro)
+    _, registro = medir("indice_conversas", len(conversas), lambda: app.construir_indice_conversas(conversas))
+    medicoes.append(registro)
+    _, registro = medir("calcular_tempos_conversas", len(conversas), lambda: app.calcular_tempos_conversas(conversas))
+    medicoes.append(registro)
+
+    # Análise local por regras (amostra limitada para corpora grandes); o parse de mensagens é medido à parte
+    amostra_local = conversas[:conversas_local] if conversas_local else conversas
+    app.estruturar_conversa_avulsa.cache_clear()
+    _, registro = medir("parsear_conversa", len(amostra_local), lambda: [app.parsear_conversa(c) for c in amostra_local])
+    medicoes.append(registro)
+    _, registro = medir("detectar_repeticoes_bot", len(amostra_local), lambda: [app.colunas_repeticao_bot(c) for c in amostra_local])
+    medicoes.append(registro)
+    _, registro = medir("analisar_conversa_local", len(amostra_local), lambda: [app.analisar_conversa_local(c) for c in amostra_local])
+    medicoes.append(registro)
+
+    # Parser das respostas do modelo (texto com o JSON do veredito, como chega da API)
+    aleatorio = random.Random(semente)
+    respostas = [
+        json.dumps({"had_need_to_transfer": aleatorio.random() < 0.3, "motivo_transbordo": None})
+        for _ in range(len(conversas))
+    ]
+    _, registro = medir("extract_json_from_text", len(respostas), lambda: [app.extract_json_from_text(r) for r in respostas])
+    medicoes.append(registro)
+
+    # Resultados sintéticos no formato do app (sem passar pela API) para medir a exportação
+    resultados = []
+    for numero, resposta in enumerate(respostas, 1):
+        resultado = app.montar_veredito(json.loads(resposta))
+        resultado["conversa_numero"] = numero
+        resultado["segmentos_analisados"] = 1
+        app.adicionar_metadados_csv(resultado, numero, df_original)
+        resultados.append(resultado)
+    df_resultados, registro = medir("montar_df_resultados", len(resultados), lambda: app.montar_df_resultados(resultados))
+    medicoes.append(registro)
+    df_exportacao, registro = medir("anexar_conversas", len(df_resultados), lambda: app.anexar_conversas(df_resultados, conversas))
+    medicoes.append(registro)
+    _, registro = medir("exportar_csv", len(df_exportacao), lambda: df_exportacao.to_csv(index=False).encode("utf-8-sig"))
+    medicoes.append(registro)
+    _, registro = medir("exportar_excel", len(df_exportacao), lambda: app.gerar_excel({"Resultados": df_exportacao}))
+    medicoes.append(registro)
+    particoes, registro = medir("particionar_por_retailer", len(df_exportacao), lambda: app.particionar_por_retailer(df_exportacao))
+    medicoes.append(registro)
+    _, registro = medir("exportar_zip_csv", len(df_exportacao), lambda: app.gerar_zip_por_retailer(particoes, "CSV"))
+    medicoes.append(registro)
+
+    # Caminho via LLM contra o servidor mock (OPENAI_BASE_URL aponta para ele)
+    if conversas_llm:
+        itens = list(enumerate(conversas[:conversas_llm], 1))
+        politica_hedge = app.PoliticaHedge(hedge_percentil, hedge_orcamento) if hedge_percentil else None
+        provedor = app.ProvedorOpenAI("sk-mock", nome="Mock local", timeout_s=timeout_s, politica_hedge=politica_hedge)
+
+        def analisar(conversa, ao_receber_campos):
+            return app.analisar_conversa(conversa, "gpt-4o-mini", "sk-mock", ao_receber_campos=ao_receber_campos, provedor=provedor)
+
+        execucao, registro = medir(
+            "analise_llm_mock",
+            len(itens),
+            lambda: app.executar_analise(itens, analisar, 0.0, app.DisjuntorFalhas(10), df_original=df_original)
+        )
+        registro["falhas"] = len(execucao["falhas"])
+        latencias = sorted(r["latencia_s"] for r in execucao["resultados"] if "latencia_s" in r)
+        if latencias:
+            registro["latencia_p50_s"] = latencias[len(latencias) // 2]
+            registro["latencia_p99_s"] = latencias[min(int(len(latencias) * 0.99), len(latencias) - 1)]
+        if politica_hedge:
+            registro["hedge"] = politica_hedge.contadores
+        medicoes.append(registro)
+
+    for registro in medicoes:
+        registro["tamanho_corpus"] = tamanho
+    return medicoes
+
+def comparar_com_base(medicoes: list, caminho_base: str, tolerancia: float) -> list:
+    """Lista as etapas cujo throughput caiu mais que a tolerância em relação ao arquivo base"""
+    with open(caminho_base, encoding="utf-8") as arquivo:
+        base = {(m["tamanho_corpus"], m["etapa"]): m for m in json.load(arquivo)["medicoes"]}
+    regressoes = []
+    for medicao in medicoes:
+        anterior = base.get((medicao["tamanho_corpus"], medicao["etapa"]))
+        if not anterior or not anterior.get("linhas_por_s") or not medicao.get("linhas_por_s"):
+            continue
+        variacao = medicao["linhas_por_s"] / anterior["linhas_por_s"] - 1
+        if variacao < -tolerancia:
+            regressoes.append({
+                "tamanho_corpus": medicao["tamanho_corpus"],
+                "etapa": medicao["etapa"],
+                "linhas_por_s_base": anterior["linhas_por_s"],
+                "linhas_por_s": medicao["linhas_por_s"],
+                "variacao": round(variacao, 3)
+            })
+    return regressoes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de ingestão, análise e exportação")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1000, 10000, 100000], help="Tamanhos dos corpora sintéticos")
+    parser.add_argument("--conversas-llm", type=int, default=200, help="Conversas analisadas via mock da OpenAI por corpus (0 desativa)")
+    parser.add_argument("--conversas-local", type=int, default=10000, help="Máximo de conversas na análise local por regras (0 = todas)")
+    parser.add_argument("--latencia-ms", type=float, default=50, help="Latência do mock até o primeiro token")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração das requisições respondidas com 429 pelo mock")
+    parser.add_argument("--retry-after", type=float, default=0, help="Retry-After (s) das respostas 429 do mock")
+    parser.add_argument("--taxa-json-invalido", type=float, default=0.0, help="Fração das respostas com JSON malformado do mock")
+    parser.add_argument("--taxa-lenta", type=float, default=0.0, help="Fração das requisições travadas pelo mock (cauda de latência)")
+    parser.add_argument("--latencia-lenta-ms", type=float, default=2000, help="Latência extra das requisições travadas")
+    parser.add_argument("--timeout-s", type=float, default=None, help="Prazo de cada requisição (padrão: o do SDK)")
+    parser.add_argument("--hedge-percentil", type=float, default=0, help="Percentil de latência que dispara a cópia (0 desativa)")
+    parser.add_argument("--hedge-orcamento", type=float, default=0.10, help="Máximo de cópias como fração das requisições")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", default=None, help="Arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Queda de throughput aceita na comparação (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # O mock precisa estar no ar antes de importar o app (o cliente lê OPENAI_BASE_URL)
+    configuracao_mock = ConfiguracaoMock(
+        args.latencia_ms, args.jitter_ms, args.taxa_429, args.retry_after, semente=args.semente,
+        taxa_json_invalido=args.taxa_json_invalido, taxa_lenta=args.taxa_lenta, latencia_lenta_ms=args.latencia_lenta_ms
+    )
+    servidor, base_url = iniciar_servidor(configuracao_mock)
+    os.environ["OPENAI_BASE_URL"] = base_url
+
+    import app
+
+    medicoes = []
+    for tamanho in args.tamanhos:
+        medicoes.extend(executar_benchmark(
+            app, tamanho, args.conversas_llm, args.conversas_local, args.semente,
+            args.timeout_s, args.hedge_percentil, args.hedge_orcamento
+        ))
+    servidor.shutdown()
+
+    relatorio = {
+        "versao_app": app.APP_VERSION,
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": vars(args),
+        "mock_openai": configuracao_mock.contadores,
+        "medicoes": medicoes
+    }
+
+    codigo_saida = 0
+    if args.comparar:
+        relatorio["regressoes"] = comparar_com_base(medicoes, args.comparar, args.tolerancia)
+        if relatorio["regressoes"]:
+            codigo_saida = 1
+            print(f"\n❌ {len(relatorio['regressoes'])} etapa(s) com queda de throughput acima de {args.tolerancia:.0%}", file=sys.stderr)
+        else:
+            print("\n✅ Nenhuma regressão de throughput", file=sys.stderr)
+
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+        print(f"\n💾 Resultado salvo em {args.saida}", file=sys.stderr)
+    else:
+        print(texto)
+    sys.exit(codigo_saida)
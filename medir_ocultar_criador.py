@@ -0,0 +1,163 @@
+"""
+Custo do script que oculta o crédito do criador, medido num navegador real (window.__custoOcultarCriador)
+
+Extrai o <script> injetado pelo app.py, monta uma página sintética com uma tabela de N linhas × 10 células
+e o rodapé "Created by Hugo Costa", adiciona páginas de 50 linhas (cada uma vira um callback do
+MutationObserver) e lê o custo acumulado pelo próprio script. Para comparação, mede na mesma página uma
+execução da varredura anterior (querySelectorAll('*') + textContent recursivo, repetida a cada segundo).
+
+Requer Playwright com Chromium:
+    pip install playwright && python -m playwright install chromium
+
+Uso:
+    python medir_ocultar_criador.py --linhas 500 2000 --saida custo_ocultar_criador.json
+    python medir_ocultar_criador.py --linhas 2000 --area-ignorada
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+try:
+    from playwright.sync_api import sync_playwright
+except ImportError:
+    sync_playwright = None
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+CELULAS_POR_LINHA = 10
+LINHAS_POR_PAGINA = 50
+
+# Varredura usada antes do MutationObserver (um tick do setInterval de 1 s, sem alterar estilos), para comparação na mesma página
+VARREDURA_ANTERIOR = """
+() => {
+    const textosParaOcultar = ['created by', 'hugo costa'];
+    function verificarElemento(elemento) {
+        const textoLower = (elemento.textContent || '').toLowerCase();
+        if (textosParaOcultar.some(texto => textoLower.includes(texto))) {
+            return;
+        }
+        for (const filho of elemento.children) {
+            verificarElemento(filho);
+        }
+    }
+    const inicio = performance.now();
+    document.querySelectorAll('*').forEach(verificarElemento);
+    return performance.now() - inicio;
+}
+"""
+
+ADICIONAR_PAGINA = """
+([inicio, linhas, celulas]) => {
+    const tabela = document.getElementById('tabela');
+    const pagina = document.createElement('tbody');
+    for (let i = inicio; i < inicio + linhas; i++) {
+        const linha = pagina.insertRow();
+        for (let c = 0; c < celulas; c++) {
+            linha.insertCell().innerHTML = `<div>linha ${i} coluna ${c} conversa com texto de exemplo</div>`;
+        }
+    }
+    tabela.appendChild(pagina);
+    // O callback do MutationObserver roda como microtarefa: esperar a próxima tarefa garante que já executou
+    return new Promise(resolver => setTimeout(resolver, 0));
+}
+"""
+
+def extrair_script_app(caminho_app: str) -> str:
+    """Conteúdo do <script> que o app injeta com st.markdown"""
+    with open(caminho_app, encoding="utf-8") as arquivo:
+        encontrado = re.search(r"<script>(.*?)</script>", arquivo.read(), re.DOTALL)
+    if not encontrado:
+        raise ValueError(f"Nenhum <script> encontrado em {caminho_app}")
+    return encontrado.group(1)
+
+def montar_pagina(linhas: int, area_ignorada: bool) -> str:
+    """Tabela de resultados (dentro ou fora de uma área ignorada pelo script) e rodapé com o crédito"""
+    celulas = "".join(
+        "<tr>" + "".join(f"<td><div>linha {i} coluna {c} conversa com texto de exemplo</div></td>" for c in range(CELULAS_POR_LINHA)) + "</tr>"
+        for i in range(linhas)
+    )
+    atributo = ' data-testid="stTable"' if area_ignorada else ""
+    return (
+        f'<html><body><div id="app"><div{atributo}><table id="tabela"><tbody>{celulas}</tbody></table></div></div>'
+        '<footer><div id="credito">Created by <a href="#">Hugo Costa</a></div></footer></body></html>'
+    )
+
+def medir(navegador, script: str, linhas: int, paginas: int, area_ignorada: bool) -> dict:
+    html = montar_pagina(linhas, area_ignorada)
+
+    # Script atual: varredura inicial ao carregar e um callback do observer por página adicionada
+    pagina = navegador.new_page()
+    pagina.set_content(html.replace("</body>", f"<script>{script}</script></body>"))
+    inicial = pagina.evaluate("() => ({...window.__custoOcultarCriador})")
+    elementos = pagina.evaluate("() => document.getElementsByTagName('*').length")
+    mutacoes = []
+    for indice in range(paginas):
+        pagina.evaluate(ADICIONAR_PAGINA, [linhas + indice * LINHAS_POR_PAGINA, LINHAS_POR_PAGINA, CELULAS_POR_LINHA])
+        mutacoes.append(pagina.evaluate("() => window.__custoOcultarCriador.ultimoMs"))
+    final = pagina.evaluate("() => ({...window.__custoOcultarCriador})")
+    credito_oculto = pagina.evaluate("() => getComputedStyle(document.getElementById('credito')).display === 'none'")
+    pagina.close()
+
+    # Varredura anterior sobre a mesma página (sem o script atual)
+    pagina = navegador.new_page()
+    pagina.set_content(html)
+    anterior = [pagina.evaluate(VARREDURA_ANTERIOR) for _ in range(3)]
+    pagina.close()
+
+    return {
+        "linhas_tabela": linhas,
+        "area_ignorada": area_ignorada,
+        "elementos": elementos,
+        "varredura_inicial_ms": round(inicial["ultimoMs"], 3),
+        "nos_texto_varredura_inicial": inicial["nosTexto"],
+        "mutacao_50_linhas_ms_media": round(sum(mutacoes) / len(mutacoes), 3) if mutacoes else None,
+        "mutacao_50_linhas_ms_max": round(max(mutacoes), 3) if mutacoes else None,
+        "execucoes": final["execucoes"],
+        "nos_texto_total": final["nosTexto"],
+        "varredura_anterior_ms_por_tick": round(sorted(anterior)[len(anterior) // 2], 3),
+        "credito_oculto": credito_oculto
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Custo do script que oculta o crédito do criador")
+    parser.add_argument("--linhas", type=int, nargs="+", default=[500, 2000], help="Linhas da tabela sintética")
+    parser.add_argument("--paginas", type=int, default=10, help="Páginas de 50 linhas adicionadas depois do carregamento")
+    parser.add_argument("--area-ignorada", action="store_true", help="Colocar a tabela dentro de uma área ignorada (stTable)")
+    parser.add_argument("--app", default=os.path.join(RAIZ, "app.py"))
+    parser.add_argument("--saida", default=None, help="Arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    if sync_playwright is None:
+        print("❌ Playwright não instalado. Execute: pip install playwright && python -m playwright install chromium", file=sys.stderr)
+        sys.exit(2)
+
+    script = extrair_script_app(args.app)
+    with sync_playwright() as playwright:
+        navegador = playwright.chromium.launch()
+        medicoes = []
+        for linhas in args.linhas:
+            medicao = medir(navegador, script, linhas, args.paginas, args.area_ignorada)
+            print(
+                f"  {linhas:>6} linhas ({medicao['elementos']} elementos): inicial {medicao['varredura_inicial_ms']} ms, "
+                f"mutação {medicao['mutacao_50_linhas_ms_media']} ms; varredura anterior {medicao['varredura_anterior_ms_por_tick']} ms/tick",
+                file=sys.stderr
+            )
+            medicoes.append(medicao)
+        versao = playwright.chromium.name + " " + navegador.version
+        navegador.close()
+
+    relatorio = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "navegador": versao,
+        "parametros": vars(args),
+        "medicoes": medicoes
+    }
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+        print(f"\n💾 Resultado salvo em {args.saida}", file=sys.stderr)
+    else:
+        print(texto)
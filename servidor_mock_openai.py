@@ -0,0 +1,367 @@
+"""
+Servidor local que imita o endpoint /v1/chat/completions da OpenAI (para benchmark e testes sem custo)
+
+Modos:
+    sintetico   vereditos determinísticos gerados localmente (padrão)
+    gravar      encaminha para a API real e grava cada resposta em um cassete JSON Lines
+    reproduzir  responde a partir do cassete, sem acessar a API (requisição não gravada → erro 400)
+
+Respostas 429, JSON malformado (truncado, campo com tipo errado, texto sem JSON) e respostas travadas (cauda de
+latência) são injetados nas frações configuradas; com --semente, a sequência de falhas é reproduzível.
+
+Uso:
+    python servidor_mock_openai.py --porta 8765 --latencia-ms 300 --taxa-429 0.05 --taxa-json-invalido 0.02 --semente 42
+    python servidor_mock_openai.py --modo gravar --cassete cassete.jsonl
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Motivos usados nos vereditos sintéticos (subconjunto da taxonomia do app)
+MOTIVOS_SINTETICOS = [
+    "STATUS_PEDIDO_ATRASADO",
+    "STATUS_PEDIDO_ENTREGUE_NAO_RECEBIDO",
+    "REEMBOLSO_OU_ESTORNO_ATRASADO",
+    "DETALHES_STATUS_TROCA_DEVOLUCAO",
+    "SOLICITACAO_CANCELAMENTO",
+    "PEDIDO_DIRETO_HUMANO"
+]
+
+class ConfiguracaoMock:
+    """Comportamento do servidor: latência, erros 429 e JSON malformado injetados e tamanho dos pedaços do streaming"""
+
+    def __init__(self, latencia_ms: float = 200, jitter_ms: float = 50, taxa_429: float = 0.0,
+                 retry_after_s: float = 1, tamanho_pedaco: int = 8, semente: int = None,
+                 modo: str = "sintetico", cassete: "CasseteRespostas" = None, upstream: str = "https://api.openai.com/v1",
+                 latencia_gravada: bool = True, taxa_json_invalido: float = 0.0, taxa_lenta: float = 0.0,
+                 latencia_lenta_ms: float = 10000):
+        self.modo = modo
+        self.cassete = cassete
+        self.upstream = upstream.rstrip("/")
+        self.latencia_gravada = latencia_gravada
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.taxa_429 = taxa_429
+        self.taxa_json_invalido = taxa_json_invalido
+        self.taxa_lenta = taxa_lenta
+        self.latencia_lenta_ms = latencia_lenta_ms
+        self.retry_after_s = retry_after_s
+        self.tamanho_pedaco = tamanho_pedaco
+        self.aleatorio = random.Random(semente)
+        self.trava = threading.Lock()
+        self.contadores = {
+            "requisicoes": 0, "respostas_429": 0, "respostas_ok": 0, "respostas_json_invalido": 0, "respostas_lentas": 0,
+            "gravadas": 0, "reproduzidas": 0, "nao_gravadas": 0
+        }
+
+    def sortear(self) -> float:
+        with self.trava:
+            return self.aleatorio.random()
+
+    def contar(self, chave: str) -> None:
+        with self.trava:
+            self.contadores[chave] += 1
+
+def gerar_veredito(mensagens) -> dict:
+    """Veredito determinístico a partir do conteúdo da requisição (a mesma conversa sempre recebe o mesmo veredito)"""
+    conteudo = json.dumps(mensagens, ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha256(conteudo.encode("utf-8")).digest()
+    transbordo = digest[0] % 3 == 0
+    veredito = {
+        "had_need_to_transfer": transbordo,
+        "motivo_transbordo": MOTIVOS_SINTETICOS[digest[1] % len(MOTIVOS_SINTETICOS)] if transbordo else None
+    }
+    # Prompt do modo cascata pede a confiança do veredito
+    if "confianca" in conteudo:
+        veredito["confianca"] = round(0.5 + (digest[2] % 50) / 100, 2)
+    return veredito
+
+def corromper_resposta(texto: str, sorteio: float) -> str:
+    """Versão malformada da resposta, como as que modelos e servidores reais devolvem de vez em quando"""
+    if sorteio < 0.25:
+        return texto[:max(len(texto) // 2, 1)]  # stream cortado no meio do objeto
+    if sorteio < 0.5:
+        return texto.rstrip("}") + ",}"  # vírgula sobrando (JSON inválido)
+    if sorteio < 0.75:
+        return texto.replace("true", '"sim"').replace("false", '"não"')  # campo booleano como texto
+    return "Desculpe, não consegui analisar esta conversa."  # resposta sem JSON
+
+class CasseteRespostas:
+    """Respostas gravadas da API real, indexadas pelo conteúdo da requisição (modelo, mensagens e formato)"""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.trava = threading.Lock()
+        self.respostas = {}
+        try:
+            with open(caminho, encoding="utf-8") as arquivo:
+                for linha in arquivo:
+                    if linha.strip():
+                        registro = json.loads(linha)
+                        self.respostas[registro["chave"]] = registro
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def chave(requisicao: dict) -> str:
+        canonica = json.dumps(
+            {campo: requisicao.get(campo) for campo in ("model", "messages", "response_format", "temperature")},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(canonica.encode("utf-8")).hexdigest()
+
+    def buscar(self, requisicao: dict) -> dict:
+        return self.respostas.get(self.chave(requisicao))
+
+    def gravar(self, requisicao: dict, texto: str, uso: dict, latencia_s: float) -> None:
+        registro = {"chave": self.chave(requisicao), "modelo": requisicao.get("model"), "texto": texto, "uso": uso, "latencia_s": round(latencia_s, 3)}
+        with self.trava:
+            self.respostas[registro["chave"]] = registro
+            with open(self.caminho, "a", encoding="utf-8") as arquivo:
+                arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+class ErroUpstream(Exception):
+    """Resposta de erro da API real repassada ao cliente no modo gravar"""
+
+    def __init__(self, status: int, corpo: bytes, cabecalhos: dict):
+        super().__init__(status)
+        self.status = status
+        self.corpo = corpo
+        self.cabecalhos = cabecalhos
+
+def encaminhar_para_api(configuracao: ConfiguracaoMock, requisicao: dict, autorizacao: str) -> tuple:
+    """Chama a API real sem streaming e retorna (texto, uso, latência)"""
+    corpo = dict(requisicao)
+    corpo.pop("stream", None)
+    corpo.pop("stream_options", None)
+    pedido = urllib.request.Request(
+        f"{configuracao.upstream}/chat/completions",
+        data=json.dumps(corpo).encode("utf-8"),
+        headers={"Content-Type": "application/json", "Authorization": autorizacao or ""},
+        method="POST"
+    )
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(pedido, timeout=120) as resposta:
+            dados = json.loads(resposta.read())
+    except urllib.error.HTTPError as erro:
+        raise ErroUpstream(erro.code, erro.read(), {"Retry-After": erro.headers.get("Retry-After")}) from erro
+    latencia = time.perf_counter() - inicio
+    return dados["choices"][0]["message"]["content"] or "", dados.get("usage"), latencia
+
+def calcular_uso(mensagens, texto_resposta: str) -> dict:
+    """Bloco usage no formato da API (tokens aproximados por 4 caracteres)"""
+    tokens_entrada = sum(len(m.get("content") or "") for m in mensagens) // 4 + 1
+    tokens_saida = len(texto_resposta) // 4 + 1
+    return {
+        "prompt_tokens": tokens_entrada,
+        "completion_tokens": tokens_saida,
+        "total_tokens": tokens_entrada + tokens_saida,
+        "prompt_tokens_details": {"cached_tokens": 0}
+    }
+
+class ServidorMock(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # O app fecha a conexão do streaming assim que o veredito chega: não é erro do servidor
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+def criar_handler(configuracao: ConfiguracaoMock):
+    class HandlerMock(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, formato, *args):
+            pass
+
+        def _responder_json(self, status: int, corpo: dict, cabecalhos: dict = None) -> None:
+            dados = json.dumps(corpo).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            for nome, valor in (cabecalhos or {}).items():
+                self.send_header(nome, valor)
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_POST(self):
+            tamanho = int(self.headers.get("Content-Length", 0))
+            requisicao = json.loads(self.rfile.read(tamanho) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._responder_json(404, {"error": {"message": f"Rota não suportada: {self.path}", "type": "invalid_request_error"}})
+                return
+
+            configuracao.contar("requisicoes")
+            if configuracao.sortear() < configuracao.taxa_429:
+                configuracao.contar("respostas_429")
+                self._responder_json(
+                    429,
+                    {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                    {"Retry-After": str(configuracao.retry_after_s)}
+                )
+                return
+
+            try:
+                texto, uso = self._obter_resposta(requisicao)
+            except ErroUpstream as erro:
+                self.send_response(erro.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(erro.corpo)))
+                for nome, valor in erro.cabecalhos.items():
+                    if valor:
+                        self.send_header(nome, valor)
+                self.end_headers()
+                self.wfile.write(erro.corpo)
+                return
+            if texto is None:
+                configuracao.contar("nao_gravadas")
+                self._responder_json(400, {"error": {
+                    "message": "Requisição não encontrada no cassete (grave novamente com --modo gravar)",
+                    "type": "invalid_request_error",
+                    "code": "nao_gravada"
+                }})
+                return
+            modelo = requisicao.get("model", "gpt-4o-mini")
+            id_resposta = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+            # No modo gravar o cassete guarda a resposta real; a corrupção só vale para o que é servido
+            if configuracao.taxa_json_invalido and configuracao.sortear() < configuracao.taxa_json_invalido:
+                texto = corromper_resposta(texto, configuracao.sortear())
+                configuracao.contar("respostas_json_invalido")
+            else:
+                configuracao.contar("respostas_ok")
+
+            if not requisicao.get("stream"):
+                self._responder_json(200, {
+                    "id": id_resposta,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": modelo,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+                    "usage": uso
+                })
+                return
+
+            # Streaming (SSE) em pedaços pequenos, como a API real
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            pedacos = [texto[i:i + configuracao.tamanho_pedaco] for i in range(0, len(texto), configuracao.tamanho_pedaco)]
+            try:
+                for posicao, pedaco in enumerate(pedacos):
+                    delta = {"content": pedaco}
+                    if posicao == 0:
+                        delta["role"] = "assistant"
+                    self._enviar_evento(id_resposta, modelo, delta, None)
+                self._enviar_evento(id_resposta, modelo, {}, "stop")
+                if (requisicao.get("stream_options") or {}).get("include_usage"):
+                    self._enviar_evento(id_resposta, modelo, None, None, uso)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # Cliente encerrou o streaming assim que recebeu os campos do veredito
+                pass
+
+        def _obter_resposta(self, requisicao: dict) -> tuple:
+            """Retorna (texto, uso) conforme o modo; texto None quando a requisição não está no cassete"""
+            if configuracao.modo == "sintetico":
+                self._aguardar_latencia()
+                texto = json.dumps(gerar_veredito(requisicao.get("messages", [])), ensure_ascii=False)
+                return texto, calcular_uso(requisicao.get("messages", []), texto)
+
+            registro = configuracao.cassete.buscar(requisicao)
+            if registro is not None:
+                configuracao.contar("reproduzidas")
+                if configuracao.latencia_gravada:
+                    time.sleep(registro["latencia_s"])
+                else:
+                    self._aguardar_latencia()
+                return registro["texto"], registro["uso"]
+            if configuracao.modo == "reproduzir":
+                return None, None
+
+            texto, uso, latencia = encaminhar_para_api(configuracao, requisicao, self.headers.get("Authorization"))
+            configuracao.cassete.gravar(requisicao, texto, uso, latencia)
+            configuracao.contar("gravadas")
+            return texto, uso
+
+        def _aguardar_latencia(self) -> None:
+            # Latência simulada até o primeiro token
+            atraso = configuracao.latencia_ms + configuracao.jitter_ms * (2 * configuracao.sortear() - 1)
+            # Cauda de latência: uma fração das requisições trava antes do primeiro token
+            if configuracao.taxa_lenta and configuracao.sortear() < configuracao.taxa_lenta:
+                atraso += configuracao.latencia_lenta_ms
+                configuracao.contar("respostas_lentas")
+            time.sleep(max(atraso, 0) / 1000)
+
+        def _enviar_evento(self, id_resposta: str, modelo: str, delta: dict, finish_reason, uso: dict = None) -> None:
+            evento = {
+                "id": id_resposta,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": modelo,
+                # O pedaço final de usage (stream_options include_usage) vem sem choices
+                "choices": [] if uso else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            if uso:
+                evento["usage"] = uso
+            self.wfile.write(f"data: {json.dumps(evento, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    return HandlerMock
+
+def iniciar_servidor(configuracao: ConfiguracaoMock = None, host: str = "127.0.0.1", porta: int = 0):
+    """Inicia o servidor em uma thread e retorna (servidor, base_url); porta 0 escolhe uma porta livre"""
+    configuracao = configuracao or ConfiguracaoMock()
+    servidor = ServidorMock((host, porta), criar_handler(configuracao))
+    servidor.configuracao = configuracao
+    threading.Thread(target=servidor.serve_forever, name="servidor-mock-openai", daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor mock da API de chat completions da OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--latencia-ms", type=float, default=200, help="Latência média até o primeiro token")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="Variação máxima (+/-) da latência")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração das requisições respondidas com 429 (0 a 1)")
+    parser.add_argument("--retry-after", type=float, default=1, help="Valor do cabeçalho Retry-After nas respostas 429")
+    parser.add_argument("--taxa-json-invalido", type=float, default=0.0, help="Fração das respostas com JSON malformado (0 a 1)")
+    parser.add_argument("--taxa-lenta", type=float, default=0.0, help="Fração das requisições com latência extra (cauda lenta)")
+    parser.add_argument("--latencia-lenta-ms", type=float, default=10000, help="Latência extra das requisições lentas")
+    parser.add_argument("--semente", type=int, default=None, help="Semente para tornar a injeção de erros reproduzível")
+    parser.add_argument("--modo", choices=["sintetico", "gravar", "reproduzir"], default="sintetico")
+    parser.add_argument("--cassete", default="cassete_openai.jsonl", help="Arquivo JSON Lines das respostas gravadas")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="API real usada no modo gravar")
+    parser.add_argument("--latencia-simulada", action="store_true", help="Na reprodução, usar --latencia-ms em vez da latência gravada")
+    args = parser.parse_args()
+
+    configuracao = ConfiguracaoMock(
+        args.latencia_ms, args.jitter_ms, args.taxa_429, args.retry_after, semente=args.semente,
+        modo=args.modo,
+        cassete=CasseteRespostas(args.cassete) if args.modo != "sintetico" else None,
+        upstream=args.upstream,
+        latencia_gravada=not args.latencia_simulada,
+        taxa_json_invalido=args.taxa_json_invalido,
+        taxa_lenta=args.taxa_lenta,
+        latencia_lenta_ms=args.latencia_lenta_ms
+    )
+    servidor = ServidorMock((args.host, args.porta), criar_handler(configuracao))
+    print(f"✅ Mock OpenAI em http://{args.host}:{args.porta}/v1 (modo {args.modo})")
+    print(f"   Use: OPENAI_BASE_URL=http://{args.host}:{args.porta}/v1 streamlit run app.py")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 {configuracao.contadores}")
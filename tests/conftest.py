@@ -0,0 +1,17 @@
+import logging
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# O app roda em modo "bare" do Streamlit ao ser importado: silenciar os avisos de contexto
+logging.disable(logging.WARNING)
+
+
+@pytest.fixture(scope="session")
+def app():
+    import app as modulo_app
+    return modulo_app
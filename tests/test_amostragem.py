@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+TAMANHO_POPULACAO = 20_000
+RETAILERS = 40
+DIAS = 30
+TAMANHO_AMOSTRA = 800
+SORTEIOS = 200
+
+
+@pytest.fixture(scope="module")
+def populacao():
+    """População sintética com taxas que variam por retailer, por dia e por risco (retailers de tamanhos desiguais)"""
+    aleatorio = np.random.default_rng(7)
+    pesos_retailer = aleatorio.pareto(1.2, RETAILERS) + 0.05
+    retailer = aleatorio.choice(RETAILERS, TAMANHO_POPULACAO, p=pesos_retailer / pesos_retailer.sum())
+    dia = aleatorio.integers(1, DIAS + 1, TAMANHO_POPULACAO)
+    risco_alto = aleatorio.random(TAMANHO_POPULACAO) < 0.2
+    taxa_retailer = aleatorio.beta(2, 12, RETAILERS)
+    taxa = np.clip(taxa_retailer[retailer] * (1 + 0.3 * np.sin(dia)) + np.where(risco_alto, 0.35, 0.0), 0, 1)
+    transbordo = aleatorio.random(TAMANHO_POPULACAO) < taxa
+    estratos = [
+        f"retailer {r} | {d:02d}/01/2026 | {'risco alto' if alto else 'risco baixo'}"
+        for r, d, alto in zip(retailer, dia, risco_alto)
+    ]
+    return estratos, transbordo
+
+
+def estimar(app, estratos, transbordo, semente):
+    consolidados = app.consolidar_estratos(estratos, TAMANHO_AMOSTRA)
+    amostra = app.sortear_amostra_estratificada(consolidados, TAMANHO_AMOSTRA, semente)
+    plano = {
+        "estrato": {numero: consolidados[numero - 1] for numero in amostra},
+        "tamanhos_estratos": pd.Series(consolidados).value_counts().to_dict()
+    }
+    df_resultados = pd.DataFrame({
+        "conversa_numero": amostra,
+        "acao_necessaria": [bool(transbordo[numero - 1]) for numero in amostra]
+    })
+    return app.estimar_taxas_populacao(df_resultados, plano, 0.95)
+
+
+def test_estratos_consolidados_comportam_o_minimo(app, populacao):
+    estratos, _ = populacao
+    tamanhos = pd.Series(app.consolidar_estratos(estratos, TAMANHO_AMOSTRA)).value_counts()
+    assert len(tamanhos) > 1
+    assert (TAMANHO_AMOSTRA * tamanhos / TAMANHO_POPULACAO >= app.MIN_AMOSTRA_POR_ESTRATO).all()
+
+
+def test_consolidar_estratos_preserva_estratos_grandes(app):
+    estratos = ["A | 01/01/2026 | risco baixo"] * 500 + ["B | 01/01/2026 | risco baixo"] * 3 + ["B | 02/01/2026 | risco alto"] * 2
+    consolidados = app.consolidar_estratos(estratos, 100)
+    assert consolidados[0] == "A | 01/01/2026 | risco baixo"
+    assert len(set(consolidados[500:])) == 1
+
+
+def test_intervalo_cobre_a_taxa_real(app, populacao):
+    estratos, transbordo = populacao
+    taxa_real = transbordo.mean()
+    cobertos = 0
+    for semente in range(SORTEIOS):
+        resumo = estimar(app, estratos, transbordo, semente)
+        assert resumo["estratos_sem_amostra"] == 0
+        taxa = resumo["taxas"]["transbordo"]
+        cobertos += taxa["ic_inferior"] <= taxa_real <= taxa["ic_superior"]
+    # 95% nominal: com 200 sorteios, abaixo de 91% indicaria intervalo estreito demais
+    assert cobertos / SORTEIOS >= 0.91
+
+
+def test_estrato_com_uma_conversa_nao_zera_variancia(app):
+    # A: 20 de 50 analisadas, metade com transbordo; B: 1 de 50, com transbordo (taxa de B praticamente desconhecida)
+    numeros = list(range(1, 22))
+    plano = {"estrato": {n: "A" if n <= 20 else "B" for n in numeros}, "tamanhos_estratos": {"A": 50, "B": 50}}
+    df_resultados = pd.DataFrame({"conversa_numero": numeros, "acao_necessaria": [n % 2 == 0 for n in range(20)] + [True]})
+    taxa = app.estimar_taxas_populacao(df_resultados, plano)["taxas"]["transbordo"]
+    assert taxa["estimativa"] == pytest.approx(0.75)
+    # Só a variância de A daria aproximadamente [0,66; 0,83]
+    assert taxa["ic_inferior"] < 0.6
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+
+def politica_aquecida(app, latencia=0.01):
+    politica = app.PoliticaHedge(0.95, 0.10, atraso_minimo_s=0.05)
+    for _ in range(app.MIN_AMOSTRAS_HEDGE):
+        politica.registrar_latencia(latencia)
+    return politica
+
+
+def requisicao_lenta_na_original(atraso_original):
+    def requisitar(cancelado, original):
+        inicio = time.perf_counter()
+        if original:
+            cancelado.wait(atraso_original)
+        return ("{}", None, None, time.perf_counter() - inicio)
+    return requisitar
+
+
+def test_rajada_inicial_permite_copia_logo_na_primeira_requisicao_lenta(app):
+    politica = politica_aquecida(app)
+    resultado = app.requisitar_com_hedge(requisicao_lenta_na_original(2.0), politica)
+    assert resultado[-1] == 1
+    assert politica.contadores["hedges_vencedores"] == 1
+    # A original perdeu a corrida: entra no percentil com o tempo até o cancelamento, não com a latência da cópia
+    assert max(politica.latencias) >= 0.05
+
+
+def test_latencia_de_falha_tambem_alimenta_o_percentil(app):
+    politica = politica_aquecida(app)
+
+    def requisitar(cancelado, original):
+        time.sleep(0.03)
+        raise app.ErroTempoEsgotado("prazo esgotado")
+
+    with pytest.raises(app.ErroTempoEsgotado):
+        app.requisitar_com_hedge(requisitar, politica)
+    assert len(politica.latencias) == app.MIN_AMOSTRAS_HEDGE + 1
+    assert politica.latencias[-1] >= 0.03
+
+
+def test_orcamento_limita_as_copias(app):
+    politica = politica_aquecida(app)
+    copias = sum(app.requisitar_com_hedge(requisicao_lenta_na_original(0.2), politica)[-1] for _ in range(10))
+    # Rajada inicial + 10% de crédito por requisição
+    assert copias <= app.RAJADA_HEDGE + 1
+    assert politica.contadores["hedges_negados"] > 0
+
+
+def test_atraso_fica_fora_da_cauda_quando_ela_ocupa_1_menos_percentil(app):
+    politica = app.PoliticaHedge(0.95, 0.10, atraso_minimo_s=0.05)
+    for latencia in [0.01] * 90 + [2.0] * 10:
+        politica.registrar_latencia(latencia)
+    assert politica.atraso_hedge() < 0.1
@@ -0,0 +1,47 @@
+import pytest
+
+
+@pytest.fixture
+def historico(app, tmp_path):
+    return app.HistoricoAnalises(str(tmp_path / "historico.db"))
+
+
+def gravar(app, historico, conversas, modelo):
+    resultados = [
+        {"conversa_numero": numero, "chat_id": "N/A", "had_need_to_transfer": False, "modelo_utilizado": modelo}
+        for numero in range(1, len(conversas) + 1)
+    ]
+    app.registrar_no_historico(historico, resultados, conversas)
+
+
+def separar(app, historico, conversas, modelos_aceitos):
+    itens = list(enumerate(conversas, 1))
+    # Sem CSV original: chave pelo hash do conteúdo
+    return app.separar_delta(itens, historico, modelos_aceitos=modelos_aceitos)
+
+
+def test_reaproveita_veredito_do_mesmo_modelo(app, historico):
+    conversas = ["CLIENTE - 01/01/2026 10:00 - oi", "CLIENTE - 01/01/2026 11:00 - quero trocar"]
+    gravar(app, historico, conversas, "gpt-4o")
+    pendentes, reaproveitados = separar(app, historico, conversas, app.modelos_aceitos_delta("gpt-4o"))
+    assert pendentes == []
+    assert [r["origem_veredito"] for r in reaproveitados] == ["histórico", "histórico"]
+
+
+def test_reanalisa_veredito_de_outro_modelo_ou_do_classificador(app, historico):
+    conversas = ["CLIENTE - 01/01/2026 10:00 - oi"]
+    gravar(app, historico, conversas, "gpt-4o-mini")
+    pendentes, reaproveitados = separar(app, historico, conversas, app.modelos_aceitos_delta("gpt-4o"))
+    assert len(pendentes) == 1 and reaproveitados == []
+
+    gravar(app, historico, conversas, "classificador 20261019-125330")
+    pendentes, _ = separar(app, historico, conversas, app.modelos_aceitos_delta("gpt-4o"))
+    assert len(pendentes) == 1
+
+
+def test_cascata_aceita_os_dois_modelos(app, historico):
+    conversas = ["CLIENTE - 01/01/2026 10:00 - oi"]
+    gravar(app, historico, conversas, "gpt-4o")
+    aceitos = app.modelos_aceitos_delta("gpt-4o-mini", modo_cascata=True, modelo_forte="gpt-4o")
+    pendentes, reaproveitados = separar(app, historico, conversas, aceitos)
+    assert pendentes == [] and len(reaproveitados) == 1
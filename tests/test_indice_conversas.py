@@ -0,0 +1,48 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import RAIZ
+
+CONSULTAS = [
+    "transferir", "atendente humano", "atend", "quero falar", "quero fal", "falar com",
+    "pedido", "não", "nao", "cartão de crédito", "cartao de cred", "obrigado pelo", "xyzinexistente", "humano atendente"
+]
+
+
+@pytest.fixture(scope="module")
+def conversas():
+    df = pd.read_csv(os.path.join(RAIZ, "conversas_analise.csv"), keep_default_na=False)
+    coluna = "Conversa" if "Conversa" in df.columns else "conversa"
+    return [str(texto) for texto in df[coluna]]
+
+
+def construir_sem_fts5(app, conversas, monkeypatch):
+    def conectar_sem_fts5(*args, **kwargs):
+        raise sqlite3.OperationalError("no such module: fts5")
+    monkeypatch.setattr(app.sqlite3, "connect", conectar_sem_fts5)
+    indice = app.construir_indice_conversas(conversas)
+    monkeypatch.undo()
+    return indice
+
+
+def test_fallback_em_memoria_retorna_os_mesmos_resultados_do_fts5(app, conversas, monkeypatch):
+    fts5 = app.construir_indice_conversas(conversas)
+    if fts5.motor != "SQLite FTS5":
+        pytest.skip("SQLite sem FTS5")
+    memoria = construir_sem_fts5(app, conversas, monkeypatch)
+    assert memoria.motor == "índice em memória"
+    for consulta in CONSULTAS:
+        assert memoria.buscar(consulta) == fts5.buscar(consulta), consulta
+
+
+def test_fallback_respeita_ordem_dos_termos_e_prefixo(app, monkeypatch):
+    memoria = construir_sem_fts5(app, ["quero falar com atendente", "atendente quero falar", "falando sozinho"], monkeypatch)
+    assert memoria.buscar("quero falar") == {1, 2}
+    assert memoria.buscar("falar com") == {1}
+    assert memoria.buscar("com falar") == set()
+    assert memoria.buscar("fal") == {1, 2, 3}
+    assert memoria.buscar("quero fal") == {1, 2}
+    assert memoria.buscar("Atendênte") == {1, 2}
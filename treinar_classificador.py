@@ -0,0 +1,195 @@
+"""
+Treino do classificador destilado a partir dos vereditos já produzidos pelo LLM
+
+Lê relatórios exportados pelo app (CSV ou Excel com as colunas conversa, acao_necessaria, motivo_transbordo e
+modelo_utilizado) e, opcionalmente, um CSV com rótulos humanos ("Necessidade de transbordo"). Treina uma regressão
+softmax sobre features de hashing (as mesmas de app.extrair_features_classificador), mede acurácia e cobertura
+numa validação separada e grava o artefato versionado em classificadores/classificador-AAAAMMDD-HHMMSS.npz.
+O app carrega sempre o artefato mais recente do diretório.
+
+Uso:
+    python treinar_classificador.py --resultados relatorio_jan.xlsx relatorio_fev.csv --modelo-professor gpt-4o
+    python treinar_classificador.py --resultados relatorio.csv --rotulados conversas_analise.csv --limiares 0.8 0.9 0.95
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# O app roda em modo "bare" do Streamlit ao ser importado: silenciar os avisos de contexto
+logging.disable(logging.WARNING)
+
+import app
+
+# Função para ler os exemplos (conversa, had_need_to_transfer, motivo) dos relatórios exportados
+def carregar_exemplos_resultados(caminhos: list, modelo_professor: str = None) -> list:
+    exemplos = []
+    for caminho in caminhos:
+        if caminho.lower().endswith((".xlsx", ".xls")):
+            df = pd.concat(pd.read_excel(caminho, sheet_name=None).values(), ignore_index=True)
+        else:
+            df = pd.read_csv(caminho, keep_default_na=False)
+        if "conversa" not in df.columns or "acao_necessaria" not in df.columns:
+            print(f"⚠️ {caminho}: sem as colunas conversa/acao_necessaria, ignorado", file=sys.stderr)
+            continue
+        modelos = df["modelo_utilizado"].astype(str) if "modelo_utilizado" in df.columns else [""] * len(df)
+        motivos = df["motivo_transbordo"] if "motivo_transbordo" in df.columns else ["N/A"] * len(df)
+        for conversa, acao, motivo, modelo in zip(df["conversa"], df["acao_necessaria"], motivos, modelos):
+            # Vereditos do próprio classificador não servem de professor
+            if modelo.startswith("classificador") or (modelo_professor and modelo != modelo_professor):
+                continue
+            transbordo = acao if isinstance(acao, bool) else str(acao).strip().lower() in ("true", "sim", "1")
+            motivo = str(motivo).strip()
+            exemplos.append({
+                "conversa": str(conversa),
+                "had_need_to_transfer": transbordo,
+                "motivo_transbordo": motivo if motivo in app.TAXONOMIA_MOTIVO_TRANSBORDO or motivo == "N/A" else None
+            })
+    return exemplos
+
+# Função para ler os rótulos humanos de transbordo (o motivo humano é texto livre e não entra no treino)
+def carregar_exemplos_rotulados(caminho: str) -> list:
+    df = pd.read_csv(caminho, keep_default_na=False)
+    coluna_conversa = "Conversa" if "Conversa" in df.columns else "conversa"
+    exemplos = []
+    for conversa, rotulo in zip(df[coluna_conversa], df["Necessidade de transbordo"]):
+        rotulo = str(rotulo).strip().lower()
+        if rotulo in ("sim", "não", "nao"):
+            exemplos.append({"conversa": str(conversa), "had_need_to_transfer": rotulo == "sim", "motivo_transbordo": None})
+    return exemplos
+
+# Função para vetorizar as conversas em blocos esparsos (CSR)
+def vetorizar(conversas: list, dimensao: int) -> tuple:
+    ponteiros, indices, valores = [0], [], []
+    for conversa in conversas:
+        indices_conversa, valores_conversa = app.extrair_features_classificador(conversa, dimensao)
+        indices.append(indices_conversa)
+        valores.append(valores_conversa)
+        ponteiros.append(ponteiros[-1] + len(indices_conversa))
+    return np.array(ponteiros), np.concatenate(indices), np.concatenate(valores)
+
+# Função para montar a matriz densa de um lote restrita às colunas (features) presentes nele
+def matriz_do_lote(matriz: tuple, linhas: np.ndarray) -> tuple:
+    ponteiros, indices, valores = matriz
+    partes = [np.arange(ponteiros[linha], ponteiros[linha + 1]) for linha in linhas]
+    posicoes = np.concatenate(partes)
+    colunas, inverso = np.unique(indices[posicoes], return_inverse=True)
+    densa = np.zeros((len(linhas), len(colunas)), dtype=np.float32)
+    densa[np.repeat(np.arange(len(linhas)), [len(parte) for parte in partes]), inverso] = valores[posicoes]
+    return colunas, densa
+
+# Função para treinar uma cabeça softmax com gradiente descendente em mini-lotes
+def treinar_softmax(matriz: tuple, alvos: np.ndarray, linhas: np.ndarray, n_classes: int, dimensao: int,
+                    epocas: int, taxa_aprendizado: float, regularizacao: float, tamanho_lote: int, semente: int) -> tuple:
+    pesos = np.zeros((dimensao, n_classes), dtype=np.float32)
+    vies = np.zeros(n_classes, dtype=np.float32)
+    aleatorio = np.random.default_rng(semente)
+    for _ in range(epocas):
+        ordem = aleatorio.permutation(linhas)
+        for inicio in range(0, len(ordem), tamanho_lote):
+            lote = ordem[inicio:inicio + tamanho_lote]
+            colunas, densa = matriz_do_lote(matriz, lote)
+            pontuacoes = densa @ pesos[colunas] + vies
+            pontuacoes -= pontuacoes.max(axis=1, keepdims=True)
+            probabilidades = np.exp(pontuacoes)
+            probabilidades /= probabilidades.sum(axis=1, keepdims=True)
+            probabilidades[np.arange(len(lote)), alvos[lote]] -= 1
+            gradiente = densa.T @ probabilidades / len(lote) + regularizacao * pesos[colunas]
+            pesos[colunas] -= taxa_aprendizado * gradiente
+            vies -= taxa_aprendizado * probabilidades.mean(axis=0)
+    return pesos, vies
+
+# Função para medir acurácia e cobertura por limiar na validação
+def avaliar_validacao(classificador: app.ClassificadorDestilado, exemplos: list, limiares: list) -> dict:
+    previsoes = [classificador.prever(exemplo["conversa"]) for exemplo in exemplos]
+    acertos_transbordo = [p["had_need_to_transfer"][0] == e["had_need_to_transfer"] for p, e in zip(previsoes, exemplos)]
+    com_motivo = [(p, e) for p, e in zip(previsoes, exemplos) if e["motivo_transbordo"] is not None and "motivo_transbordo" in p]
+    resumo = {
+        "exemplos": len(exemplos),
+        "acuracia_transbordo": round(float(np.mean(acertos_transbordo)), 4) if exemplos else None,
+        "acuracia_motivo": round(float(np.mean([p["motivo_transbordo"][0] == e["motivo_transbordo"] for p, e in com_motivo])), 4) if com_motivo else None,
+        "por_limiar": {}
+    }
+    # Cobertura = fração resolvida localmente; acurácia medida só nessas conversas
+    for limiar in limiares:
+        confiantes = [
+            acerto for p, acerto in zip(previsoes, acertos_transbordo)
+            if min(probabilidade for _, probabilidade in p.values()) >= limiar
+        ]
+        resumo["por_limiar"][str(limiar)] = {
+            "cobertura": round(len(confiantes) / len(exemplos), 4) if exemplos else None,
+            "acuracia_transbordo": round(float(np.mean(confiantes)), 4) if confiantes else None
+        }
+    return resumo
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Treina o classificador destilado dos vereditos do LLM")
+    parser.add_argument("--resultados", nargs="*", default=[], help="Relatórios exportados pelo app (CSV ou Excel)")
+    parser.add_argument("--rotulados", default=None, help="CSV com a coluna humana 'Necessidade de transbordo'")
+    parser.add_argument("--modelo-professor", default=None, help="Usar só vereditos deste modelo (ex.: gpt-4o)")
+    parser.add_argument("--dimensao", type=int, default=2 ** 18, help="Tamanho do espaço de hashing")
+    parser.add_argument("--epocas", type=int, default=20)
+    parser.add_argument("--taxa-aprendizado", type=float, default=2.0)
+    parser.add_argument("--regularizacao", type=float, default=1e-4)
+    parser.add_argument("--tamanho-lote", type=int, default=64)
+    parser.add_argument("--validacao", type=float, default=0.2, help="Fração dos exemplos separada para validação")
+    parser.add_argument("--limiares", type=float, nargs="+", default=[0.7, 0.8, 0.9, 0.95])
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida-dir", default=app.DIRETORIO_CLASSIFICADORES)
+    args = parser.parse_args()
+
+    exemplos = carregar_exemplos_resultados(args.resultados, args.modelo_professor)
+    if args.rotulados:
+        exemplos += carregar_exemplos_rotulados(args.rotulados)
+    if len(exemplos) < 10:
+        print(f"❌ Poucos exemplos para treinar ({len(exemplos)})", file=sys.stderr)
+        sys.exit(1)
+
+    random.Random(args.semente).shuffle(exemplos)
+    corte = int(len(exemplos) * (1 - args.validacao))
+    treino, validacao = exemplos[:corte], exemplos[corte:]
+
+    matriz = vetorizar([exemplo["conversa"] for exemplo in treino], args.dimensao)
+    parametros_treino = (args.dimensao, args.epocas, args.taxa_aprendizado, args.regularizacao, args.tamanho_lote, args.semente)
+    cabecas = {}
+
+    classes_transbordo = [False, True]
+    alvos = np.array([classes_transbordo.index(exemplo["had_need_to_transfer"]) for exemplo in treino])
+    cabecas["had_need_to_transfer"] = (*treinar_softmax(matriz, alvos, np.arange(len(treino)), 2, *parametros_treino), classes_transbordo)
+
+    # Motivo só com exemplos rotulados na taxonomia (inclui "N/A" para conversas sem transbordo)
+    com_motivo = np.array([i for i, exemplo in enumerate(treino) if exemplo["motivo_transbordo"] is not None], dtype=np.int64)
+    if len(com_motivo):
+        classes_motivo = sorted({treino[i]["motivo_transbordo"] for i in com_motivo})
+        alvos = np.zeros(len(treino), dtype=np.int64)
+        alvos[com_motivo] = [classes_motivo.index(treino[i]["motivo_transbordo"]) for i in com_motivo]
+        cabecas["motivo_transbordo"] = (*treinar_softmax(matriz, alvos, com_motivo, len(classes_motivo), *parametros_treino), classes_motivo)
+
+    treinado_em = datetime.now()
+    assinatura = hashlib.sha256(b"".join(pesos.tobytes() for pesos, _, _ in cabecas.values())).hexdigest()[:8]
+    metadados = {
+        "versao": f"{treinado_em:%Y%m%d-%H%M%S}-{assinatura}",
+        "treinado_em": treinado_em.isoformat(timespec="seconds"),
+        "versao_app": app.APP_VERSION,
+        "exemplos_treino": len(treino),
+        "exemplos_com_motivo": int(len(com_motivo)),
+        "fontes": args.resultados + ([args.rotulados] if args.rotulados else []),
+        "modelo_professor": args.modelo_professor,
+        "parametros": {campo: valor for campo, valor in vars(args).items() if campo not in ("resultados", "rotulados", "saida_dir")}
+    }
+    classificador = app.ClassificadorDestilado(args.dimensao, cabecas, metadados)
+    if validacao:
+        metadados["validacao"] = avaliar_validacao(classificador, validacao, args.limiares)
+
+    os.makedirs(args.saida_dir, exist_ok=True)
+    caminho = os.path.join(args.saida_dir, f"classificador-{treinado_em:%Y%m%d-%H%M%S}.npz")
+    classificador.salvar(caminho)
+    print(json.dumps(metadados, ensure_ascii=False, indent=2))
+    print(f"\n💾 Classificador salvo em {caminho}", file=sys.stderr)